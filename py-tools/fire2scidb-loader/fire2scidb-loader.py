@@ -29,47 +29,43 @@ import argparse
 import datetime
 import os
 import re
+import shutil
 import subprocess
+import sys
+import threading
+from multiprocessing.pool import ThreadPool
+
+try:
+    import Queue as queue
+except ImportError:
+    import queue
+
+#
+# the sparse encoder needs NumPy and GDAL's Python bindings,
+# the products converted by fire2scidb do not
+#
+try:
+    import numpy
+    from osgeo import gdal
+except ImportError:
+    numpy = None
+    gdal = None
+
+#
+# the product registry is shared with modis2scidb-loader
+#
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "modis2scidb-loader"))
+
+import productRegistry
+import scidbClient
+import convManifest
 
 #
 # change this for fine tuning
 #
 scidb_cluster_name = "focos"
 
-geo_arrays = {
-  "hotspot_daily": {
-        "file_extension": "tif",
-        "start_date": "2014-01-01",
-        "create_1d_array_cmd": "iquery -naq \"CREATE ARRAY hotspot_daily_1d_tmp <col:int16, row:int16, time_idx:int16, measure:uint8> [i=0:1410000,1410001,0];\"",
-        "tmp_array_1d": "hotspot_daily_1d_tmp",
-        "tmp_array_data_format": "'(int16, int16, int16, uint8)'",
-        "array_3d": "hotspot_daily"
-  },
-  "hotspot_monthly": {
-        "file_extension": "tif",
-        "start_date": "2000-01",
-        "create_1d_array_cmd": "iquery -naq \"CREATE ARRAY hotspot_monthly_1d_tmp <col:int16, row:int16, time_idx:int16, measure:uint8> [i=0:1410000,1410001,0];\"",
-        "tmp_array_1d": "hotspot_monthly_1d_tmp",
-        "tmp_array_data_format": "'(int16, int16, int16, uint8)'",
-        "array_3d": "hotspot_monthly"
-  },
-  "hotspot_risk_daily": {
-        "file_extension": "env",
-        "start_date": "2015-12-01",
-        "create_1d_array_cmd": "iquery -naq \"CREATE ARRAY hotspot_risk_daily_1d_tmp <col:int16, row:int16, time_idx:int16, measure:uint8> [i=0:29889971,29889972,0];\"",
-        "tmp_array_1d": "hotspot_risk_daily_1d_tmp",
-        "tmp_array_data_format": "'(int16, int16, int16, uint8)'",
-        "array_3d": "hotspot_risk_daily"
-  },
-  "hotspot_risk_monthly": {
-        "file_extension": "tif",
-        "start_date": "2015-01",
-        "create_1d_array_cmd": "iquery -naq \"CREATE ARRAY hotspot_risk_monthly_1d_tmp <col:int16, row:int16, time_idx:int16, high_risk:uint8, medium_risk:uint8, low_risk:uint8> [i=0:34979999,3498000,0];\"",
-        "tmp_array_1d": "hotspot_risk_monthly_1d_tmp",
-        "tmp_array_data_format": "'(int16, int16, int16, uint8, uint8, uint8)'",
-        "array_3d": "hotspot_risk_monthly"
-  }
-}
+geo_arrays = productRegistry.fireProducts
 
 def compute_monthly_time_index(year, month, initial_year):
     """Compute the time index for a monthly file.
@@ -132,6 +128,560 @@ def extract_time_point_from_file_name(file_name, initial_date):
 
     exit(1)
 
+
+def get_cells_per_file(geo_array):
+    """Returns the number of cells of the temporary 1D array, that is,
+       the most records a converted file can have."""
+
+    d = re.search(r"\[\s*\w+\s*=\s*(\d+)\s*:\s*(\d+)", geo_array["create_1d_array_afl"])
+
+    return int(d.group(2)) - int(d.group(1)) + 1
+
+
+def get_batch_size(geo_array):
+    """Returns the number of consecutive files loaded together:
+       as many as fit in the product's staging cell budget, at least 1."""
+
+    return max(1, geo_array["staging_cell_budget"] // get_cells_per_file(geo_array))
+
+
+def get_tmp_array_1d(geo_array, loader, batch=1):
+    """Returns the name of the temporary 1D array of a loader and the AFL creating it.
+       Loader 0 uses the product's array, the others get their own copy.
+       Arrays holding a batch of files are batch times longer and named after the batch size."""
+
+    tmp_array = geo_array["tmp_array_1d"]
+
+    create_afl = geo_array["create_1d_array_afl"]
+
+    if loader > 0:
+        tmp_array = "{0}_{1}".format(tmp_array, loader)
+
+    if batch > 1:
+        tmp_array = "{0}_x{1}".format(tmp_array, batch)
+
+        d = re.search(r"(\[\s*\w+\s*=\s*)(\d+)(\s*:\s*)(\d+)", create_afl)
+
+        start = int(d.group(2))
+
+        end = start + batch * get_cells_per_file(geo_array) - 1
+
+        create_afl = create_afl[:d.start()] + d.group(1) + d.group(2) + d.group(3) + str(end) + create_afl[d.end():]
+
+    return tmp_array, create_afl.replace(geo_array["tmp_array_1d"], tmp_array, 1)
+
+
+def create_tmp_arrays(scidb, geo_array, loaders, batch=1):
+    """Creates the temporary 1D arrays of the loaders that do not exist yet.
+       Every load replaces the content of the array, so they are reused for all the files."""
+
+    scidb_arrays = [row[0] for row in scidbClient.readQuery(scidb, "project(list('arrays'), name)")]
+
+    for loader in range(loaders):
+        tmp_array, create_afl = get_tmp_array_1d(geo_array, loader, batch)
+
+        if tmp_array not in scidb_arrays:
+            scidbClient.runQueries(scidb, [create_afl])
+
+
+def list_fire_files(source_dir, file_extension):
+    """Returns the files with the given extension found in the directory
+       and its subdirectories, sorted by path."""
+
+    res = []
+
+    for dir_path, dir_names, file_names in os.walk(source_dir):
+        for file_name in file_names:
+            if file_name.endswith(".{0}".format(file_extension)):
+                res.append(os.path.join(dir_path, file_name))
+
+    return sorted(res)
+
+
+def skip_loaded_files(fire_spot_files, manifest_path, data_product, geo_array):
+    """Returns the files not yet loaded to the 3D array according to the manifest:
+       the new ones and those changed (mtime or size) since they were loaded."""
+
+    manifest = convManifest.openManifest(manifest_path)
+
+    res = [f for f in fire_spot_files if not convManifest.isDone(manifest, f, data_product, geo_array["array_3d"])]
+
+    manifest.close()
+
+    print("Files already loaded: {0}.".format(len(fire_spot_files) - len(res)))
+
+    return res
+
+
+def get_loaded_time_indices(manifest_path, data_product, geo_array):
+    """Returns the time indices of the files recorded in the manifest, that is,
+       those inserted (or partly inserted) into the 3D array by previous runs."""
+
+    manifest = convManifest.openManifest(manifest_path)
+
+    res = set([row[0] for row in manifest.execute("SELECT DISTINCT time_id FROM conversions WHERE window = ? AND output = ?", (data_product, geo_array["array_3d"]))])
+
+    manifest.close()
+
+    return res
+
+
+def get_cleared_time_indices(fire_files, geo_array, loaded_time_indices):
+    """Returns the time indices of the files to clear from the 3D array before inserting them:
+       the sparse encoder does not write the cells that became zero, so the cells
+       of a time index loaded before would be kept."""
+
+    if geo_array.get("encoder", "fire2scidb") != "sparse" or len(loaded_time_indices) == 0:
+        return []
+
+    res = []
+
+    for fire_file in fire_files:
+        time_index = extract_time_point_from_file_name(os.path.basename(fire_file), geo_array["start_date"])
+
+        if time_index in loaded_time_indices:
+            res.append(time_index)
+
+    return res
+
+
+def record_loaded_files(fire_files, manifest_path, data_product, geo_array):
+    """Records in the manifest that the files were inserted into the 3D array."""
+
+    if manifest_path is None:
+        return
+
+    manifest = convManifest.openManifest(manifest_path)
+
+    for fire_file in fire_files:
+        convManifest.finishConversion(manifest, fire_file, data_product, geo_array["array_3d"], 0, True)
+
+    manifest.close()
+
+
+def get_record_types(geo_array):
+    """Returns the types of the records of the temporary 1D array:
+       col, row and time_idx followed by the measures, as in tmp_array_data_format."""
+
+    return [t.strip() for t in geo_array["tmp_array_data_format"].strip("'()").split(",")]
+
+
+def get_record_dtype(geo_array):
+    """Returns the NumPy type of the records of the temporary 1D array."""
+
+    types = get_record_types(geo_array)
+
+    names = ["col", "row", "time_idx"] + ["measure_{0}".format(i) for i in range(len(types) - 3)]
+
+    return numpy.dtype([(n, numpy.dtype(t).newbyteorder("<")) for n, t in zip(names, types)])
+
+
+def run_fire2scidb(fire_file, outfile_name, time_index):
+    """Converts a raster-file to SciDB binary using fire2scidb: a record for every cell.
+       Returns True on success."""
+
+    focos2scidb_cmd = "fire2scidb --f {0} --o {1} --t {2} --verbose".format(fire_file, outfile_name, time_index)
+
+    return subprocess.call(focos2scidb_cmd, shell=True) == 0
+
+
+def encode_sparse(fire_file, outfile_name, time_index, geo_array):
+    """Converts a raster-file to SciDB binary using NumPy, writing only the cells
+       where a band is neither zero nor nodata. The records have the same layout
+       and order (row by row) as the ones written by fire2scidb.
+       Returns the number of records written, or None on errors."""
+
+    if gdal is None:
+        print("Error converting file '{0}': the sparse encoder needs NumPy and GDAL's Python bindings.".format(fire_file))
+        return None
+
+    dataset = gdal.Open(fire_file)
+
+    if dataset is None:
+        print("Error converting file '{0}': could not open dataset.".format(fire_file))
+        return None
+
+    dtype = get_record_dtype(geo_array)
+
+    nmeasures = len(dtype.names) - 3
+
+    if dataset.RasterCount != nmeasures:
+        print("Error converting file '{0}': it has {1} band(s) but the product has {2} measure(s).".format(fire_file, dataset.RasterCount, nmeasures))
+        return None
+
+    bands = []
+
+    mask = None
+
+    for i in range(1, nmeasures + 1):
+        band = dataset.GetRasterBand(i)
+
+        data = band.ReadAsArray()
+
+        valid = data != 0
+
+        nodata = band.GetNoDataValue()
+
+        if nodata is not None:
+            valid &= data != nodata
+
+        mask = valid if mask is None else mask | valid
+
+        bands.append(data)
+
+    rows, cols = numpy.nonzero(mask)
+
+    records = numpy.empty(len(rows), dtype=dtype)
+
+    records["col"] = cols
+
+    records["row"] = rows
+
+    records["time_idx"] = time_index
+
+    for i, data in enumerate(bands):
+        records["measure_{0}".format(i)] = data[rows, cols]
+
+    records.tofile(outfile_name)
+
+    return len(records)
+
+
+def encode_fire_file(fire_file, outfile_name, time_index, geo_array):
+    """Converts a raster-file to SciDB binary with the product's encoder:
+       fire2scidb writes every cell, sparse only the cells with data.
+       Returns True on success."""
+
+    encoder = geo_array.get("encoder", "fire2scidb")
+
+    if encoder == "sparse":
+        return encode_sparse(fire_file, outfile_name, time_index, geo_array) is not None
+
+    return run_fire2scidb(fire_file, outfile_name, time_index)
+
+
+def benchmark_encoders(fire_spot_files, geo_array, output_dir):
+    """Converts the files with fire2scidb and with the sparse encoder
+       and prints the time and size of the binary files of each one."""
+
+    totals = {"fire2scidb": [0.0, 0], "sparse": [0.0, 0]}
+
+    for fire_file in fire_spot_files:
+        input_file_dir, input_file_name = os.path.split(fire_file)
+
+        try:
+            time_index = extract_time_point_from_file_name(input_file_name, geo_array["start_date"])
+        except SystemExit:
+            print("Error converting file '{0}': no valid date in its name.".format(fire_file))
+            continue
+
+        for encoder in ["fire2scidb", "sparse"]:
+            outfile_name = os.path.join(output_dir, input_file_name.replace(".{0}".format(geo_array["file_extension"]), ".{0}.scidb".format(encoder)))
+
+            if os.path.isfile(outfile_name):
+                os.remove(outfile_name)
+
+            t0 = datetime.datetime.now()
+
+            ok = encode_fire_file(fire_file, outfile_name, time_index, dict(geo_array, encoder=encoder))
+
+            seconds = (datetime.datetime.now() - t0).total_seconds()
+
+            if not ok:
+                continue
+
+            nbytes = os.path.getsize(outfile_name)
+
+            totals[encoder][0] += seconds
+
+            totals[encoder][1] += nbytes
+
+            print("{0}: {1} {2:.3f}s {3} bytes ({4} records).".format(fire_file, encoder, seconds, nbytes, nbytes // sum([productRegistry.typeSize[t] for t in get_record_types(geo_array)])))
+
+            os.remove(outfile_name)
+
+    for encoder in ["fire2scidb", "sparse"]:
+        print("Total {0}: {1:.3f}s {2} bytes.".format(encoder, totals[encoder][0], totals[encoder][1]))
+
+    if totals["sparse"][1] > 0:
+        print("Size ratio fire2scidb/sparse: {0:.1f}.".format(float(totals["fire2scidb"][1]) / totals["sparse"][1]))
+
+
+def convert_fire_file(fire_file, geo_array, output_dir, manifest_path=None, data_product=''):
+    """Converts a raster-file to SciDB binary using the product's encoder.
+       When a manifest is given, the file (fingerprint and time index) is recorded as started.
+       Returns the binary file name, or None on errors."""
+
+# extrac file name and select chronon
+    input_file_dir, input_file_name = os.path.split(fire_file)
+
+    outfile_name = os.path.join(output_dir, input_file_name.replace(".{0}".format(geo_array["file_extension"]), ".scidb"))
+
+    try:
+        time_index = extract_time_point_from_file_name(input_file_name, geo_array["start_date"])
+    except SystemExit:
+        print("Error converting file '{0}': no valid date in its name.".format(fire_file))
+        return None
+
+    if manifest_path is not None:
+        manifest = convManifest.openManifest(manifest_path)
+
+        convManifest.startConversion(manifest, fire_file, data_product, geo_array["array_3d"], 0, '', time_index)
+
+        manifest.close()
+
+# remove old binary file from target directory
+    if os.path.isfile(outfile_name):
+        os.remove(outfile_name)
+
+        print("Old file '{0}' removed. Generating new binary file... ".format(outfile_name))
+
+# convert raster-file to SciDB binary
+    if not encode_fire_file(fire_file, outfile_name, time_index, geo_array):
+        print("Error converting file '{0}' to {1}.".format(fire_file, outfile_name))
+        return None
+
+    return outfile_name
+
+
+def join_files(outfile_names):
+    """Concatenates the binary files of a batch, in order, into a single binary file
+       and returns its name. The binary format has no header, so it holds the records of all of them."""
+
+    if len(outfile_names) == 1:
+        return outfile_names[0]
+
+    batch_file_name = os.path.splitext(outfile_names[0])[0] + "_batch.scidb"
+
+    batch_file = open(batch_file_name, "wb")
+
+    for outfile_name in outfile_names:
+        f = open(outfile_name, "rb")
+
+        shutil.copyfileobj(f, batch_file, 16 * pow(2, 20))
+
+        f.close()
+
+    batch_file.close()
+
+    return batch_file_name
+
+
+def load_queries(geo_array, outfile_name, tmp_array, cleared_time_indices=()):
+    """Returns the queries loading a binary file to a temporary 1D array
+       and inserting data from temporary 1D to 3D. The cells of the given time indices
+       are deleted from the 3D array before the insert."""
+
+    res = ["load({0}, '{1}', -2, {2})".format(tmp_array, outfile_name, geo_array["tmp_array_data_format"])]
+
+    if len(cleared_time_indices) > 0:
+        res.append("delete({0}, {1})".format(geo_array["array_3d"], " or ".join(["time_idx = {0}".format(t) for t in cleared_time_indices])))
+
+    res.append("insert(redimension({2}, {1}), {0})".format(geo_array["array_3d"], geo_array["array_3d"], tmp_array))
+
+    return res
+
+
+def report_load_error(geo_array, outfile_name, e):
+    """Prints a failed load."""
+
+    print("Error loading file '{0}' to array 3D '{1}' ({2:.3f}s): {3}".format(outfile_name, geo_array["array_3d"], e.seconds, e.message))
+    print("Query: {0}".format(e.query))
+
+
+def load_batch(scidb, geo_array, outfile_names, tmp_array, cleared_time_indices=()):
+    """Loads a batch of consecutive binary files to a temporary 1D array with a single load
+       and inserts them into the 3D array with a single insert. Returns the timings of the queries."""
+
+    batch_file_name = join_files(outfile_names)
+
+    try:
+        timings = scidbClient.runQueries(scidb, load_queries(geo_array, batch_file_name, tmp_array, cleared_time_indices))
+    finally:
+        if batch_file_name not in outfile_names:
+            os.remove(batch_file_name)
+
+    return timings
+
+
+def run_pipeline(scidb, geo_array, fire_spot_files, output_dir, converters, loaders, queue_size, batch=1, manifest_path=None, data_product='', loaded_time_indices=()):
+    """Converts and loads the files at the same time: a pool of converters feeds a queue
+       of at most queue_size binary files (at least two batches) consumed by the loaders.
+       Each loader loads batches of consecutive files to its own temporary 1D array, but the inserts
+       into the 3D array keep the order of the files (time_idx).
+       The files inserted are recorded in the manifest, if any, and the time indices
+       loaded before (loaded_time_indices) are cleared first for the sparse encoder.
+       Returns False if a file could not be converted or loaded; the files after it are not inserted
+       and their binary files are removed."""
+
+# next: the batch to insert; failed: the first batch not loaded, if any
+    state = {"next": 0, "failed": None}
+    turn = threading.Condition()
+    stop = threading.Event()
+    lock = threading.Lock()
+
+# binary files converted but not loaded yet
+    pending = set()
+
+# a token per binary file that can wait to be loaded, taken in the order of the files
+    slots = queue.Queue()
+
+    for i in range(max(queue_size, 2 * batch)):
+        slots.put(None)
+
+    converted = queue.Queue()
+
+    def convert(fire_file):
+        outfile_name = None
+
+        if not stop.is_set():
+            outfile_name = convert_fire_file(fire_file, geo_array, output_dir, manifest_path, data_product)
+
+        if outfile_name is None:
+            slots.put(None)
+        else:
+            with lock:
+                pending.add(outfile_name)
+
+        return outfile_name
+
+    def after_failure(seq):
+        return state["failed"] is not None and state["failed"] < seq
+
+    def fail(seq):
+        with turn:
+            if state["failed"] is None or seq < state["failed"]:
+                state["failed"] = seq
+
+            turn.notify_all()
+
+        stop.set()
+
+    def load(loader):
+        tmp_array, create_afl = get_tmp_array_1d(geo_array, loader, batch)
+
+        while True:
+            seq, fire_files = converted.get()
+
+            if fire_files is None:
+                return
+
+            outfile_names = [o for f, o in fire_files]
+
+            outfile_name = None
+
+            try:
+                if not after_failure(seq):
+                    outfile_name = join_files(outfile_names)
+
+                    queries = load_queries(geo_array, outfile_name, tmp_array, get_cleared_time_indices([f for f, o in fire_files], geo_array, loaded_time_indices))
+
+                    timings = scidbClient.runQueries(scidb, queries[:1])
+
+# wait for the previous file to be inserted
+                with turn:
+                    while state["next"] != seq and not after_failure(seq):
+                        turn.wait()
+
+                if not after_failure(seq):
+                    timings = timings + scidbClient.runQueries(scidb, queries[1:])
+
+                    record_loaded_files([f for f, o in fire_files], manifest_path, data_product, geo_array)
+
+                    with lock:
+                        pending.difference_update(outfile_names)
+
+                    for f in outfile_names:
+                        print("File '{0}' loaded in {1:.3f}s.".format(f, sum([t["seconds"] for t in timings])))
+            except scidbClient.QueryError as e:
+                report_load_error(geo_array, outfile_name, e)
+                fail(seq)
+            except (IOError, OSError) as e:
+                print("Error loading file '{0}' to array 3D '{1}': {2}".format(outfile_name or ", ".join(outfile_names), geo_array["array_3d"], e))
+                fail(seq)
+            finally:
+# a batch failing before its turn must not skip the batches before it
+                with turn:
+                    if state["next"] == seq:
+                        state["next"] = seq + 1
+                        turn.notify_all()
+
+                if outfile_name is not None and outfile_name not in outfile_names and os.path.isfile(outfile_name):
+                    os.remove(outfile_name)
+
+                for f in outfile_names:
+                    slots.put(None)
+
+    threads = [threading.Thread(target=load, args=(loader,)) for loader in range(loaders)]
+
+    for t in threads:
+        t.daemon = True
+        t.start()
+
+    pool = ThreadPool(converters)
+
+    try:
+        seq = 0
+        fire_files = []
+
+# the files submitted to the converters, in order, with their results
+        submitted = []
+        i = 0
+
+        while not stop.is_set() and (i < len(fire_spot_files) or len(submitted) > 0):
+# a file waits for a token before its conversion starts, so the tokens cannot all be held
+# by later files while the file the batches wait for is not converted
+            if i < len(fire_spot_files) and not (len(submitted) > 0 and submitted[0][1].ready()):
+                try:
+                    slots.get(timeout=0 if len(submitted) > 0 else 0.5)
+                    submitted.append((fire_spot_files[i], pool.apply_async(convert, (fire_spot_files[i],))))
+                    i += 1
+                    continue
+                except queue.Empty:
+                    if len(submitted) == 0:
+                        continue
+
+            fire_file, result = submitted.pop(0)
+            outfile_name = result.get()
+
+# stop at the first file not converted; the files before it are still loaded
+            if outfile_name is None or stop.is_set():
+                stop.set()
+                break
+
+            fire_files.append((fire_file, outfile_name))
+
+            if len(fire_files) == batch:
+                converted.put((seq, fire_files))
+                seq += 1
+                fire_files = []
+
+# the files converted before a failure are still loaded; after a load failure the loaders skip them
+        if len(fire_files) > 0:
+            converted.put((seq, fire_files))
+    finally:
+        for t in threads:
+            converted.put((-1, None))
+
+        if stop.is_set():
+# the converters waiting for a free slot give up, the files not converted yet are dropped
+            pool.terminate()
+        else:
+            pool.close()
+
+        pool.join()
+
+    for t in threads:
+        t.join()
+
+# remove the binary files that will not be loaded
+    for outfile_name in pending:
+        if os.path.isfile(outfile_name):
+            os.remove(outfile_name)
+
+    return not stop.is_set()
+
+
 if __name__ == '__main__':
 
 #
@@ -153,6 +703,42 @@ if __name__ == '__main__':
                                     help="Temporary directory for converting TIFF files into SciDB binary data",
                                     required=True)
 
+    parser.add_argument("-s", "--shim",
+                        help="Comma separated URLs of SciDB's shim (i.e. http://localhost:8080). The queries run over one long-lived session instead of an iquery process each. Default = iquery",
+                        default="iquery")
+
+    parser.add_argument("--pipeline",
+                        help="Convert the next files while loading the previous ones",
+                        action="store_true")
+
+    parser.add_argument("--converters",
+                        help="Number of files converted at the same time by --pipeline. Default = 2",
+                        type=int, default=2)
+
+    parser.add_argument("--loaders",
+                        help="Number of files loaded at the same time by --pipeline, each one to its own temporary 1D array. The inserts into the 3D array keep the file order. Default = 1",
+                        type=int, default=1)
+
+    parser.add_argument("--queueSize",
+                        help="Maximum number of converted files waiting to be loaded by --pipeline, at least two batches. Default = 4",
+                        type=int, default=4)
+
+    parser.add_argument("-m", "--manifest",
+                        help="Manifest (SQLite file) of the files loaded. Only the new files and those changed since they were loaded are converted and loaded. See convManifest.py",
+                        default=None)
+
+    parser.add_argument("--batch",
+                        help="Number of consecutive files (time indices) loaded with a single load and insert. Default = 0, as many as fit in the product's staging_cell_budget",
+                        type=int, default=0)
+
+    parser.add_argument("-e", "--encoder",
+                        help="Encoder converting the files: fire2scidb writes every cell, sparse (NumPy and GDAL) only the cells that are neither zero nor nodata. Default = the product's encoder",
+                        choices=["fire2scidb", "sparse"], default=None)
+
+    parser.add_argument("--benchmark",
+                        help="Convert the files with both encoders, print their times and sizes, and exit without loading",
+                        action="store_true")
+
     args = parser.parse_args()
 
     source_dir = args.directory
@@ -161,82 +747,94 @@ if __name__ == '__main__':
 
     output_dir = args.outdir
 
-    geo_array = geo_arrays[data_product]
+    geo_array = dict(geo_arrays[data_product])
+
+    if args.encoder is not None:
+        geo_array["encoder"] = args.encoder
+
+    loaders = 1
+
+    if args.pipeline:
+        loaders = max(1, args.loaders)
+
+    scidb = scidbClient.openPool(args.shim, loaders)
 
     file_extension = geo_array["file_extension"]
 
+    batch = args.batch
+
+    if batch < 1:
+        batch = get_batch_size(geo_array)
+
+    manifest_path = args.manifest
+
 #
 # Search for input risk-fire files
 #
-    fire_spot_files = os.popen("find {0} -name *.{1} | sort".format(source_dir, file_extension)).read().split('\n')
+    fire_spot_files = list_fire_files(source_dir, file_extension)
+
+    if args.benchmark:
+        benchmark_encoders(fire_spot_files, geo_array, output_dir)
+        exit(0);
 
-    fire_spot_files.remove('')
+    loaded_time_indices = set()
+
+    if manifest_path is not None:
+        fire_spot_files = skip_loaded_files(fire_spot_files, manifest_path, data_product, geo_array)
+
+        loaded_time_indices = get_loaded_time_indices(manifest_path, data_product, geo_array)
 
 #
 # For each file we have found:
 # - let's check if its name is valid
 # - let's find if it is a monthly or daily data
 # - convert it to SciDB binary format
-# - load converted data to a 1D temporary array
+# - load converted data to a 1D temporary array (created once and reused)
 # - transform and insert 1D array into final 3D array
-# - remove temporary 1D array
 
     print("Converting risk-fire data...")
 
-    for fire_file in fire_spot_files:
-
-# extrac file name and select chronon
-         input_file_dir, input_file_name = os.path.split(fire_file)
-
-         outfile_name = os.path.join(output_dir, input_file_name.replace(".{0}".format(file_extension), ".scidb"))
-
-         time_index = extract_time_point_from_file_name(input_file_name, geo_array["start_date"])
-
-# remove old binary file from target directory
-         remove_old_bin_file_cmd = "rm {0}".format(outfile_name)
-
-         retcode = subprocess.call(remove_old_bin_file_cmd, shell=True)
-
-         if retcode == 0:
-             print("Old file '{0}' removed. Generating new binary file... ".format(outfile_name))
-
-# convert raster-file to SciDB binary
-         focos2scidb_cmd = "fire2scidb --f {0} --o {1} --t {2} --verbose".format(fire_file, outfile_name, time_index)
-
-         retcode = subprocess.call(focos2scidb_cmd, shell=True)
+# create the temporary 1D arrays once
+    try:
+        create_tmp_arrays(scidb, geo_array, loaders, batch)
+    except scidbClient.QueryError as e:
+        print("Error creating the temporary 1D array '{0}': {1}".format(geo_array["tmp_array_1d"], e.message))
+        exit(1);
 
-         if retcode != 0:
-             print("Error converting file '{0}' to {1}.".format(fire_file, outfile_name))
-             exit(1);
+    if args.pipeline:
+        if not run_pipeline(scidb, geo_array, fire_spot_files, output_dir, max(1, args.converters), loaders, max(1, args.queueSize), batch, manifest_path, data_product, loaded_time_indices):
+            exit(1);
+    else:
+        tmp_array, create_afl = get_tmp_array_1d(geo_array, 0, batch)
 
-# remove old 1D temporary array if any
-         drop_temp_1d_array_cmd = "iquery -naq \"remove({0});\"".format(geo_array["tmp_array_1d"])
+        for b in range(0, len(fire_spot_files), batch):
+            outfile_names = []
 
-         subprocess.call(drop_temp_1d_array_cmd, shell=True)
+            for fire_file in fire_spot_files[b:b + batch]:
 
-# create temporary 1D array
-         retcode = subprocess.call(geo_array["create_1d_array_cmd"], shell=True)
+                outfile_name = convert_fire_file(fire_file, geo_array, output_dir, manifest_path, data_product)
 
-         if retcode != 0:
-             print("Error creating temporary 1D array: '{0}'.".format(geo_array["create_1d_array_cmd"]))
-             exit(1);
+                if outfile_name is None:
+                    break
 
-# Load data to 1D temporary array
-         load_data_in_1d_array_cmd = "iquery -naq \"load({0}, '{1}', -2, {2});\"".format(geo_array["tmp_array_1d"], outfile_name, geo_array["tmp_array_data_format"])
+                outfile_names.append(outfile_name)
 
-         retcode = subprocess.call(load_data_in_1d_array_cmd, shell=True)
+# load the batch to the temporary 1D array and insert data from temporary 1D to 3D
+            if len(outfile_names) > 0:
+                try:
+                    timings = load_batch(scidb, geo_array, outfile_names, tmp_array, get_cleared_time_indices(fire_spot_files[b:b + len(outfile_names)], geo_array, loaded_time_indices))
+                except scidbClient.QueryError as e:
+                    report_load_error(geo_array, ", ".join(outfile_names), e)
+                    exit(1);
 
-         if retcode != 0:
-             print("Error loading file '{0}' to array 1D '{1}'.".format(outfile_name, tmp_array_1d))
-             exit(1);
+                record_loaded_files(fire_spot_files[b:b + len(outfile_names)], manifest_path, data_product, geo_array)
 
-# Insert data from temporary 1D to 3D
-         load_data_in_3d_array_cmd = "iquery -naq \"insert(redimension({2}, {1}), {0});\"".format(geo_array["array_3d"], geo_array["array_3d"], geo_array["tmp_array_1d"])
+                for outfile_name in outfile_names:
+                    print("File '{0}' loaded in {1:.3f}s.".format(outfile_name, sum([t["seconds"] for t in timings])))
 
-         retcode = subprocess.call(load_data_in_3d_array_cmd, shell=True)
+            if len(outfile_names) < len(fire_spot_files[b:b + batch]):
+                exit(1);
 
-         if retcode != 0:
-             print("Error converting 1D array '{0}' to 3D array '{1}'.".format(geo_array["tmp_array_1d"], geo_array["array_3d"]))
-             exit(1);
+    scidbClient.closePool(scidb)
 
     print("Converting risk-fire data... finished!")
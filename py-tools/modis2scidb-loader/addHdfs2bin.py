@@ -22,12 +22,20 @@
 #
 import os
 import sys
+import glob
+import time
 import argparse
+import multiprocessing
+import shutil
+import numpy as np
 from pyhdf.SD import SD
 from pyhdf.SD import SDC
-from array import array
 import datetime
 import logging
+import productRegistry
+import hdfCatalog
+import convManifest
+import loadMetrics
 
 #********************************************************
 # UTIL
@@ -90,15 +98,47 @@ def getHV(tile):
 
 def tile2grid(tile, resolution):
     '''Return the indexes (lonid, latid) of the upper left pixel of the image on the given tile'''
-    hv = map(int, getHV(tile))
+    hv = list(map(int, getHV(tile)))
     h = hv[0]
     v = hv[1]
     lonid = h * resolution
     latid = v * resolution
     return {'lonid':lonid, 'latid':latid}
 
-def addHdf2bin(hdfFilepath, bfpath, period, startyear, lineMin, lineMax, sampMin, sampMax):
-    '''Adds an HDF to a binary file and return its path'''
+def getRecordDtype(bandnames, banddatatype, layout = 'lltid'):
+    '''Returns the NumPy data type of a binary record: the indexes followed by the band values in the order they are stored in the HDF. The indexes are either encoded in a single value (layout lltid) or given as int64 col_id, row_id and time_id (layout dims)'''
+    fields = [('lltid', 'L')]
+    if layout == 'dims':
+        fields = [('col_id', 'q'), ('row_id', 'q'), ('time_id', 'q')]
+    for bandname in bandnames:
+        fields.append((bandname, banddatatype[bandname]))
+    return np.dtype(fields)
+
+def encodeBlock(rowdict, recdtype, bandnames, timid, deltalonid, deltalatid, rowFrom, sampMin, sampMax):
+    '''Returns an array of records for a block of rows. rowdict holds, for each band, the window (2D array) read from the HDF starting at the row rowFrom and the column sampMin'''
+    nrows = rowdict[bandnames[0]].shape[0]
+    ncols = sampMax - sampMin + 1
+    block = np.empty(nrows * ncols, dtype = recdtype)
+    if 'lltid' in recdtype.names:
+        lonid = np.arange(deltalonid + sampMin, deltalonid + sampMax + 1, dtype = np.uint64)
+        latid = np.arange(deltalatid + rowFrom, deltalatid + rowFrom + nrows, dtype = np.uint64)
+        lltid = lonid[np.newaxis, :] + latid[:, np.newaxis] * np.uint64(pow(10, 6)) + np.uint64(timid) * np.uint64(pow(10, 11)) # Encodes the indexes in a single value
+        block['lltid'] = lltid.ravel()
+    else:
+        cells = block.reshape(nrows, ncols)
+        cells['col_id'] = np.arange(deltalonid + sampMin, deltalonid + sampMax + 1, dtype = np.int64)[np.newaxis, :]
+        cells['row_id'] = np.arange(deltalatid + rowFrom, deltalatid + rowFrom + nrows, dtype = np.int64)[:, np.newaxis]
+        block['time_id'] = timid
+    for bandname in bandnames:
+        block[bandname] = rowdict[bandname].ravel()
+    return block
+
+def getRowsPerBlock(blockBytes, ncols, recsize):
+    '''Returns the number of rows of a block read at once from each band, given the memory (bytes) of a block of records'''
+    return max(1, blockBytes // (ncols * recsize))
+
+def openHdf(hdfFilepath, period, startyear, layout = 'lltid'):
+    '''Opens an HDF and returns a dictionary describing it: the opened SDSs, band names in file order, record data type (of the given record layout), time index and the indexes of the upper left pixel'''
 
 
     # Dictionary used to convert from a numeric data type to its symbolic representation - http://pysclint.sourceforge.net/pyhdf/pyhdf.SD.html
@@ -116,78 +156,358 @@ def addHdf2bin(hdfFilepath, bfpath, period, startyear, lineMin, lineMax, sampMin
         SDC.FLOAT64: 'FLOAT64'
     }
 
-    #TODO:Not yet tested to work with SciDB: CHAR, CHAR8, UCHAR8, INT8, UINT8, INT32, UINT32, FLOAT32, FLOAT64
-    typeTab2 = {
-        'CHAR': 'c',
-        'CHAR8': 'b',
-        'UCHAR8': 'B',
-        'INT8': 'h',
-        'UINT8': 'H',
-        'INT16': 'h',
-        'UINT16': 'H',
-        'INT32': 'l',
-        'UINT32': 'L',
-        'FLOAT32': 'f',
-        'FLOAT64': 'd'
-    }    
+    path, filename = os.path.split(hdfFilepath)
+    hdf = SD(hdfFilepath, SDC.READ)
+    ds = hdf.datasets()
+    reclayout = layout
+    layout = productRegistry.getHdfLayout(ds, typeTab) # Band order and types, cached for HDFs alike
+    bandres = layout['bandres']
+    banddict = {} # band values
+    for k in ds.keys():
+        banddict[k] = hdf.select(k)
+    #Get the temporal index
+    dateDOY = filename[9:16]
+    timid = int(date2grid(dateDOY, period, startyear))
+    if timid < 0:
+        raise Exception('Invalid time index')
+    #Get the spatial indexes
+    tile = filename[17:23]
+    #Test: All the bands have the same resolution
+    resolution = 0
+    firsttime = True
+    for k in bandres:
+        if bandres[k][0] != bandres[k][1]:
+            raise Exception('Band resolution mismatch')
+        if firsttime:
+            firsttime = False
+            resolution = bandres[k][0]
+    llid = tile2grid(tile, resolution)
+    return {
+        'hdf': hdf,
+        'banddict': banddict,
+        'bandnames': layout['bandnames'],
+        'recdtype': getRecordDtype(layout['bandnames'], layout['banddatatype'], reclayout),
+        'timid': timid,
+        'resolution': resolution,
+        'deltalonid': llid['lonid'],
+        'deltalatid': llid['latid']
+    }
 
-    try:
-        path, filename = os.path.split(hdfFilepath)
-        hdf = SD(hdfFilepath, SDC.READ)
-        ds = hdf.datasets()
-        banddict = {} # band values
-        banddatatype = {}
-        bandindex = {}# band index in the file
-        bandres = {} # band resolution e.g. (4800, 4800)
-        for k in ds.keys():
-            banddict[k] = hdf.select(k)
-            banddatatype[k] = typeTab2[typeTab[ds[k][2]]]
-            bandindex[ds[k][3]] = k
-            bandres[k] = ds[k][1]
-        sortedbandindexkeys = sorted(bandindex.keys())
-        #Get the temporal index
-        dateDOY = filename[9:16]
-        timid = date2grid(dateDOY, period, startyear)
-        #Get the spatial indexes
-        tile = filename[17:23]
-        #Test: All the bands have the same resolution
-        resolution = 0
-        firsttime = True
-        for k in bandres:
-            if bandres[k][0] != bandres[k][1]:
-                raise Exception('Band resolution mismatch')
-            if firsttime:
-                firsttime = False
-                resolution = bandres[k][0]
-        llid = tile2grid(tile, resolution)
-        deltalonid = llid['lonid']
-        deltalatid = llid['latid']
-        bfile = open(bfpath, "ab")
-        for i in range(lineMin, lineMax + 1):
-            rowdict = {}
-            for k in banddict.keys():
-                rowdict[k] = banddict[k][i, ]
-            latid = deltalatid + i
-            for j in range(sampMin, sampMax + 1):
-                lonid = deltalonid + j
-                idx = [lonid + (latid * pow(10, 6)) +  (timid * pow(10, 11))]# Encodes the indexes in a single value
-                idxa = array('L', idx)
-                #print str(lonid) + " "  + str(latid) + " " + str(timid) + " " + str(idx)
-                idxa.tofile(bfile) # Writes the coordinates to the file
-                #Get values
-                for k in sortedbandindexkeys:
-                    bandname = bandindex[k]
-                    val = [rowdict[bandname][j]]
-                    vala = array(banddatatype[bandname], val)
-                    vala.tofile(bfile) # Writes the band value to the file
+def checkWindow(hdfinfo, lineMin, lineMax, sampMin, sampMax):
+    '''Raises an exception if the given pixel window does not fit in the HDF'''
+    resolution = hdfinfo['resolution']
+    if lineMin < 0 or sampMin < 0 or lineMax >= resolution or sampMax >= resolution or lineMin > lineMax or sampMin > sampMax:
+        raise Exception('Invalid pixel window')
+
+def readBlocks(hdfinfo, lineMin, lineMax, sampMin, sampMax, blockBytes):
+    '''Yields the encoded records of the given pixel window, block by block. Each band is read as windows (hyperslabs) of about blockBytes of records'''
+    bandnames = hdfinfo['bandnames']
+    recdtype = hdfinfo['recdtype']
+    rowsPerBlock = getRowsPerBlock(blockBytes, sampMax - sampMin + 1, recdtype.itemsize)
+    for i in range(lineMin, lineMax + 1, rowsPerBlock):
+        rowTo = min(i + rowsPerBlock, lineMax + 1)
+        rowdict = {}
+        for k in bandnames:
+            rowdict[k] = hdfinfo['banddict'][k][i:rowTo, sampMin:sampMax + 1] # Reads only the window
+        yield encodeBlock(rowdict, recdtype, bandnames, hdfinfo['timid'], hdfinfo['deltalonid'], hdfinfo['deltalatid'], i, sampMin, sampMax)
+
+def readChunkBands(hdfinfo, lineMin, lineMax, sampMin, sampMax, geometry):
+    '''Yields the encoded records of the given pixel window ordered by destination chunk. geometry holds the chunk intervals of the destination array (see productRegistry.getChunkGeometry). For each band of rows sharing the same row chunk, it yields the row chunk index and a list of (column chunk index, records) pairs'''
+    bandnames = hdfinfo['bandnames']
+    colg = geometry['col_id']
+    rowg = geometry['row_id']
+    ncols = sampMax - sampMin + 1
+    colchunks = (np.arange(hdfinfo['deltalonid'] + sampMin, hdfinfo['deltalonid'] + sampMax + 1) - colg['start']) // colg['interval']
+    colsplits = [0] + list(np.flatnonzero(np.diff(colchunks)) + 1) + [ncols] # Window columns where a new chunk starts
+    i = lineMin
+    while i <= lineMax:
+        rowid = hdfinfo['deltalatid'] + i
+        rowchunk = (rowid - rowg['start']) // rowg['interval']
+        rowTo = min(lineMax + 1, i + rowg['start'] + (rowchunk + 1) * rowg['interval'] - rowid)
+        rowdict = {}
+        for k in bandnames:
+            rowdict[k] = hdfinfo['banddict'][k][i:rowTo, sampMin:sampMax + 1] # Reads only the window
+        block = encodeBlock(rowdict, hdfinfo['recdtype'], bandnames, hdfinfo['timid'], hdfinfo['deltalonid'], hdfinfo['deltalatid'], i, sampMin, sampMax).reshape(rowTo - i, ncols)
+        chunks = []
+        for j in range(len(colsplits) - 1):
+            chunks.append((int(colchunks[colsplits[j]]), block[:, colsplits[j]:colsplits[j + 1]].ravel()))
+        yield rowchunk, chunks
+        i = rowTo
+
+def getChunkFilepath(bfpath, colchunk, rowchunk):
+    '''Returns the path to the binary file of a destination chunk i.e. /path/file_c3_r7.sdbbin for /path/file.sdbbin'''
+    root, ext = os.path.splitext(bfpath)
+    return root + '_c' + str(colchunk) + '_r' + str(rowchunk) + ext
+
+def getChunkInstance(geometry, colchunk, rowchunk, instances):
+    '''Returns the instance (0..instances - 1) loading a destination chunk. The chunks are dealt round-robin in row-major order'''
+    colg = geometry['col_id']
+    ncolchunks = 1
+    if colg['end'] is not None:
+        ncolchunks = (colg['end'] - colg['start']) // colg['interval'] + 1
+    return (rowchunk * ncolchunks + colchunk) % instances
+
+def getPartitionFilepath(bfpath, instance):
+    '''Returns the path to the binary file loaded by an instance i.e. /path/file_i3.sdbbin for /path/file.sdbbin'''
+    root, ext = os.path.splitext(bfpath)
+    return root + '_i' + str(instance) + ext
+
+def getFileSize(filepath):
+    '''Returns the size of a file or 0 if it does not exist'''
+    res = 0
+    if os.path.isfile(filepath):
+        res = os.path.getsize(filepath)
+    return res
+
+def truncateFile(filepath, size):
+    '''Drops the bytes of a file after the given size'''
+    if os.path.isfile(filepath) and os.path.getsize(filepath) > size:
+        bfile = open(filepath, "r+b")
+        bfile.truncate(size)
         bfile.close()
+
+def addHdf2bin(hdfFilepath, bfpath, period, startyear, lineMin, lineMax, sampMin, sampMax, blockBytes = 64 * pow(2, 20), layout = 'lltid', geometry = None, chunkFiles = False, partitions = 0):
+    '''Adds an HDF to a binary file and return its path. Each band is read as windows (hyperslabs) of lineMin..lineMax x sampMin..sampMax of about blockBytes of records. When the destination chunk geometry is given, the records are written chunk by chunk and, if chunkFiles is TRUE, to a binary file per chunk (see getChunkFilepath) or, if partitions > 0, to a binary file per loading instance (see getPartitionFilepath). On errors, the records already added are dropped'''
+    offsets = {bfpath: getFileSize(bfpath)} # Initial size of the files written
+    try:
+        hdfinfo = openHdf(hdfFilepath, period, startyear, layout)
+        checkWindow(hdfinfo, lineMin, lineMax, sampMin, sampMax)
+        if geometry is None:
+            bfile = open(bfpath, "ab")
+            for block in readBlocks(hdfinfo, lineMin, lineMax, sampMin, sampMax, blockBytes):
+                block.tofile(bfile) # Writes the coordinates and band values of the whole block to the file
+            bfile.close()
+        else:
+            bfiles = {} # Open files
+            if partitions > 0 and not chunkFiles:
+                #Every instance gets its file, even if no chunk of the window is dealt to it
+                for i in range(partitions):
+                    pfpath = getPartitionFilepath(bfpath, i)
+                    offsets[pfpath] = getFileSize(pfpath)
+                    open(pfpath, "ab").close()
+            for rowchunk, chunks in readChunkBands(hdfinfo, lineMin, lineMax, sampMin, sampMax, geometry):
+                for colchunk, records in chunks:
+                    cfpath = bfpath
+                    if chunkFiles:
+                        cfpath = getChunkFilepath(bfpath, colchunk, rowchunk)
+                    elif partitions > 0:
+                        cfpath = getPartitionFilepath(bfpath, getChunkInstance(geometry, colchunk, rowchunk, partitions))
+                    if cfpath not in bfiles:
+                        if cfpath not in offsets:
+                            offsets[cfpath] = getFileSize(cfpath)
+                        bfiles[cfpath] = open(cfpath, "ab")
+                    records.tofile(bfiles[cfpath])
+                if chunkFiles:
+                    #A chunk file is complete once its band of rows is done
+                    for cfile in bfiles.values():
+                        cfile.close()
+                    bfiles = {}
+            for cfile in bfiles.values():
+                cfile.close()
+        hdfinfo['hdf'].end()
     except IOError as e:
-        logging.exception("IOError:\n" + str(e.message) + " " + hdfFilepath)
+        logging.exception("IOError:\n" + str(e) + " " + hdfFilepath)
+        for fp in offsets:
+            truncateFile(fp, offsets[fp])
     except:
-        e = sys.exc_info()[0]
-        logging.exception("Unknown exception:\n" + str(e.message) + " " + hdfFilepath)
+        e = sys.exc_info()[1]
+        logging.exception("Unknown exception:\n" + str(e) + " " + hdfFilepath)
+        for fp in offsets:
+            truncateFile(fp, offsets[fp])
     return bfpath
 
+def convertRowBand(task):
+    '''Converts a band of rows of an HDF and writes it straight to its place (byte offset) in a preallocated binary file. It returns the number of records written'''
+    hdfFilepath, bfpath, offset, period, startyear, rowFrom, rowTo, sampMin, sampMax, blockBytes, layout = task
+    hdfinfo = openHdf(hdfFilepath, period, startyear, layout)
+    nrecs = (rowTo - rowFrom + 1) * (sampMax - sampMin + 1)
+    out = np.memmap(bfpath, dtype = hdfinfo['recdtype'], mode = 'r+', offset = offset, shape = (nrecs,))
+    pos = 0
+    for block in readBlocks(hdfinfo, rowFrom, rowTo, sampMin, sampMax, blockBytes):
+        out[pos:pos + len(block)] = block
+        pos = pos + len(block)
+    out.flush()
+    del out
+    hdfinfo['hdf'].end()
+    return nrecs
+
+def addHdf2binParallel(hdfFilepath, bfpath, period, startyear, lineMin, lineMax, sampMin, sampMax, processes, blockBytes = 64 * pow(2, 20), layout = 'lltid'):
+    '''Adds an HDF to a binary file and return its path. The file is extended by the size of the pixel window and bands of rows are converted by a pool of processes, each one writing to its own offset of the memory-mapped file'''
+    offset0 = -1
+    try:
+        hdfinfo = openHdf(hdfFilepath, period, startyear, layout)
+        checkWindow(hdfinfo, lineMin, lineMax, sampMin, sampMax)
+        recsize = hdfinfo['recdtype'].itemsize
+        hdfinfo['hdf'].end()
+        ncols = sampMax - sampMin + 1
+        nrows = lineMax - lineMin + 1
+        #Preallocate the output: pixels x (the index and band item sizes)
+        if not os.path.isfile(bfpath):
+            open(bfpath, "wb").close()
+        offset0 = os.path.getsize(bfpath)
+        bfile = open(bfpath, "r+b")
+        bfile.truncate(offset0 + nrows * ncols * recsize)
+        bfile.close()
+        #Split the rows in bands. Use at least one band per process
+        rowsPerBand = min(getRowsPerBlock(blockBytes, ncols, recsize), -(-nrows // processes))
+        tasks = []
+        for i in range(lineMin, lineMax + 1, rowsPerBand):
+            rowTo = min(i + rowsPerBand, lineMax + 1) - 1
+            offset = offset0 + (i - lineMin) * ncols * recsize
+            tasks.append((hdfFilepath, bfpath, offset, period, startyear, i, rowTo, sampMin, sampMax, blockBytes, layout))
+        pool = multiprocessing.Pool(processes)
+        try:
+            pool.map(convertRowBand, tasks)
+        finally:
+            pool.close()
+            pool.join()
+    except:
+        e = sys.exc_info()[1]
+        logging.exception("Exception:\n" + str(e) + " " + hdfFilepath)
+        if offset0 >= 0:
+            #Drop the preallocated records
+            truncateFile(bfpath, offset0)
+    return bfpath
+
+def convertHdf(hdfFilepath, bfpath, period, startyear, lineMin, lineMax, sampMin, sampMax, blockBytes, rowJobs, layout = 'lltid', geometry = None, chunkFiles = False, partitions = 0):
+    '''Adds an HDF to a binary file using rowJobs processes and return its path. Records ordered by destination chunk are written by a single process'''
+    if rowJobs > 1 and geometry is None:
+        return addHdf2binParallel(hdfFilepath, bfpath, period, startyear, lineMin, lineMax, sampMin, sampMax, rowJobs, blockBytes, layout)
+    return addHdf2bin(hdfFilepath, bfpath, period, startyear, lineMin, lineMax, sampMin, sampMax, blockBytes, layout, geometry, chunkFiles, partitions)
+
+def listHdfs(hdfFilepaths, catalog = None):
+    '''Returns the paths to the HDFs given as paths separated by ';' or as folders containing them. When a catalog is given, the HDFs in the folders are found there instead of listing them'''
+    res = []
+    hpaths = hdfFilepaths.split(';')
+    for hp in hpaths:
+        if os.path.isfile(hp):
+            if hp.endswith('.hdf'):
+                res.append(hp)
+            else:
+                logging.warning('Unknown file type: ' + hp)
+        elif os.path.isdir(hp) and catalog is not None:
+            hdfCatalog.refreshCatalog(catalog, hp)
+            res.extend(hdfCatalog.listHdfs(catalog, hp, False))
+        elif os.path.isdir(hp):
+            for (dirpath, dirnames, filenames) in os.walk(hp):
+                for fn in filenames:
+                    if fn.endswith('.hdf'):
+                        res.append(dirpath + '/' + fn)
+                    else:
+                        logging.warning('Unknown file type: ' + fn)
+                break
+    return res
+
+def convertSegment(task):
+    '''Adds an HDF to its own segment file and return the segment path and the seconds it took'''
+    hdfFilepath, segpath, period, startyear, lineMin, lineMax, sampMin, sampMax, blockBytes, layout, geometry = task
+    t0 = time.time()
+    if os.path.isfile(segpath):
+        os.remove(segpath)
+    return (addHdf2bin(hdfFilepath, segpath, period, startyear, lineMin, lineMax, sampMin, sampMax, blockBytes, layout, geometry), time.time() - t0)
+
+def getOutputSize(bfpath, chunkFiles = False, partitions = 0):
+    '''Returns the size (bytes) of a binary file or of its files per chunk or per loading instance'''
+    if partitions > 0:
+        return sum([getFileSize(getPartitionFilepath(bfpath, i)) for i in range(partitions)])
+    if chunkFiles:
+        root, ext = os.path.splitext(bfpath)
+        return sum([getFileSize(cf) for cf in glob.glob(root + '_c*_r*' + ext)])
+    return getFileSize(bfpath)
+
+def appendSegment(segpath, bfpath):
+    '''Appends a segment file to a binary file, removes it and returns the number of bytes appended'''
+    res = 0
+    if os.path.isfile(segpath):
+        bfile = open(bfpath, "ab")
+        segfile = open(segpath, "rb")
+        shutil.copyfileobj(segfile, bfile, 16 * pow(2, 20))
+        segfile.close()
+        bfile.close()
+        res = os.path.getsize(segpath)
+        os.remove(segpath)
+    return res
+
+def describeHdf(hdfFilepath, period, startyear):
+    '''Returns the bands (of the product guessed from the path, if any) and the time index of an HDF, as recorded in the conversion manifest'''
+    bands = ''
+    prod = productRegistry.guessProduct(hdfFilepath)
+    if prod is not None:
+        bands = ','.join([bandname for bandname, bandtype in productRegistry.getProduct(prod)['bands']])
+    try:
+        timid = int(date2grid(os.path.basename(hdfFilepath)[9:16], period, startyear))
+    except (ValueError, ZeroDivisionError):
+        timid = -1
+    return (bands, timid)
+
+def recordConversion(metrics, hdfFilepath, bfpath, nbytes, seconds, layout, windowPixels):
+    '''Records the conversion of an HDF in the metrics (see loadMetrics.py). Conversions writing no bytes (the errors drop the records written) are labeled as failed. Otherwise a record of the HDF's own record type was written for every pixel of the window'''
+    status = 'ok'
+    if nbytes < 1:
+        status = 'failed'
+    pixels = 0
+    if nbytes > 0:
+        pixels = windowPixels
+    loadMetrics.record(metrics, 'convert', {'hdf': hdfFilepath, 'output': bfpath, 'bytes': nbytes, 'pixels': pixels, 'seconds': seconds}, {'layout': layout, 'status': status})
+
+def addHdfs2bin(hdfPaths, bfpath, period, startyear, lineMin, lineMax, sampMin, sampMax, blockBytes, rowJobs, jobs, manifest = None, layout = 'lltid', geometry = None, chunkFiles = False, partitions = 0, metrics = None):
+    '''Adds the HDFs, in the given order, to a binary file of the given record layout (see getRecordDtype) and return the number of HDFs added. When jobs > 1, the HDFs are converted by a pool of processes to segment files which are then joined in order. When a manifest (see convManifest.py) is given, the HDFs already converted to the binary file are skipped. When the destination chunk geometry is given, each HDF's records are ordered chunk by chunk, optionally to a binary file per chunk or per loading instance. The conversion of each HDF is recorded in the metrics (see loadMetrics.py)'''
+    hdfcount = 0
+    pixels = (lineMax - lineMin + 1) * (sampMax - sampMin + 1)
+    if (chunkFiles or partitions > 0) and (manifest is not None or jobs > 1):
+        logging.warning("Binary files per chunk or instance are written by a single process and without manifest")
+        manifest = None
+        jobs = 1
+    window = convManifest.buildWindow(lineMin, lineMax, sampMin, sampMax, layout)
+    if manifest is not None:
+        convManifest.recoverOutput(manifest, bfpath)
+        todo = []
+        for hp in hdfPaths:
+            if convManifest.isDone(manifest, hp, window, bfpath):
+                logging.info('HDF: ' + hp + ' already added to: ' + bfpath)
+            else:
+                todo.append(hp)
+        convManifest.dropStale(manifest, todo, window, bfpath)
+        hdfPaths = todo
+    if jobs > 1 and len(hdfPaths) > 1:
+        tasks = []
+        for i in range(len(hdfPaths)):
+            segpath = bfpath + '.' + str(i) + '.part'
+            tasks.append((hdfPaths[i], segpath, period, startyear, lineMin, lineMax, sampMin, sampMax, blockBytes, layout, geometry))
+        pool = multiprocessing.Pool(min(jobs, len(tasks)))
+        try:
+            converted = pool.map(convertSegment, tasks)
+        finally:
+            pool.close()
+            pool.join()
+        #Join the segments in order. Each HDF is recorded as started at its offset before its segment is appended, so the bytes of an interrupted join are dropped by the next run
+        for i in range(len(hdfPaths)):
+            hp = hdfPaths[i]
+            if manifest is not None:
+                bands, timid = describeHdf(hp, period, startyear)
+                convManifest.startConversion(manifest, hp, window, bfpath, getFileSize(bfpath), bands, timid)
+            nbytes = appendSegment(converted[i][0], bfpath)
+            if manifest is not None:
+                convManifest.finishConversion(manifest, hp, window, bfpath, nbytes)
+            recordConversion(metrics, hp, bfpath, nbytes, converted[i][1], layout, pixels)
+            logging.info('HDF: ' + hp + ' added to: ' + bfpath)
+            hdfcount += 1
+    else:
+        for hp in hdfPaths:
+            t0 = time.time()
+            offset = getFileSize(bfpath)
+            outsize = getOutputSize(bfpath, chunkFiles, partitions)
+            if manifest is not None:
+                bands, timid = describeHdf(hp, period, startyear)
+                convManifest.startConversion(manifest, hp, window, bfpath, offset, bands, timid)
+            tmp = convertHdf(hp, bfpath, period, startyear, lineMin, lineMax, sampMin, sampMax, blockBytes, rowJobs, layout, geometry, chunkFiles, partitions)
+            if manifest is not None:
+                convManifest.finishConversion(manifest, hp, window, bfpath, getFileSize(bfpath) - offset)
+            recordConversion(metrics, hp, bfpath, getOutputSize(bfpath, chunkFiles, partitions) - outsize, time.time() - t0, layout, pixels)
+            logging.info('HDF: ' + hp + ' added to: ' + bfpath)
+            hdfcount += 1
+    return hdfcount
+
 
 #********************************************************
 #WORKER
@@ -201,9 +521,21 @@ def main(argv):
     parser.add_argument("-lmax", "--lineMax", help = "HDF end row. Default = 4799", type = int, default = 4799)
     parser.add_argument("-smin", "--sampMin", help = "HDF start column. Default = 0", type = int, default = 0)
     parser.add_argument("-smax", "--sampMax", help = "HDF end column. Default = 4799", type = int, default = 4799)
+    parser.add_argument("-b", "--blockSize", help = "Memory (MB) used by each block of rows read from the HDF. Default = 64", type = int, default = 64)
+    parser.add_argument("--jobs", help = "Number of HDFs converted at the same time, each one to its own segment file (--rowJobs is then ignored). Default = 1", type = int, default = 1)
+    parser.add_argument("-j", "--rowJobs", help = "Number of processes converting bands of rows of each HDF. Default = 1", type = int, default = 1)
     parser.add_argument("-r", "--resolution", help = "Number of pixel in a HDF; usually 4800 x 4800. Default = 4800", type = int, default = 4800)
     parser.add_argument("-p", "--period", help = "Time period between HDFs. i.e 8 means the time index starts at 0 for the image of January 1st of 2000", type = int, default = 16)
     parser.add_argument("-s", "--startyear", help = "Starting year of the time index", type = int, default = 2000)
+    parser.add_argument("--layout", help = "Record layout: lltid (the indexes encoded in a single value) or dims (int64 col_id, row_id and time_id). It must match the one used by load2scidb.py. Default = lltid", choices = ['lltid', 'dims'], default = 'lltid')
+    parser.add_argument("--chunkOrder", help = "Order the records chunk by chunk using the destination array's chunks of the product (see --product)", action = "store_true")
+    parser.add_argument("--chunkFiles", help = "Write a binary file per destination chunk i.e. binaryFilepath_c3_r7.sdbbin. It implies --chunkOrder", action = "store_true")
+    parser.add_argument("--instances", help = "Write a binary file per SciDB instance i.e. binaryFilepath_i3.sdbbin, dealing the destination chunks round-robin, for a parallel load (see load2scidb.py --parallel). It implies --chunkOrder. Default = 0 (a single binary file)", type = int, default = 0)
+    parser.add_argument("--product", help = "Product of the HDFs i.e MOD13Q1. Default = guessed from the HDF paths", default = '')
+    parser.add_argument("--manifest", help = "Conversion manifest (SQLite file). HDFs already added to the binary file are skipped. See convManifest.py", default = '')
+    parser.add_argument("--catalog", help = "Catalog (SQLite file) of the HDFs. It is refreshed before use. See hdfCatalog.py", default = '')
+    parser.add_argument("--metrics", help = "File (JSON lines) the metrics of each HDF conversion are appended to. See loadMetrics.py", default = '')
+    parser.add_argument("--metricsProm", help = "File the conversion totals are written to, in Prometheus' textfile format", default = '')
     parser.add_argument("--log", help = "Log level", default = 'WARNING')
     #Get paramters
     args = parser.parse_args()
@@ -216,6 +548,16 @@ def main(argv):
     lineMax = args.lineMax
     sampMin = args.sampMin
     sampMax = args.sampMax
+    blockBytes = args.blockSize * pow(2, 20)
+    rowJobs = args.rowJobs
+    jobs = args.jobs
+    catalogPath = args.catalog
+    manifestPath = args.manifest
+    layout = args.layout
+    chunkFiles = args.chunkFiles
+    partitions = args.instances
+    chunkOrder = args.chunkOrder or chunkFiles or partitions > 0
+    prod = args.product
     log = args.log
     ####################################################
     # CONFIG
@@ -232,29 +574,24 @@ def main(argv):
     ####################################################
     # SCRIPT
     ####################################################
-    hpaths = hdfFilepaths.split(';')
+    catalog = None
+    if catalogPath != '':
+        catalog = hdfCatalog.openCatalog(catalogPath)
+    hdfPaths = listHdfs(hdfFilepaths, catalog)
     #print "Adding HDFs to binary file..."
-    hdfcount = 0
-    for hp in hpaths:
-        if os.path.isfile(hp):
-            if hp.endswith('.hdf'):
-                #print hp + ' ...'
-                tmp = addHdf2bin(hp, binaryFilepath, period, startyear, lineMin, lineMax, sampMin, sampMax)
-                logging.info('HDF: ' + hp + ' added to: ' + binaryFilepath)
-                hdfcount += 1
-            else:
-                logging.warning('Unknown file type: ' + hp)
-        elif os.path.isdir(hp):
-            for (dirpath, dirnames, filenames) in os.walk(hp):
-                for fn in filenames:
-                    if fn.endswith('.hdf'):
-                        #print dirpath + '/' + fn + ' ...'
-                        tmp = addHdf2bin(dirpath + '/' + fn, binaryFilepath, period, startyear, lineMin, lineMax, sampMin, sampMax)
-                        logging.info('HDF: ' + hp + ' added to: ' + binaryFilepath)
-                        hdfcount += 1
-                    else:
-                        logging.warning('Unknown file type: ' + fn)
-                break
+    manifest = None
+    if manifestPath != '':
+        manifest = convManifest.openManifest(manifestPath)
+    geometry = None
+    if chunkOrder:
+        if prod == '' and len(hdfPaths) > 0:
+            prod = productRegistry.guessProduct(hdfPaths[0])
+        geometry = productRegistry.getChunkGeometry(prod)
+        if geometry is None:
+            raise Exception("No destination array chunks for product: " + str(prod))
+    metrics = loadMetrics.openMetrics(args.metrics, args.metricsProm, 'addHdfs2bin')
+    hdfcount = addHdfs2bin(hdfPaths, binaryFilepath, period, startyear, lineMin, lineMax, sampMin, sampMax, blockBytes, rowJobs, jobs, manifest, layout, geometry, chunkFiles, partitions, metrics)
+    loadMetrics.writeProm(metrics)
     t1 = datetime.datetime.now()    
     tt = t1 - t0
     logging.info("Number of HDFs added: " + str(hdfcount) + " in " + str(tt))
@@ -25,11 +25,82 @@
 import os
 import sys
 import time
+import threading
 import subprocess as subp
 import argparse
 import datetime
 import logging
 import re
+import folderWatcher
+import loadDispatcher
+import loadQueue
+import load2scidb
+import scidbClient
+import loadMetrics
+import productRegistry
+
+#********************************************************
+# UTIL
+#********************************************************
+def groupFiles(filepaths, groupBytes):
+    '''Splits the files in groups of consecutive files adding up to groupBytes at most. Files larger than groupBytes make their own group'''
+    res = []
+    group = []
+    groupsize = 0
+    for filepath in filepaths:
+        size = os.path.getsize(filepath)
+        if len(group) > 0 and groupsize + size > groupBytes:
+            res.append(tuple(group))
+            group = []
+            groupsize = 0
+        group.append(filepath)
+        groupsize = groupsize + size
+    if len(group) > 0:
+        res.append(tuple(group))
+    return res
+
+def loadFile(filepaths, scriptFolder, destArray, prod, log, queuePath, pool = None, layout = None, instances = 1, instanceMemory = 0, metrics = None):
+    '''Loads a group of SDBBINs to SciDB using load2scidb.py, removes them afterwards and records the result in the load queue. When a pool of SciDB sessions is given, the SDBBINs are loaded in-process over it. Either way, each load slot reuses its own staging array. The queue wait and the busy time of the slot are recorded in the metrics (see loadMetrics.py)'''
+    t0 = time.time()
+    cmd = ["python", scriptFolder + "load2scidb.py", "--loadInstance", "-2", "--worker", load2scidb.getWorkerName(), "--instances", str(instances), "--instanceMemory", str(instanceMemory), "--log", log, "--product", prod] + list(filepaths) + [destArray]
+    if layout is not None:
+        cmd[2:2] = ["--layout", layout]
+    if metrics is not None and metrics['json'] != '':
+        cmd[2:2] = ["--metrics", metrics['json']]
+    queue = loadQueue.openQueue(queuePath)
+    wait = loadQueue.waitTime(queue, filepaths)
+    nbytes = sum([os.path.getsize(f) for f in filepaths if os.path.isfile(f)])
+    status = 'failed'
+    error = None
+    try:
+        logging.info("Loading SDBBINs: " + " ".join(filepaths))
+        if pool is None:
+            subp.check_call(cmd)
+        elif load2scidb.loadFiles(list(filepaths), destArray, productRegistry.getProductName(prod), None, -2, pool, layout, instances, instanceMemory, None, metrics) != 0:
+            raise subp.CalledProcessError(1, "load2scidb.loadFiles")
+        for filepath in filepaths:
+            os.remove(filepath)
+        status = 'loaded'
+    except subp.CalledProcessError as e:
+        logging.exception("CalledProcessError: " + " ".join(cmd) + "\n" + str(e))
+        error = str(e)
+    except OSError as e:
+        logging.exception("OSError: " + " ".join(cmd) + "\n" + str(e))
+        error = str(e)
+    except:
+        #Logged by the dispatcher
+        error = str(sys.exc_info()[1])
+        raise
+    finally:
+        #Files not loaded are recorded as failed, so they are retried instead of staying in 'loading'
+        for filepath in filepaths:
+            loadQueue.setStatus(queue, filepath, status, error)
+        queue.close()
+        slot = threading.current_thread().name
+        loadMetrics.record(metrics, 'dispatch', {'files': len(filepaths), 'bytes': nbytes, 'wait_seconds': wait, 'seconds': time.time() - t0}, {'status': status})
+        loadMetrics.addCounter(metrics, 'slot_busy_seconds', time.time() - t0, {'slot': slot})
+        loadMetrics.writeProm(metrics)
+
 
 #********************************************************
 #WORKER
@@ -41,6 +112,17 @@ def main(argv):
     parser.add_argument("destArray", help = "3D Array to upload the data to")
     parser.add_argument("product", help = "MODIS product. e.g MOD09Q1")
     parser.add_argument("-t", "--checktime", help = "Waiting time between folder inspections. Default is 60 (seconds)", type = int, default = 60)
+    parser.add_argument("-w", "--watch", help = "Load the SDBBINs as soon as they are complete (closed after writing or moved into the folder) using inotify. It falls back to inspecting the folder every checktime seconds when inotify is not available", action = "store_true")
+    parser.add_argument("--instanceCheck", help = "Waiting time between checks of the number of SciDB instances, which is the number of concurrent loads. Default is 300 (seconds)", type = int, default = 300)
+    parser.add_argument("--stableTime", help = "Time a SDBBIN's size must stay unchanged before loading it. Use 0 when the SDBBINs are moved (renamed) into the folder once complete, as run.py does. Default is 2 (seconds)", type = float, default = 2)
+    parser.add_argument("--queue", help = "Load queue (SQLite file) keeping track of the SDBBINs across restarts. Default is checkFolder.db", default = 'checkFolder.db')
+    parser.add_argument("--maxAttempts", help = "Number of times a failed SDBBIN is loaded before giving up. Default is 3", type = int, default = 3)
+    parser.add_argument("-g", "--groupSize", help = "Ready SDBBINs are loaded together, using one temporal array and one redimension, up to this size. Default is 0 (MB), one SDBBIN per load", type = int, default = 0)
+    parser.add_argument("--layout", help = "Record layout of the SDBBINs: lltid or dims. See addHdfs2bin.py. Default = the product's", choices = ['lltid', 'dims'], default = None)
+    parser.add_argument("--instanceMemory", help = "Memory of a SciDB instance, used by load2scidb.py for sizing the temporal 1D-array. Default is 0 (MB), not considered", type = int, default = 0)
+    parser.add_argument("--shim", help = "Comma separated URLs of SciDB's shim (i.e. http://localhost:8080). The SDBBINs are loaded in-process over long-lived sessions instead of running load2scidb.py", default = '')
+    parser.add_argument("--metrics", help = "File (JSON lines) the metrics of each load are appended to. See loadMetrics.py", default = '')
+    parser.add_argument("--metricsProm", help = "File the load totals (including the busy seconds of each load slot, i.e. SciDB instance) are written to, in Prometheus' textfile format", default = '')
     parser.add_argument("--log", help = "Log level", default = 'WARNING')
     #Get paramters
     args = parser.parse_args()
@@ -48,6 +130,16 @@ def main(argv):
     scriptFolder = args.scriptFolder
     destArray = args.destArray
     checktime = args.checktime
+    watch = args.watch
+    instanceCheck = args.instanceCheck
+    stableTime = args.stableTime
+    queuePath = os.path.abspath(args.queue)
+    maxAttempts = args.maxAttempts
+    groupBytes = args.groupSize * pow(2, 20)
+    shim = args.shim
+    layout = args.layout
+    instanceMemory = args.instanceMemory
+    metrics = loadMetrics.openMetrics(os.path.abspath(args.metrics) if args.metrics != '' else '', args.metricsProm, 'checkFolder')
     prod = args.product
     log = args.log
 
@@ -76,40 +168,44 @@ def main(argv):
     ####################################################
 
 
-    sdbInstances = int(subp.check_output("iquery -aq \"list('instances');\" | wc -l", shell=True)) - 3
-
-
-    cmdprefix = "parallel -j " + str(sdbInstances) + " --no-notice python " + scriptFolder + "load2scidb.py --loadInstance -2 --log " + log + " --product " + prod + " {1} " + destArray + " ::: "
-    before = dict ([(f, None) for f in os.listdir (path_to_watch)])
-    while 1:
-        time.sleep (checktime)
-        after = dict ([(f, None) for f in os.listdir (path_to_watch)])
-        added = [f for f in after if not f in before]
-        if added:
-            sdbbinList = []
-            for ad in added:
-                fileFullPath = path_to_watch + str(ad)
-                fileName, fileExtension = os.path.splitext(fileFullPath)
-                if(fileExtension == '.sdbbin'):
-                    sdbbinList.append(fileFullPath)
-            #Call to load2scidb.py
-            cmd = cmdprefix + " ".join(sdbbinList)
+    queue = loadQueue.openQueue(queuePath)
+    loadQueue.recoverQueue(queue, maxAttempts)
+    #Watch the folder before listing it, so the SDBBINs completed in between are not missed
+    watcher = folderWatcher.watchFolder(path_to_watch, checktime, watch, True, max(0.5, min(stableTime, checktime)))
+    logging.info("SDBBINs found in the folder: " + str(loadQueue.scanFolder(queue, path_to_watch, '.sdbbin')))
+    sdbInstances = loadDispatcher.getInstances()
+    logging.info("SciDB instances: " + str(sdbInstances))
+    pool = None
+    if shim != '':
+        pool = scidbClient.openPool(shim, len(sdbInstances))
+    try:
+        load2scidb.cleanStaging(pool or scidbClient.openPool("iquery"))
+    except scidbClient.QueryError as e:
+        logging.warning("Could not remove the orphaned staging arrays\n" + str(e))
+    dispatcher = loadDispatcher.startDispatcher(lambda f: loadFile(f, scriptFolder, destArray, prod, log, queuePath, pool, layout, len(sdbInstances), instanceMemory, metrics), len(sdbInstances))
+    lastCheck = time.time()
+    added = []
+    while True:
+        if time.time() - lastCheck > instanceCheck:
             try:
-                #logging.info("Loading SDBBINs : ", re.escape(str(cmd)))
-                subp.check_call(str(cmd), shell=True)
-                for f in sdbbinList:
-                    #logging.info("Removing SDBBIN : ", re.escape(str(f)))
-                    os.remove(f)
+                sdbInstances = loadDispatcher.getInstances()
+                loadDispatcher.setSlots(dispatcher, len(sdbInstances))
+                if pool is not None:
+                    pool['size'] = len(sdbInstances)
             except subp.CalledProcessError as e:
-                logging.exception("CalledProcessError: " + str(cmd) + "\n" + str(e.message))
-            except ValueError as e:
-                logging.exception("ValueError: " + str(cmd) + "\n" + str(e.message))
-            except OSError as e:
-                logging.exception("OSError: " + str(cmd) + "\n" + str(e.message))
-            except:
-                e = sys.exc_info()[0]
-                logging.exception("Unknown exception: " + str(cmd) + "\n" + str(e.message))
-        before = after
+                logging.exception("Could not list the SciDB instances\n" + str(e))
+            lastCheck = time.time()
+        for ad in added:
+            fileFullPath = path_to_watch + str(ad)
+            fileName, fileExtension = os.path.splitext(fileFullPath)
+            if(fileExtension == '.sdbbin'):
+                loadQueue.observe(queue, fileFullPath)
+        loadQueue.retryFailed(queue, maxAttempts, checktime)
+        for group in groupFiles(loadQueue.readyFiles(queue, stableTime), groupBytes):
+            for fileFullPath in group:
+                loadQueue.setStatus(queue, fileFullPath, 'loading')
+            loadDispatcher.submit(dispatcher, group)
+        added = next(watcher)
 
 
 if __name__ == "__main__":
@@ -0,0 +1,131 @@
+#
+#   Copyright (C) 2014 National Institute For Space Research (INPE) - Brazil.
+#
+#  This file is part of SciETL.
+#
+#  SciETL is free software: you can
+#  redistribute it and/or modify it under the terms of the
+#  GNU Lesser General Public License as published by
+#  the Free Software Foundation, either version 3 of the License,
+#  or (at your option) any later version.
+#
+#  SciETL is distributed in the hope that
+#  it will be useful, but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+#  GNU Lesser General Public License for more details.
+#
+#  You should have received a copy of the GNU Lesser General Public License
+#  along with SciETL. See LICENSE. If not, write to
+#  e-sensing team at <esensning-team@dpi.inpe.br>.
+#
+# Author: Alber Sanchez
+#
+# Persistent record of the HDF conversions: what was converted (input HDF,
+# mtime, size, bands, time_id, pixel window) and the output it produced.
+# Reruns skip the conversions already done and redo the missing or stale ones.
+#
+
+import os
+import datetime
+import logging
+import sqlite3
+
+#********************************************************
+# UTIL
+#********************************************************
+def openManifest(dbpath):
+    '''Opens (or creates) the conversion manifest stored in the given SQLite file'''
+    conn = sqlite3.connect(dbpath, timeout = 60)
+    conn.execute("CREATE TABLE IF NOT EXISTS conversions (hdf TEXT, mtime REAL, size INTEGER, bands TEXT, time_id INTEGER, window TEXT, output TEXT, offset INTEGER, nbytes INTEGER, status TEXT, updated TEXT, PRIMARY KEY (hdf, window, output))")
+    conn.execute("CREATE INDEX IF NOT EXISTS conversions_output ON conversions (output, status)")
+    conn.commit()
+    return conn
+
+def buildWindow(lineMin, lineMax, sampMin, sampMax, layout = 'lltid'):
+    '''Returns the text representation of a pixel window i.e 0:4799,0:4799. Record layouts other than lltid are part of it i.e 0:4799,0:4799;dims, so the same HDF written in another layout is converted again'''
+    res = str(lineMin) + ':' + str(lineMax) + ',' + str(sampMin) + ':' + str(sampMax)
+    if layout is not None and layout != '' and layout != 'lltid':
+        res = res + ';' + layout
+    return res
+
+def fingerprint(filepath):
+    '''Returns the mtime and size of a file'''
+    st = os.stat(filepath)
+    return (st.st_mtime, st.st_size)
+
+def isDone(conn, hdf, window, output):
+    '''Returns TRUE if the HDF was already converted to the output and it did not change since then'''
+    row = conn.execute("SELECT mtime, size FROM conversions WHERE hdf = ? AND window = ? AND output = ? AND status = 'done'", (hdf, window, output)).fetchone()
+    if row is None or not os.path.isfile(hdf):
+        return False
+    return tuple(row) == fingerprint(hdf)
+
+def areDone(conn, hdfs, window, output):
+    '''Returns TRUE if all the HDFs were already converted to the output'''
+    for hdf in hdfs:
+        if isDone(conn, hdf, window, output) == False:
+            return False
+    return True
+
+def startConversion(conn, hdf, window, output, offset, bands = '', time_id = -1):
+    '''Records that the conversion of an HDF to the output starts at the given byte offset'''
+    mtime, size = fingerprint(hdf)
+    conn.execute("INSERT OR REPLACE INTO conversions VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, 'started', ?)", (hdf, mtime, size, bands, time_id, window, output, offset, 0, str(datetime.datetime.now())))
+    conn.commit()
+
+def finishConversion(conn, hdf, window, output, nbytes, allowEmpty = False):
+    '''Records the end of the conversion of an HDF. Conversions producing no bytes are recorded as failed, unless empty outputs are allowed'''
+    status = 'done'
+    if nbytes < 1 and not allowEmpty:
+        status = 'failed'
+    conn.execute("UPDATE conversions SET nbytes = ?, status = ?, updated = ? WHERE hdf = ? AND window = ? AND output = ?", (nbytes, status, str(datetime.datetime.now()), hdf, window, output))
+    conn.commit()
+
+def copyBytes(src, dst, nbytes, bufsize = 16 * pow(2, 20)):
+    '''Copies the next nbytes of a file to another'''
+    while nbytes > 0:
+        buf = src.read(min(nbytes, bufsize))
+        if len(buf) == 0:
+            break
+        dst.write(buf)
+        nbytes = nbytes - len(buf)
+
+def dropStale(conn, hdfs, window, output):
+    '''Cuts out of the output the bytes of the given HDFs converted before (i.e. they changed since then), so converting them again does not duplicate their pixels. The conversions after them are moved back to their new offsets'''
+    stale = []
+    for hdf in hdfs:
+        stale.extend(conn.execute("SELECT offset, nbytes FROM conversions WHERE hdf = ? AND window = ? AND output = ? AND status = 'done' AND nbytes > 0", (hdf, window, output)).fetchall())
+        conn.execute("DELETE FROM conversions WHERE hdf = ? AND window = ? AND output = ?", (hdf, window, output))
+    # Bytes no longer in the output (i.e. a placed output) are not cut
+    outsize = 0
+    if os.path.isfile(output):
+        outsize = os.path.getsize(output)
+    stale = sorted([(offset, nbytes) for offset, nbytes in stale if offset + nbytes <= outsize])
+    if len(stale) > 0:
+        logging.warning("Cutting " + str(len(stale)) + " changed conversions out of: " + output)
+        tmppath = output + '.tmp'
+        src = open(output, "rb")
+        dst = open(tmppath, "wb")
+        pos = 0
+        for offset, nbytes in stale + [(outsize, 0)]:
+            copyBytes(src, dst, offset - pos)
+            src.seek(offset + nbytes)
+            pos = offset + nbytes
+        src.close()
+        dst.close()
+        os.rename(tmppath, output)
+        for offset, nbytes in reversed(stale):
+            conn.execute("UPDATE conversions SET offset = offset - ? WHERE output = ? AND offset > ?", (nbytes, output, offset))
+    conn.commit()
+
+def recoverOutput(conn, output):
+    '''Truncates the output to the offset of its oldest unfinished conversion (i.e. the work of a killed run), so reruns do not append duplicated pixels'''
+    row = conn.execute("SELECT min(offset) FROM conversions WHERE output = ? AND status = 'started'", (output,)).fetchone()
+    if row is not None and row[0] is not None:
+        if os.path.isfile(output) and os.path.getsize(output) > row[0]:
+            logging.warning("Truncating unfinished conversions of: " + output + " to " + str(row[0]) + " bytes")
+            bfile = open(output, "r+b")
+            bfile.truncate(row[0])
+            bfile.close()
+        conn.execute("UPDATE conversions SET status = 'failed', updated = ? WHERE output = ? AND status = 'started'", (str(datetime.datetime.now()), output))
+        conn.commit()
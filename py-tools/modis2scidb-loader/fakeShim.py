@@ -0,0 +1,203 @@
+#
+#   Copyright (C) 2014 National Institute For Space Research (INPE) - Brazil.
+#
+#  This file is part of SciETL.
+#
+#  SciETL is free software: you can
+#  redistribute it and/or modify it under the terms of the
+#  GNU Lesser General Public License as published by
+#  the Free Software Foundation, either version 3 of the License,
+#  or (at your option) any later version.
+#
+#  SciETL is distributed in the hope that
+#  it will be useful, but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+#  GNU Lesser General Public License for more details.
+#
+#  You should have received a copy of the GNU Lesser General Public License
+#  along with SciETL. See LICENSE. If not, write to
+#  e-sensing team at <esensning-team@dpi.inpe.br>.
+#
+# Author: Alber Sanchez
+#
+#
+# Stand-in for SciDB's shim, for testing and benchmarking the load scripts
+# without a SciDB cluster. It keeps the sessions and the arrays created and
+# removed by the queries, checks that the files to load exist and answers
+# like shim does: the query id or an HTTP 500 error with a SciDB-like message.
+# Queries on list('arrays') saved as tsv can be read back with read_lines.
+#
+# python fakeShim.py --port 8080 --latency 0.01 --arrays MOD13Q1,hotspot_daily
+#
+
+import os
+import re
+import sys
+import time
+import argparse
+import logging
+import threading
+try:
+    from BaseHTTPServer import HTTPServer, BaseHTTPRequestHandler
+    from SocketServer import ThreadingMixIn
+    from urlparse import urlparse, parse_qs
+except ImportError:
+    from http.server import HTTPServer, BaseHTTPRequestHandler
+    from socketserver import ThreadingMixIn
+    from urllib.parse import urlparse, parse_qs
+
+#********************************************************
+# UTIL
+#********************************************************
+def newState(arrays = [], latency = 0.0, fail = None, instancePaths = []):
+    '''Returns the state of a fake SciDB: its arrays, sessions, the queries run and the data folders of its instances'''
+    return {
+        'arrays': dict([(a, '') for a in arrays]), # Schema by array name
+        'results': {}, # Saved result of the last query, by session
+        'instancePaths': instancePaths,
+        'sessions': set(),
+        'queries': [],
+        'latency': latency,
+        'fail': fail, # Regular expression of the queries failing on purpose
+        'lock': threading.Lock(),
+        'next': 0
+    }
+
+def runQuery(state, query):
+    '''Checks a query against the fake SciDB and updates its arrays. It returns an error message or None'''
+    if state['latency'] > 0:
+        time.sleep(state['latency'])
+    with state['lock']:
+        state['queries'].append(query)
+        if state['fail'] is not None and re.search(state['fail'], query):
+            return "SCIDB_SE_EXECUTION::SCIDB_LE_ILLEGAL_OPERATION: failing on purpose"
+        m = re.match(r"\s*(?:CREATE\s+(?:TEMP\s+)?ARRAY\s+|create_array\(\s*)(\w+)", query, re.IGNORECASE)
+        if m:
+            if m.group(1) in state['arrays']:
+                return "SCIDB_SE_QPROC::SCIDB_LE_ARRAY_ALREADY_EXIST: Array '" + m.group(1) + "' already exists"
+            schema = ''
+            if '<' in query:
+                schema = re.sub(r'\s', '', query[query.index('<'):].rstrip(';'))
+            state['arrays'][m.group(1)] = m.group(1) + schema
+            return None
+        m = re.match(r"\s*remove\(\s*(\w+)\s*\)", query)
+        if m:
+            if m.group(1) not in state['arrays']:
+                return "SCIDB_SE_SYSCAT::SCIDB_LE_ARRAY_DOESNT_EXIST: Array '" + m.group(1) + "' does not exist"
+            del state['arrays'][m.group(1)]
+            return None
+        m = re.match(r"\s*load\(\s*(\w+)\s*,\s*'([^']*)'\s*,\s*(-?\d+)", query)
+        if m:
+            if m.group(1) not in state['arrays']:
+                return "SCIDB_SE_SYSCAT::SCIDB_LE_ARRAY_DOESNT_EXIST: Array '" + m.group(1) + "' does not exist"
+            filepaths = [m.group(2)]
+            if m.group(3) == '-1' and not os.path.isabs(m.group(2)):
+                #Parallel load: each instance reads the file from its data folder
+                filepaths = [os.path.join(ip, m.group(2)) for ip in state['instancePaths']]
+            for filepath in filepaths:
+                if not os.path.isfile(filepath):
+                    return "SCIDB_SE_IO::SCIDB_LE_CANT_OPEN_FILE: File '" + filepath + "' not found"
+        for name in re.findall(r"insert\(.*,\s*(\w+)\s*\)\s*$", query):
+            if name not in state['arrays']:
+                return "SCIDB_SE_SYSCAT::SCIDB_LE_ARRAY_DOESNT_EXIST: Array '" + name + "' does not exist"
+    return None
+
+def readResult(state, query):
+    '''Returns the result (tsv) of the queries on the list of arrays i.e. project(list('arrays'), name, schema). Other queries return nothing'''
+    m = re.match(r"\s*project\(\s*list\(\s*'arrays'\s*\)\s*,\s*([\w\s,]+)\)", query)
+    if m is None:
+        return ''
+    fields = [f.strip() for f in m.group(1).split(',')]
+    lines = []
+    with state['lock']:
+        for name in sorted(state['arrays'].keys()):
+            values = {'name': name, 'schema': state['arrays'][name]}
+            lines.append('\t'.join([values.get(f, '') for f in fields]))
+    return ''.join([line + '\n' for line in lines])
+
+def buildHandler(state):
+    '''Returns the HTTP request handler class answering shim's requests'''
+    class ShimHandler(BaseHTTPRequestHandler):
+        def reply(self, code, text):
+            body = text.encode()
+            self.send_response(code)
+            self.send_header("Content-Type", "text/plain")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def do_GET(self):
+            url = urlparse(self.path)
+            params = dict([(k, v[0]) for k, v in parse_qs(url.query).items()])
+            if url.path == '/new_session':
+                with state['lock']:
+                    state['next'] = state['next'] + 1
+                    sid = str(state['next'])
+                    state['sessions'].add(sid)
+                self.reply(200, sid)
+            elif url.path == '/release_session':
+                with state['lock']:
+                    state['sessions'].discard(params.get('id'))
+                self.reply(200, "")
+            elif url.path == '/execute_query':
+                if params.get('id') not in state['sessions']:
+                    self.reply(404, "Session not found")
+                    return
+                error = runQuery(state, params.get('query', ''))
+                if error is not None:
+                    self.reply(500, error)
+                else:
+                    if 'save' in params:
+                        state['results'][params.get('id')] = readResult(state, params.get('query', ''))
+                    self.reply(200, str(len(state['queries'])))
+            elif url.path == '/read_lines':
+                if params.get('id') not in state['sessions']:
+                    self.reply(404, "Session not found")
+                    return
+                self.reply(200, state['results'].pop(params.get('id'), ''))
+            else:
+                self.reply(404, "Unknown request: " + url.path)
+
+        def log_message(self, format, *args):
+            logging.debug(format % args)
+    return ShimHandler
+
+class ThreadingHTTPServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+def startServer(state, port = 0):
+    '''Starts the fake shim on a thread and returns its server. Use port 0 to pick a free port, available as server.server_port'''
+    server = ThreadingHTTPServer(('127.0.0.1', port), buildHandler(state))
+    t = threading.Thread(target = server.serve_forever)
+    t.daemon = True
+    t.start()
+    return server
+
+
+#********************************************************
+#WORKER
+#********************************************************
+def main(argv):
+    parser = argparse.ArgumentParser(description = "Stand-in for SciDB's shim for testing and benchmarking the loaders")
+    parser.add_argument("-p", "--port", help = "Port. Default = 8080", type = int, default = 8080)
+    parser.add_argument("-a", "--arrays", help = "Comma separated names of the arrays that already exist i.e. the destination arrays", default = '')
+    parser.add_argument("-l", "--latency", help = "Seconds added to each query. Default = 0", type = float, default = 0.0)
+    parser.add_argument("-i", "--instancePaths", help = "Comma separated data folders of the instances, where parallel loads read their files from", default = '')
+    parser.add_argument("-f", "--fail", help = "Regular expression of the queries to fail", default = None)
+    parser.add_argument("--log", help = "Log level. Default = WARNING", default = 'WARNING')
+    args = parser.parse_args()
+    numeric_loglevel = getattr(logging, args.log.upper(), None)
+    if not isinstance(numeric_loglevel, int):
+        raise ValueError('Invalid log level: %s' % args.log)
+    logging.basicConfig(level = numeric_loglevel, format = '%(asctime)s %(levelname)s: %(message)s')
+    state = newState([a for a in args.arrays.split(',') if a != ''], args.latency, args.fail, [ip for ip in args.instancePaths.split(',') if ip != ''])
+    server = ThreadingHTTPServer(('127.0.0.1', args.port), buildHandler(state))
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    logging.info("Queries run: " + str(len(state['queries'])))
+
+
+if __name__ == "__main__":
+   main(sys.argv[1:])
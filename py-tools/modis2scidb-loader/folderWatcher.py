@@ -0,0 +1,129 @@
+#
+#   Copyright (C) 2014 National Institute For Space Research (INPE) - Brazil.
+#
+#  This file is part of SciETL.
+#
+#  SciETL is free software: you can
+#  redistribute it and/or modify it under the terms of the
+#  GNU Lesser General Public License as published by
+#  the Free Software Foundation, either version 3 of the License,
+#  or (at your option) any later version.
+#
+#  SciETL is distributed in the hope that
+#  it will be useful, but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+#  GNU Lesser General Public License for more details.
+#
+#  You should have received a copy of the GNU Lesser General Public License
+#  along with SciETL. See LICENSE. If not, write to
+#  e-sensing team at <esensning-team@dpi.inpe.br>.
+#
+# Author: Alber Sanchez
+#
+#
+# Watches a folder for new files. It uses Linux's inotify (IN_CLOSE_WRITE and
+# IN_MOVED_TO events) so files are reported as soon as they are complete and
+# falls back to polling the folder when inotify is not available.
+#
+
+import os
+import time
+import errno
+import select
+import struct
+import logging
+
+# inotify flags. See /usr/include/linux/inotify.h
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_TO = 0x00000080
+IN_Q_OVERFLOW = 0x00004000
+IN_NONBLOCK = 0o4000
+IN_CLOEXEC = 0o2000000
+EVENT_HEADER = struct.Struct('iIII') # wd, mask, cookie, len
+
+#********************************************************
+# UTIL
+#********************************************************
+def openInotify(path):
+    '''Returns a non-blocking inotify file descriptor watching the given folder for complete files or None if inotify is not available'''
+    try:
+        import ctypes
+        import ctypes.util
+        libc = ctypes.CDLL(ctypes.util.find_library('c') or 'libc.so.6', use_errno = True)
+        fd = libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+        if fd < 0:
+            raise OSError(ctypes.get_errno(), "inotify_init1 failed")
+        wd = libc.inotify_add_watch(fd, path.encode(), IN_CLOSE_WRITE | IN_MOVED_TO)
+        if wd < 0:
+            os.close(fd)
+            raise OSError(ctypes.get_errno(), "inotify_add_watch failed")
+    except (OSError, AttributeError, ImportError) as e:
+        logging.warning("inotify is not available, polling the folder instead: " + str(e))
+        return None
+    return fd
+
+def readEvents(fd, timeout):
+    '''Waits up to timeout seconds for inotify events and returns the names of the files they report or None if the event queue overflowed (i.e. events were lost)'''
+    res = []
+    overflow = False
+    ready, w, x = select.select([fd], [], [], timeout)
+    if not ready:
+        return res
+    while True:
+        try:
+            buf = os.read(fd, 64 * 1024)
+        except OSError as e:
+            if e.errno == errno.EAGAIN:
+                break
+            raise
+        i = 0
+        while i + EVENT_HEADER.size <= len(buf):
+            wd, mask, cookie, namelen = EVENT_HEADER.unpack_from(buf, i)
+            i = i + EVENT_HEADER.size
+            if mask & IN_Q_OVERFLOW:
+                overflow = True
+            name = buf[i:i + namelen].rstrip(b'\0').decode()
+            i = i + namelen
+            if name and name not in res:
+                res.append(name)
+    if overflow:
+        return None
+    return res
+
+def pollChanges(path, checktime, before, idle = False):
+    '''Yields the lists of the names of the files added to the folder since the given listing, checking every checktime seconds. When idle is TRUE, empty lists are yielded too'''
+    while True:
+        time.sleep(checktime)
+        after = set(os.listdir(path))
+        added = sorted(after - before)
+        before = after
+        if added or idle:
+            yield added
+
+def pollFolder(path, checktime, idle = False):
+    '''Returns a generator of the lists of the names of the files added to the folder from now on (see pollChanges)'''
+    return pollChanges(path, checktime, set(os.listdir(path)), idle)
+
+def readInotify(fd, path, timeout, idle = False):
+    '''Yields the lists of the names of the files reported by an inotify file descriptor watching the folder. When events were lost, all the files of the folder are yielded instead. When idle is TRUE, an empty list is yielded after timeout seconds without events'''
+    try:
+        while True:
+            added = readEvents(fd, timeout)
+            if added is None:
+                logging.warning("inotify events lost, rescanning the folder: " + path)
+                added = sorted(os.listdir(path))
+            if added or idle:
+                yield added
+    finally:
+        os.close(fd)
+
+def watchFolder(path, checktime, useInotify = True, idle = False, timeout = None):
+    '''Starts watching the folder and returns a generator of the lists of the names of the files completed (closed after writing or moved in) since then. It falls back to polling every checktime seconds when inotify is not available. When idle is TRUE, an empty list is yielded after timeout seconds (default checktime) without events. The watch starts right away, so the files of the folder can be listed afterwards without missing those completed in between'''
+    fd = None
+    if useInotify:
+        fd = openInotify(path)
+    if fd is None:
+        return pollFolder(path, checktime, idle)
+    if timeout is None:
+        timeout = checktime
+    return readInotify(fd, path, timeout, idle)
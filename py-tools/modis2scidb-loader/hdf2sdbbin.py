@@ -29,6 +29,7 @@ import datetime
 import argparse
 import logging
 import re
+import productRegistry
 
 
 def isLeapYear(year):
@@ -79,7 +80,7 @@ def date2grid(dateFileName, period, startyear):
             res = idy + idd
         else:
             logging.error("date2grid: Invalid date")
-    elif period == -319980101: # Monthly - given as YYYYMMDD i.e 19980101, 19980201, 19980301
+    elif period == productRegistry.MONTHLY: # Monthly - given as YYYYMMDD i.e 19980101, 19980201, 19980301
         dateYYYYMMDD = dateFileName
         year = int(dateYYYYMMDD[0:4])
         mm = int(dateYYYYMMDD[4:6])
@@ -109,22 +110,6 @@ def main(argv):
     ####################################################
     # CONFIG
     ####################################################
-    prodList = ['MOD09Q1', 'MOD13Q1', 'TRMM3B43']
-    prodTemporalResolution = {
-        'MOD09Q1':    8,
-        'MOD13Q1':    16,
-        'TRMM3B43':    -319980101
-    }
-    prodStartYear = {
-        'MOD09Q1':    2000,
-        'MOD13Q1':    2000,
-        'TRMM3B43':    1998
-    }
-    prodBands = {
-        'MOD09Q1':    '0,1,2',
-        'MOD13Q1':    '0,1,2,3,4,5,6,7,8,9,10,11',
-        'TRMM3B43':    '0,1,2'
-    }
     numeric_loglevel = getattr(logging, log.upper(), None)
     if not isinstance(numeric_loglevel, int):
         raise ValueError('Invalid log level: %s' % log)
@@ -133,7 +118,7 @@ def main(argv):
     ####################################################
     # VALIDATION
     ####################################################
-    if product in prodList == False:
+    if productRegistry.getProductName(product) is None:
         logging.exception("Unknown product!")
         raise Exception("Unknown product!")
     if testGribModis2SciDB() == False:
@@ -144,9 +129,10 @@ def main(argv):
     ####################################################
     cmd = ""
     try:
-        period = prodTemporalResolution[product]
-        startyear = prodStartYear[product]
-        bands = prodBands[product]
+        prod = productRegistry.getProduct(product)
+        period = prod['period']
+        startyear = prod['startYear']
+        bands = prod['modis2scidbBands']
         filename = os.path.basename(hdfFile)
         time_id = date2grid(filename.split(".")[1], period, startyear)
         arg0 = "modis2scidb"
@@ -0,0 +1,161 @@
+#
+#   Copyright (C) 2014 National Institute For Space Research (INPE) - Brazil.
+#
+#  This file is part of SciETL.
+#
+#  SciETL is free software: you can
+#  redistribute it and/or modify it under the terms of the
+#  GNU Lesser General Public License as published by
+#  the Free Software Foundation, either version 3 of the License,
+#  or (at your option) any later version.
+#
+#  SciETL is distributed in the hope that
+#  it will be useful, but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+#  GNU Lesser General Public License for more details.
+#
+#  You should have received a copy of the GNU Lesser General Public License
+#  along with SciETL. See LICENSE. If not, write to
+#  e-sensing team at <esensning-team@dpi.inpe.br>.
+#
+# Author: Alber Sanchez
+#
+
+import os
+import sys
+import argparse
+import datetime
+import logging
+import sqlite3
+
+#********************************************************
+# UTIL
+#********************************************************
+def parseHdfName(filename):
+    '''Returns the parts (product, adoy, tile, h, v, collection) of an HDF name (e.g MOD09Q1.A2013361.h13v10.005.2014006133008.hdf) or None if the name does not follow the MODIS convention'''
+    res = None
+    fnparts = filename.split(".")
+    if len(fnparts) == 6 and fnparts[5] == 'hdf':
+        tile = fnparts[2]
+        if len(tile) == 6 and tile[0] == 'h' and tile[3] == 'v' and tile[1:3].isdigit() and tile[4:6].isdigit():
+            res = (fnparts[0], fnparts[1], tile, int(tile[1:3]), int(tile[4:6]), fnparts[3])
+    return res
+
+def openCatalog(dbpath):
+    '''Opens (or creates) the catalog of HDFs stored in the given SQLite file. Keep it on a local disk'''
+    conn = sqlite3.connect(dbpath)
+    conn.execute("CREATE TABLE IF NOT EXISTS folders (path TEXT PRIMARY KEY, parent TEXT, mtime REAL)")
+    conn.execute("CREATE TABLE IF NOT EXISTS hdfs (path TEXT PRIMARY KEY, folder TEXT, product TEXT, adoy TEXT, tile TEXT, h INTEGER, v INTEGER, collection TEXT, mtime REAL)")
+    conn.execute("CREATE INDEX IF NOT EXISTS hdfs_date_tile ON hdfs (adoy, h, v)")
+    conn.execute("CREATE INDEX IF NOT EXISTS hdfs_folder ON hdfs (folder)")
+    conn.execute("CREATE INDEX IF NOT EXISTS folders_parent ON folders (parent)")
+    conn.commit()
+    return conn
+
+def removeFolder(conn, folder):
+    '''Removes a folder, its subfolders and their HDFs from the catalog'''
+    conn.execute("DELETE FROM hdfs WHERE folder = ? OR substr(folder, 1, ?) = ?", (folder, len(folder) + 1, folder + '/'))
+    conn.execute("DELETE FROM folders WHERE path = ? OR substr(path, 1, ?) = ?", (folder, len(folder) + 1, folder + '/'))
+
+def refreshFolder(conn, folder, parent = None):
+    '''Updates the catalog entries of a folder and its subfolders. Only the folders whose mtime changed are listed again. It returns the number of folders listed'''
+    res = 0
+    try:
+        mtime = os.stat(folder).st_mtime
+    except OSError:
+        logging.warning("Folder not found: " + folder)
+        removeFolder(conn, folder)
+        return res
+    row = conn.execute("SELECT mtime FROM folders WHERE path = ?", (folder,)).fetchone()
+    if row is not None and row[0] == mtime:
+        subfolders = [r[0] for r in conn.execute("SELECT path FROM folders WHERE parent = ?", (folder,))]
+    else:
+        subfolders = []
+        hdfs = []
+        for name in os.listdir(folder):
+            filepath = os.path.join(folder, name)
+            if os.path.isdir(filepath):
+                subfolders.append(filepath)
+            else:
+                parts = parseHdfName(name)
+                if parts is not None:
+                    hdfs.append((filepath, folder) + parts + (os.path.getmtime(filepath),))
+        conn.execute("DELETE FROM hdfs WHERE folder = ?", (folder,))
+        conn.executemany("INSERT INTO hdfs VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)", hdfs)
+        for r in conn.execute("SELECT path FROM folders WHERE parent = ?", (folder,)).fetchall():
+            if r[0] not in subfolders:
+                removeFolder(conn, r[0])
+        conn.execute("INSERT OR REPLACE INTO folders VALUES (?, ?, ?)", (folder, parent, mtime))
+        res = 1
+    for sf in subfolders:
+        res = res + refreshFolder(conn, sf, folder)
+    return res
+
+def refreshCatalog(conn, root):
+    '''Updates the catalog with the HDFs found under the given folder and returns the number of folders listed'''
+    res = refreshFolder(conn, os.path.normpath(os.path.abspath(root)))
+    conn.commit()
+    logging.info("Catalog refreshed: " + root + " (" + str(res) + " folders listed)")
+    return res
+
+def findHdfs(conn, adoy, hRange, vRange, product = None, collection = None, folder = None):
+    '''Returns the paths to the HDFs of the given date (e.g A2013361) and tile ranges. Optionally filter by product, collection and the folder holding the files'''
+    query = "SELECT path FROM hdfs WHERE adoy = ? AND h BETWEEN ? AND ? AND v BETWEEN ? AND ?"
+    params = [adoy, min(hRange), max(hRange), min(vRange), max(vRange)]
+    if product is not None:
+        query = query + " AND product = ?"
+        params.append(product)
+    if collection is not None:
+        query = query + " AND collection = ?"
+        params.append(collection)
+    if folder is not None:
+        query = query + " AND folder = ?"
+        params.append(os.path.normpath(os.path.abspath(folder)))
+    query = query + " ORDER BY path"
+    return [r[0] for r in conn.execute(query, params)]
+
+def listHdfs(conn, folder, recursive = True):
+    '''Returns the paths to the HDFs in the given folder and, optionally, in its subfolders'''
+    folder = os.path.normpath(os.path.abspath(folder))
+    if recursive:
+        rows = conn.execute("SELECT path FROM hdfs WHERE folder = ? OR substr(folder, 1, ?) = ? ORDER BY path", (folder, len(folder) + 1, folder + '/'))
+    else:
+        rows = conn.execute("SELECT path FROM hdfs WHERE folder = ? ORDER BY path", (folder,))
+    return [r[0] for r in rows]
+
+
+#********************************************************
+#WORKER
+#********************************************************
+def main(argv):
+    t0 = datetime.datetime.now()
+    parser = argparse.ArgumentParser(description = "Builds or refreshes the catalog of an HDF archive")
+    parser.add_argument("catalog", help = "Path to the catalog (SQLite) file")
+    parser.add_argument("hdfFolder", help = "Path to the folder containing the HDFs")
+    parser.add_argument("--log", help = "Log level. Default = WARNING", default = 'WARNING')
+    #Get paramters
+    args = parser.parse_args()
+    catalog = args.catalog
+    hdfFolder = args.hdfFolder
+    log = args.log
+    ####################################################
+    # CONFIG
+    ####################################################
+    numeric_loglevel = getattr(logging, log.upper(), None)
+    if not isinstance(numeric_loglevel, int):
+        raise ValueError('Invalid log level: %s' % log)
+    logging.basicConfig(filename = 'log_hdfCatalog.log', level = numeric_loglevel, format = '%(asctime)s %(levelname)s: %(message)s')
+    logging.info("hdfCatalog: " + str(args))
+    ####################################################
+    # SCRIPT
+    ####################################################
+    conn = openCatalog(catalog)
+    refreshCatalog(conn, hdfFolder)
+    conn.close()
+    t1 = datetime.datetime.now()
+    tt = t1 - t0
+    logging.info("Finished in " + str(tt))
+
+
+if __name__ == "__main__":
+   main(sys.argv[1:])
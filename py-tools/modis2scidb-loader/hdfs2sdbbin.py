@@ -25,10 +25,17 @@ import os
 import sys
 import fnmatch
 import subprocess
+import tempfile
+import time
 import datetime
+import multiprocessing
+from multiprocessing.pool import ThreadPool
 import argparse
 import logging
 import re
+import productRegistry
+import hdfCatalog
+import convManifest
 
 
 def isLeapYear(year):
@@ -45,8 +52,15 @@ def isLeapYear(year):
     return leapyear
 
 
-def listFiles(path, pattern):
+def listFiles(path, pattern, catalog = None):
+    '''Returns the paths to the files under the given folder matching the regular expression. When a catalog is given, the HDFs are found there instead of walking the folders'''
     res = list()
+    if catalog is not None:
+        hdfCatalog.refreshCatalog(catalog, path)
+        for filepath in hdfCatalog.listHdfs(catalog, path):
+            if(re.match(pattern, filepath, flags=0)):
+                res.append(filepath)
+        return res
     for path, subdirs, files in os.walk(path):
         for name in files:
             filepath = os.path.join(path, name)
@@ -74,12 +88,12 @@ def date2grid(dateFileName, period, startyear):
         doy = int(dateYYYYDOY[4:7])
         ppy = int(365 / period) + 1 # Periods per year
         if(period > 0 and (doy - 1) % period == 0):
-            idd = (doy - 1) / period
+            idd = (doy - 1) // period
             idy = (year - startyear) * ppy
             res = idy + idd
         else:
             logging.error("date2grid: Invalid date")
-    elif period == -319980101: # Monthly - given as YYYYMMDD i.e 19980101, 19980201, 19980301
+    elif period == productRegistry.MONTHLY: # Monthly - given as YYYYMMDD i.e 19980101, 19980201, 19980301
         dateYYYYMMDD = dateFileName
         year = int(dateYYYYMMDD[0:4])
         mm = int(dateYYYYMMDD[4:6])
@@ -90,6 +104,82 @@ def date2grid(dateFileName, period, startyear):
     return res    
 
 
+def buildCommand(hdf, bfpath, bands, time_id):
+    '''Returns the arguments of the modis2scidb call converting an HDF to a binary file'''
+    return ["modis2scidb", "--f", hdf, "--o", bfpath, "--b", bands, "--t", str(time_id)]
+
+def newResult(hdf, bfpath, message = ''):
+    '''Returns the result of a conversion not done (yet) i.e. of an HDF whose time index is unknown'''
+    return {'hdf': hdf, 'output': bfpath, 'status': 'failed', 'returncode': None, 'seconds': 0, 'bytes': 0, 'message': message}
+
+def convertHdf(task):
+    '''Runs the modis2scidb conversion of a task, killing it after task['timeout'] seconds (0 means no limit). It never raises: the result tells the status (done, failed or timeout), the seconds, the bytes written and the error message, if any'''
+    t0 = time.time()
+    res = newResult(task['hdf'], task['bfpath'])
+    cmd = buildCommand(task['hdf'], task['bfpath'], task['bands'], task['time_id'])
+    logging.info(' '.join(cmd))
+    errfile = tempfile.TemporaryFile()
+    try:
+        proc = subprocess.Popen(cmd, stdout = errfile, stderr = subprocess.STDOUT)
+        while proc.poll() is None:
+            if task['timeout'] > 0 and time.time() - t0 > task['timeout']:
+                proc.kill()
+                proc.wait()
+                res['status'] = 'timeout'
+                break
+            time.sleep(0.1)
+        res['returncode'] = proc.returncode
+        if res['status'] != 'timeout' and proc.returncode == 0:
+            res['status'] = 'done'
+        errfile.seek(0)
+        res['message'] = errfile.read().decode('utf-8', 'replace').strip()[-500:]
+    except OSError as e:
+        res['message'] = str(e)
+    finally:
+        errfile.close()
+    if res['status'] == 'done' and os.path.isfile(task['bfpath']):
+        res['bytes'] = os.path.getsize(task['bfpath'])
+    elif res['status'] != 'done' and os.path.isfile(task['bfpath']):
+        os.remove(task['bfpath']) # Partial output
+    res['seconds'] = time.time() - t0
+    return res
+
+def convertHdfs(tasks, jobs, manifest = None):
+    '''Converts the tasks using a pool of jobs threads, each one running a modis2scidb process. A failed or timed out conversion does not stop the others. The conversions are recorded in the manifest, if any. It returns the results of the conversions (see convertHdf)'''
+    res = []
+    if len(tasks) == 0:
+        return res
+    if manifest is not None:
+        for task in tasks:
+            convManifest.startConversion(manifest, task['hdf'], '', task['bfpath'], 0, task['bands'], task['time_id'])
+    pool = ThreadPool(max(1, min(jobs, len(tasks))))
+    try:
+        for result in pool.imap_unordered(convertHdf, tasks):
+            res.append(result)
+            if result['status'] == 'done':
+                logging.info("Converted: " + result['hdf'] + " in " + str(round(result['seconds'], 3)) + "s")
+            else:
+                logging.error("Conversion " + result['status'] + ": " + result['hdf'] + " (return code " + str(result['returncode']) + ") " + result['message'])
+            if manifest is not None:
+                convManifest.finishConversion(manifest, result['hdf'], '', result['output'], result['bytes'])
+    finally:
+        pool.close()
+        pool.join()
+    return res
+
+def summarize(results):
+    '''Returns the number of conversions by status, the bytes written, the conversion seconds and the HDFs not converted'''
+    res = {'done': 0, 'failed': 0, 'timeout': 0, 'bytes': 0, 'seconds': 0, 'notConverted': []}
+    for result in results:
+        res[result['status']] += 1
+        res['bytes'] += result['bytes']
+        res['seconds'] += result['seconds']
+        if result['status'] != 'done':
+            res['notConverted'].append(result['hdf'])
+    res['notConverted'].sort()
+    return res
+
+
 #********************************************************
 # MAIN
 #********************************************************
@@ -100,6 +190,10 @@ def main(argv):
     parser.add_argument("loadFolder", help = "Folder from where the binary files are uploaded to SCIDB")
     parser.add_argument("product", help = "Product. e.g MOD09Q1")
     parser.add_argument("--regex", help = "Regular expression for filtering files.", default = '^.*\.(hdf|HDF)$')
+    parser.add_argument("--catalog", help = "Catalog (SQLite file) of the HDFs. It is refreshed before use. Only HDFs named after the MODIS convention are cataloged. See hdfCatalog.py", default = '')
+    parser.add_argument("--manifest", help = "Conversion manifest (SQLite file). HDFs already converted are skipped. See convManifest.py", default = '')
+    parser.add_argument("-j", "--jobs", help = "Number of HDFs converted at the same time. Default = the number of CPUs", type = int, default = multiprocessing.cpu_count())
+    parser.add_argument("--timeout", help = "Seconds after which a conversion is killed and counted as failed. Default = 0 (no limit)", type = float, default = 0)
     parser.add_argument("--log", help = "Log level. Default = WARNING", default = 'WARNING')
     #Get paramters
     args = parser.parse_args()
@@ -107,26 +201,14 @@ def main(argv):
     loadFolder = os.path.join(args.loadFolder, '')
     product = args.product
     regex = args.regex
+    catalogPath = args.catalog
+    manifestPath = args.manifest
+    jobs = args.jobs
+    timeout = args.timeout
     log = args.log
     ####################################################
     # CONFIG
     ####################################################
-    prodList = ['MOD09Q1', 'MOD13Q1', 'TRMM3B43']
-    prodTemporalResolution = {
-        'MOD09Q1':    8,
-        'MOD13Q1':    16,
-        'TRMM3B43':    -319980101
-    }
-    prodStartYear = {
-        'MOD09Q1':    2000,
-        'MOD13Q1':    2000,
-        'TRMM3B43':    1998
-    }
-    prodBands = {
-        'MOD09Q1':    '0,1,2',
-        'MOD13Q1':    '0,1,2,3,4,5,6,7,8,9,10,11',
-        'TRMM3B43':    '0,1,2'
-    }
     numeric_loglevel = getattr(logging, log.upper(), None)
     if not isinstance(numeric_loglevel, int):
         raise ValueError('Invalid log level: %s' % log)
@@ -135,7 +217,7 @@ def main(argv):
     ####################################################
     # VALIDATION
     ####################################################
-    if product in prodList == False:
+    if productRegistry.getProductName(product) is None:
         logging.exception("Unknown product!")
         raise Exception("Unknown product!")
     if testGribModis2SciDB() == False:
@@ -144,38 +226,55 @@ def main(argv):
     ####################################################
     # 
     ####################################################
-    cmd = ""
+    summary = None
     try:
-        period = prodTemporalResolution[product]
-        startyear = prodStartYear[product]
-        bands = prodBands[product]
-        hdfs = listFiles(hdfFolder, regex)
-        for i in range(0, len(hdfs)) :
-            hdf = hdfs[i]
+        prod = productRegistry.getProduct(product)
+        period = prod['period']
+        startyear = prod['startYear']
+        bands = prod['modis2scidbBands']
+        catalog = None
+        if catalogPath != '':
+            catalog = hdfCatalog.openCatalog(catalogPath)
+        hdfs = listFiles(hdfFolder, regex, catalog)
+        manifest = None
+        if manifestPath != '':
+            manifest = convManifest.openManifest(manifestPath)
+        tasks = []
+        invalid = [] # Results of the HDFs with no time index
+        for hdf in hdfs:
             filename = os.path.basename(hdf)
-            time_id = date2grid(filename.split(".")[1], period, startyear)
-            arg0 = "modis2scidb"
-            arg1 = " --f " + hdf
-            arg2 = " --o " + loadFolder + os.path.splitext(filename)[0] + ".sdbbin"
-            arg3 = " --b " + bands
-            arg4 = " --t " + str(time_id)
-            cmd = arg0 + arg1 + arg2 + arg3 + arg4
-            #if(i != len(hdfs)):
-            #    cmd = cmd + " & "
-            logging.info(cmd)
-            subprocess.check_call(str(cmd), shell = True)
-    except subprocess.CalledProcessError as e:
-        logging.exception("CalledProcessError: " + cmd + "\n" + str(e.message))
+            bfpath = loadFolder + os.path.splitext(filename)[0] + ".sdbbin"
+            try:
+                time_id = date2grid(filename.split(".")[1], period, startyear)
+            except (ValueError, IndexError) as e:
+                time_id = -1
+                logging.error("Invalid date in the name of: " + hdf + " " + str(e))
+            if time_id < 0:
+                invalid.append(newResult(hdf, bfpath, "Invalid date in the file name"))
+                continue
+            if manifest is not None:
+                if convManifest.isDone(manifest, hdf, '', bfpath):
+                    logging.info("Already converted: " + hdf)
+                    continue
+                if os.path.isfile(bfpath):
+                    os.remove(bfpath) # Output of an unfinished conversion
+            tasks.append({'hdf': hdf, 'bfpath': bfpath, 'bands': bands, 'time_id': time_id, 'timeout': timeout})
+        summary = summarize(invalid + convertHdfs(tasks, jobs, manifest))
+        logging.info("Summary: " + str(summary['done']) + " converted, " + str(summary['failed']) + " failed, " + str(summary['timeout']) + " timed out. " + str(summary['bytes']) + " bytes in " + str(round(summary['seconds'], 3)) + " conversion seconds")
+        for hdf in summary['notConverted']:
+            logging.warning("Not converted: " + hdf)
     except ValueError as e:
-        logging.exception("ValueError: " + cmd + "\n" + str(e.message))
+        logging.exception("ValueError: " + str(e))
     except OSError as e:
-        logging.exception("OSError: " + cmd + "\n" + str(e.message))
+        logging.exception("OSError: " + str(e))
     except:
-        e = sys.exc_info()[0]
-        logging.exception("Unknown exception: " + cmd + "\n" + str(e.message))
+        e = sys.exc_info()[1]
+        logging.exception("Unknown exception: " + str(e))
     t1 = datetime.datetime.now()    
     tt = t1 - t0
     logging.info("Finished in " + str(tt))
+    if summary is None or len(summary['notConverted']) > 0:
+        sys.exit(1)
     
 
 if __name__ == "__main__":
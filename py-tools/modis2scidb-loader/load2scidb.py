@@ -23,12 +23,21 @@
 
 #CHRONOS python checkFolder.py -t 60 --log INFO /dados1/scidb/toLoad/ /dados/scidb/scripts/MOD13Q1/ MOD13Q1_TEST009_20140605
 import os
+import re
 import sys
+import errno
+import socket
 import argparse
+import threading
 import datetime
 import subprocess as subp
+import shutil
 import logging
 from subprocess import check_output as qx
+import productRegistry
+import scidbClient
+import loadDispatcher
+import loadMetrics
 ##################################################
 # CREATE DESTINATION ARRAY
 ##################################################
@@ -45,6 +54,12 @@ from subprocess import check_output as qx
 #SELECT * FROM MOD13Q1_TEST009_20140605 WHERE col_id = 57600 AND row_id = 43200;
 #time iquery -q "SELECT * FROM MOD13Q1_TEST009_20140605 WHERE col_id = 57600 AND row_id = 43200"
 
+# Staging arrays created or checked by this process: CREATE statement by array name (None when unknown)
+stagingArrays = {}
+stagingLock = threading.Lock()
+# Sized chunks of the staging arrays are rounded down to 1024 records times a power of this step, so loads of similar size share a staging array
+stagingChunkStep = 4
+
 #********************************************************
 # UTIL
 #********************************************************
@@ -76,43 +91,251 @@ def processDatatypes(schema):
     return ', '.join(datatypes)
 
 
-def load2scidb(bfile, DESTARRAY, flatArrayAQL, cmdaql, cmdafl, loadInstance):
-    '''Load the binary file to SciDB'''
+def getFlatDimension(prod, chunkSize1D = 0):
+    '''Return the dimension of the temporal 1D array. When chunkSize1D is not given, the product's chunk size is used'''
+    res = '[k=0:*, ' + str(chunkSize1D) + ', 0]'
+    if chunkSize1D < 1:
+        res = '[k=0:*, ' + str(productRegistry.getFlatArrayChunksize(prod)) + ',0]'
+    return res
+
+
+def joinFiles(bfiles, grouppath):
+    '''Concatenates binary files of the same product into a group file and returns its path. The binary format has no header, so the group is a valid binary file holding all their records'''
+    gfile = open(grouppath, "wb")
+    for bfile in bfiles:
+        f = open(bfile, "rb")
+        shutil.copyfileobj(f, gfile, 16 * pow(2, 20))
+        f.close()
+    gfile.close()
+    return grouppath
+
+
+def getWorkerName(slot = None):
+    '''Return the name of the current loader: host, process id and slot (by default, the thread name) i.e. gis_obama_p1234_MainThread. Staging arrays are named after it'''
+    if slot is None:
+        slot = threading.current_thread().name
+    return re.sub(r'\W', '_', socket.gethostname() + '_p' + str(os.getpid()) + '_' + str(slot))
+
+
+def getStagingName(prod, layout, worker, flatDimension = ''):
+    '''Return the name of the staging (temporal 1D) array of a loader for the given product, record layout and dimension. There is an array per chunk size, so loads of other sizes do not recreate it'''
+    res = prod + '_' + layout
+    dims = parseDimensions(flatDimension)
+    if len(dims) > 0 and dims[0][1] is not None:
+        res = res + '_c' + str(dims[0][1])
+    return getArrayname(res + '_stage_' + worker)
+
+
+def parseStagingName(name):
+    '''Return the host and the process id of the loader owning a staging array or None if the array is not a staging array'''
+    m = re.search(r'_stage_(\w+)_p(\d+)_[A-Za-z0-9]\w*$', name)
+    if m is None:
+        return None
+    return (m.group(1), int(m.group(2)))
+
+
+def getCreatedArray(flatArrayAQL):
+    '''Return the name of the array created by the given AQL statement'''
+    return re.match(r'\s*CREATE\s+(?:TEMP\s+)?ARRAY\s+(\w+)', flatArrayAQL, re.IGNORECASE).group(1)
+
+
+def isRunning(pid):
+    '''Test if a process of this host is running'''
+    try:
+        os.kill(pid, 0)
+    except OSError as e:
+        return e.errno == errno.EPERM
+    return True
+
+
+def listArrays(pool):
+    '''Return the schemas of SciDB's arrays by array name'''
+    res = {}
+    for row in scidbClient.readQuery(pool, "project(list('arrays'), name, schema)"):
+        if len(row) > 1:
+            res[row[0]] = row[1]
+        elif len(row) == 1:
+            res[row[0]] = ''
+    return res
+
+
+def parseAttributes(schema):
+    '''Return the names and types of the attributes of a schema (or CREATE ARRAY statement) i.e. [('lltid', 'int64'), ('red', 'int16')]. Nullability, default values and compression are ignored'''
+    res = []
+    if '<' not in schema or '>' not in schema:
+        return res
+    for att in schema[schema.index('<') + 1:schema.index('>')].split(','):
+        m = re.match(r'\s*(\w+)\s*:\s*(\w+)', att)
+        if m is not None:
+            res.append((m.group(1).lower(), m.group(2).lower()))
+    return res
+
+
+def parseDimensions(schema):
+    '''Return the names and chunk intervals (None if not given) of the dimensions of a schema (or CREATE ARRAY statement). Both i=0:*,1024,0 and i=0:*:0:1024 (low:high:overlap:interval) are understood'''
+    res = []
+    if '[' not in schema:
+        return res
+    for m in re.finditer(r'(\w+)\s*(?:=\s*(-?\d+|\*|\?)\s*:\s*(-?\d+|\*|\?)\s*(?:([,:])\s*(\d+|\*|\?)\s*[,:]\s*(\d+|\*|\?))?)?', schema[schema.index('[') + 1:schema.rindex(']') if ']' in schema else len(schema)]):
+        interval = m.group(5) if m.group(4) == ',' else m.group(6)
+        if interval is not None and interval.isdigit():
+            interval = int(interval)
+        else:
+            interval = None
+        res.append((m.group(1).lower(), interval))
+    return res
+
+
+def sameSchema(schema1, schema2):
+    '''Test if two schemas (or CREATE ARRAY statements) have the same attributes (names and types) and dimensions (names and chunk intervals), however SciDB prints them'''
+    attrs = parseAttributes(schema1)
+    return len(attrs) > 0 and attrs == parseAttributes(schema2) and parseDimensions(schema1) == parseDimensions(schema2)
+
+
+def stageQueries(pool, flatArrayAQL):
+    '''Return the queries preparing the staging array of a load: none when the array already exists with the same schema, its (re)creation otherwise. Staging arrays are reused across loads with no clearing, since a load replaces the content of the array'''
+    name = getCreatedArray(flatArrayAQL)
+    with stagingLock:
+        known = stagingArrays.get(name)
+    if known is None:
+        known = listArrays(pool).get(name)
+    res = []
+    if known is None or not sameSchema(known, flatArrayAQL):
+        if known is not None:
+            res.append("remove(" + name + ")")
+        res.append(flatArrayAQL.rstrip(';'))
+    with stagingLock:
+        stagingArrays[name] = flatArrayAQL
+    return res
+
+
+def forgetStaging(name):
+    '''Forget what is known of a staging array, so the next load checks it in SciDB again (i.e. after a failed load)'''
+    with stagingLock:
+        if name in stagingArrays:
+            stagingArrays[name] = None
+
+
+def dropStaging(pool):
+    '''Remove the staging arrays created or checked by this process'''
+    with stagingLock:
+        names = list(stagingArrays.keys())
+        stagingArrays.clear()
+    for name in names:
+        try:
+            scidbClient.runQueries(pool, ["remove(" + name + ")"])
+        except scidbClient.QueryError as e:
+            logging.warning("Could not remove the staging array: " + name + "\n" + e.message)
+
+
+def cleanStaging(pool):
+    '''Remove the staging arrays left behind by the loaders of this host that are no longer running (i.e. killed loaders). It returns their names'''
+    host = re.sub(r'\W', '_', socket.gethostname())
+    res = []
+    for name in listArrays(pool):
+        owner = parseStagingName(name)
+        if owner is None or owner[0] != host or isRunning(owner[1]):
+            continue
+        try:
+            scidbClient.runQueries(pool, ["remove(" + name + ")"])
+            forgetStaging(name)
+            res.append(name)
+        except scidbClient.QueryError as e:
+            logging.warning("Could not remove the orphaned staging array: " + name + "\n" + e.message)
+    if len(res) > 0:
+        logging.info("Orphaned staging arrays removed: " + ", ".join(res))
+    return res
+
+
+def buildQueries(bfile, DESTARRAY, flatArrayAQL, loadInstance, layout = 'lltid'):
+    '''Build the AFL queries for loading the binary file to SciDB: load to the staging 1D array created by flatArrayAQL, then redimension and insert into the destination array. The lltid layout is decoded using integer division and modulo; the dims layout is redimensioned as it is'''
+    res = []
+    TMP_VALUE1D = getCreatedArray(flatArrayAQL)
+    schema = flatArrayAQL[flatArrayAQL.index('<') + 1:flatArrayAQL.index('>')]
+    #Load to 1D temporal array
+    res.append("load(" + TMP_VALUE1D + ", '" + bfile + "', " + str(loadInstance) + ", '(" + processDatatypes(schema) + ")', 0, shadowArray)")
+    #Re-build dimension indexes and insert into the destination array
+    if layout == 'dims':
+        res.append("insert(redimension(" + TMP_VALUE1D + ", " + DESTARRAY + "), " + DESTARRAY + ")")
+    else:
+        res.append("insert(redimension(apply(" + TMP_VALUE1D + ", col_id, lltid % 1000000, row_id, (lltid / 1000000) % 100000, time_id, lltid / 100000000000), " + DESTARRAY + "), " + DESTARRAY + ")")
+    return res
+
+
+def splitTimings(timings):
+    '''Return the seconds spent preparing the staging array, loading and redimensioning/inserting given the timings of the queries of a load (see buildQueries). The iquery backend only reports the total'''
+    res = {'seconds': sum([t['seconds'] for t in timings])}
+    if len(timings) >= 2:
+        res['stage_seconds'] = sum([t['seconds'] for t in timings[:-2]])
+        res['load_seconds'] = timings[-2]['seconds']
+        res['insert_seconds'] = timings[-1]['seconds']
+    return res
+
+
+def load2scidb(bfile, DESTARRAY, flatArrayAQL, pool, loadInstance, layout = 'lltid', metrics = None, values = {}):
+    '''Load the binary file to SciDB through the staging array created by flatArrayAQL, using a session of the pool (see scidbClient.py). The load and the given values (i.e. its bytes) are recorded in the metrics (see loadMetrics.py). It returns 0 on success'''
     #---------------
     # Script starts here
     #---------------
-    cmd = ""
+    retcode = 1
+    event = dict(values)
+    event['file'] = bfile
+    event['backend'] = pool['backend']
     try:
         logging.info("Loading: " + bfile)
-        tmparraylist = []
-        TMP_VALUE1D = flatArrayAQL.split(' ')[2]
-        schema = flatArrayAQL[flatArrayAQL.index('<') + 1:flatArrayAQL.index('>')]
-        #Create the temporal 1D array for holding the data
-        cmd = flatArrayAQL + "; "
-        tmparraylist.append(TMP_VALUE1D)
-        #Load to 1D temporal array
-        afl = "load(" + TMP_VALUE1D + ", '" + bfile + "', " + str(loadInstance) + ", '(" + processDatatypes(schema) + ")', 0, shadowArray);"
-        cmd = cmd + afl + "; "
-        #Re-build dimension indexes and insert into the destination array
-        afl = "insert(redimension(apply(" + TMP_VALUE1D + ",col_id, int64(lltid - floor(lltid/pow(10,11)) * pow(10,11) - floor((lltid - (floor(lltid/pow(10,11)) * pow(10,11)))/pow(10,6)) * pow(10,6)), row_id, int64(floor((lltid - (floor(lltid/pow(10,11)) * pow(10,11)))/pow(10,6))),time_id, int64(floor(lltid/pow(10,11)))), " + DESTARRAY + "), " + DESTARRAY + ");"
-        cmd = cmd + afl + "; "
-        #Remove temporal arrays
-        for an in tmparraylist:
-            afl = "remove(" + an + ");"
-            cmd = cmd + afl + "; "
-        cmd = cmdafl + cmd + "\""
-        logging.debug("Query: " + cmd)
-        retcode = subp.call(cmd, shell = True)
-        logging.info("Load completed: " + bfile)
-    except subp.CalledProcessError as e:
-        logging.exception("CalledProcessError: " + cmd + "\n" + str(e.message))
-    except ValueError as e:
-        logging.exception("ValueError: " + cmd + "\n" + str(e.message))
-    except OSError as e:
-        logging.exception("OSError: " + cmd + "\n" + str(e.message))
+        queries = stageQueries(pool, flatArrayAQL) + buildQueries(bfile, DESTARRAY, flatArrayAQL, loadInstance, layout)
+        logging.debug("Queries: " + "; ".join(queries))
+        timings = scidbClient.runQueries(pool, queries)
+        retcode = 0
+        event.update(splitTimings(timings))
+        logging.info("Load completed: " + bfile + " " + str([round(t['seconds'], 3) for t in timings]))
+    except scidbClient.QueryError as e:
+        logging.error("Load failed: " + bfile + " after " + str(round(e.seconds, 3)) + "s\n" + e.message + "\n" + e.query)
+        forgetStaging(getCreatedArray(flatArrayAQL))
+        event['error'] = e.message
     except:
-        e = sys.exc_info()[0]
-        logging.exception("Unknown exception: " + cmd + "\n" + str(e.message))        
+        e = sys.exc_info()[1]
+        logging.exception("Unknown exception: " + bfile + "\n" + str(e))
+        event['error'] = str(e)
+    loadMetrics.record(metrics, 'load', event, {'status': 'ok' if retcode == 0 else 'failed', 'array': DESTARRAY})
+    return retcode
+
+
+def sizeFlatDimension(binaryFilepaths, prod, layout, instances = 1, instanceMemory = 0):
+    '''Return the dimension of the temporal 1D array sized for loading the given binary files (see productRegistry.sizeFlatArrayChunk) and the number of bytes to load'''
+    nbytes = 0
+    for bf in binaryFilepaths:
+        nbytes = nbytes + os.path.getsize(bf)
+    chunkSize1D = productRegistry.sizeFlatArrayChunk(prod, nbytes, layout, instances, instanceMemory)
+    rounded = 1024
+    while rounded * stagingChunkStep <= chunkSize1D:
+        rounded = rounded * stagingChunkStep
+    if chunkSize1D >= rounded:
+        chunkSize1D = rounded
+    logging.info("Chunk size of the temporal 1D array: " + str(chunkSize1D) + " records for " + str(nbytes) + " bytes of " + str(productRegistry.getRecordSize(prod, layout)) + " bytes records (" + str(instances) + " instances, " + str(instanceMemory) + " MB per instance)")
+    return (getFlatDimension(prod, chunkSize1D), nbytes)
+
+
+def loadFiles(binaryFilepaths, destArray, prod, flatDimension, loadInstance, pool, layout = None, instances = 1, instanceMemory = 0, worker = None, metrics = None):
+    '''Load binary files of the same product and record layout (by default, the product's) to SciDB. Several files are joined and loaded together through the staging array of the worker (by default, the current one). When flatDimension is None, the staging array is sized for the files. It returns 0 on success'''
+    layout = productRegistry.getLayout(prod, layout)
+    binaryFilepaths = [os.path.abspath(bf) for bf in binaryFilepaths] # SciDB opens the files from its own folder
+    nbytes = sum([os.path.getsize(bf) for bf in binaryFilepaths])
+    if flatDimension is None:
+        flatDimension, nbytes = sizeFlatDimension(binaryFilepaths, prod, layout, instances, instanceMemory)
+    values = {'files': len(binaryFilepaths), 'bytes': nbytes, 'records': nbytes // productRegistry.getRecordSize(prod, layout), 'product': prod, 'layout': layout, 'dimension': flatDimension}
+    binaryFilepath = binaryFilepaths[0]
+    TMP_VALUE1D = getStagingName(prod, layout, worker or getWorkerName(), flatDimension)
+    flatArrayAQL = "CREATE TEMP ARRAY " + TMP_VALUE1D + " <" + productRegistry.getFlatArraySchema(prod, layout) + ">" + flatDimension + ";"
+    if len(binaryFilepaths) > 1:
+        binaryFilepath = joinFiles(binaryFilepaths, binaryFilepath + '.group')
+        logging.info("Loading " + str(len(binaryFilepaths)) + " binary files as: " + binaryFilepath)
+    t0 = datetime.datetime.now()
+    retcode = load2scidb(binaryFilepath, destArray, flatArrayAQL, pool, loadInstance, layout, metrics, values)
+    logging.info("Load time: " + str(datetime.datetime.now() - t0) + " " + flatDimension + " " + binaryFilepath)
+    if len(binaryFilepaths) > 1:
+        os.remove(binaryFilepath)
+    return retcode
 
 
 def buildCmd(bfile, DESTARRAY, flatArrayAQL, cmdaql, cmdafl, loadInstance):
@@ -138,54 +361,100 @@ def buildCmd(bfile, DESTARRAY, flatArrayAQL, cmdaql, cmdafl, loadInstance):
     return cmd
 
 
+def placeFile(filepath, destpath):
+    '''Hard links the file to the given path. It copies it if a link is not possible (i.e. across file systems)'''
+    if os.path.isfile(destpath):
+        os.remove(destpath)
+    try:
+        os.link(filepath, destpath)
+    except OSError:
+        shutil.copyfile(filepath, destpath)
+
+
+def loadPartitions(partitionFilepaths, destArray, prod, flatDimension, pool, instancePaths, layout = None, instanceMemory = 0, worker = None, metrics = None):
+    '''Load binary files, one per SciDB instance in instance order, using SciDB's parallel load (-1). Each file is placed in its instance's data folder, where the instance reads it from. When flatDimension is None, the temporal array is sized for the files. It returns 0 on success'''
+    if len(partitionFilepaths) != len(instancePaths):
+        logging.error("The number of binary files (" + str(len(partitionFilepaths)) + ") does not match the number of instances (" + str(len(instancePaths)) + ")")
+        return 1
+    layout = productRegistry.getLayout(prod, layout)
+    nbytes = sum([os.path.getsize(pf) for pf in partitionFilepaths])
+    if flatDimension is None:
+        flatDimension, nbytes = sizeFlatDimension(partitionFilepaths, prod, layout, len(instancePaths), instanceMemory)
+    values = {'files': len(partitionFilepaths), 'bytes': nbytes, 'records': nbytes // productRegistry.getRecordSize(prod, layout), 'product': prod, 'layout': layout, 'dimension': flatDimension, 'instances': len(instancePaths)}
+    TMP_VALUE1D = getStagingName(prod, layout, worker or getWorkerName(), flatDimension)
+    flatArrayAQL = "CREATE TEMP ARRAY " + TMP_VALUE1D + " <" + productRegistry.getFlatArraySchema(prod, layout) + ">" + flatDimension + ";"
+    relpath = TMP_VALUE1D + ".sdbbin" # Relative to the data folder of each instance
+    placed = []
+    retcode = 1
+    try:
+        for i in range(len(partitionFilepaths)):
+            destpath = os.path.join(instancePaths[i], relpath)
+            placeFile(partitionFilepaths[i], destpath)
+            placed.append(destpath)
+        t0 = datetime.datetime.now()
+        retcode = load2scidb(relpath, destArray, flatArrayAQL, pool, -1, layout, metrics, values)
+        logging.info("Load time: " + str(datetime.datetime.now() - t0) + " " + flatDimension + " " + relpath)
+    except (IOError, OSError) as e:
+        logging.exception("Could not place the binary files in the instance folders\n" + str(e))
+    finally:
+        for destpath in placed:
+            os.remove(destpath)
+    return retcode
+
+
 #********************************************************
 #WORKER
 #********************************************************
 def main(argv):
     t0 = datetime.datetime.now()
     parser = argparse.ArgumentParser(description = "Loads a SCIDB's binary file to SCIDB")
-    parser.add_argument("binaryFilepath", help = "Path to a binary file (*.sdbbin)")
+    parser.add_argument("binaryFilepath", help = "Path to a binary file (*.sdbbin). Several binary files of the same product are loaded together using one temporal array and one redimension", nargs = '+')
     parser.add_argument("destArray", help = "3D Array to upload the data to")
     parser.add_argument("-p", "--product", help = "MODIS product. e.g MOD09Q1", default = "default")
-    parser.add_argument("-c", "--chunkSize1D", help = "Chunksize for the temporal 1D-array holding the loaded data", type = int, default = 0)
+    parser.add_argument("-c", "--chunkSize1D", help = "Chunksize for the temporal 1D-array holding the loaded data. Default = sized from the size of the binary files, the record size, the instances and the instance memory", type = int, default = 0)
+    parser.add_argument("--instances", help = "Number of SciDB instances the loaded data is spread over, used for sizing the temporal 1D-array. Default = 1 or the number of --instancePaths", type = int, default = 1)
+    parser.add_argument("--instanceMemory", help = "Memory (MB) of a SciDB instance, used for sizing the temporal 1D-array. Default = 0 (not considered)", type = int, default = 0)
     parser.add_argument("-l", "--loadInstance", help = "SciDB's instance used for uploading the data. Default = coordinator instance", type = int, default = -2)
+    parser.add_argument("--layout", help = "Record layout of the binary files: lltid or dims. See addHdfs2bin.py. Default = the product's", choices = ['lltid', 'dims'], default = None)
+    parser.add_argument("--parallel", help = "Parallel load: the binary files, one per SciDB instance in instance order (see addHdfs2bin.py --instances), are placed in the data folder of each instance and loaded by all the instances at once", action = "store_true")
+    parser.add_argument("--instancePaths", help = "Comma separated data folders of the SciDB instances used by --parallel. Default = the instance_path of list('instances')", default = '')
+    parser.add_argument("--shim", help = "Comma separated URLs of SciDB's shim (i.e. http://localhost:8080). Default = iquery", default = '')
+    parser.add_argument("--worker", help = "Name of the loader (see getWorkerName) whose staging array is used and kept for its next loads. Default = a staging array of this process, removed at the end", default = None)
+    parser.add_argument("--cleanStaging", help = "Remove the staging arrays left behind by killed loaders of this host before loading", action = "store_true")
+    parser.add_argument("--metrics", help = "File (JSON lines) the metrics of the load are appended to. See loadMetrics.py", default = '')
+    parser.add_argument("--metricsProm", help = "File the load totals are written to, in Prometheus' textfile format", default = '')
     parser.add_argument("--log", help = "Log level. Default = WARNING", default = 'WARNING')
     #Get paramters
     args = parser.parse_args()
-    binaryFilepath = args.binaryFilepath    
-    chunkSize1D = args.chunkSize1D
+    binaryFilepaths = args.binaryFilepath
+    binaryFilepath = binaryFilepaths[0]
     destArray = args.destArray
     chunkSize1D = args.chunkSize1D
+    instances = args.instances
+    instanceMemory = args.instanceMemory
     loadInstance = args.loadInstance
     prod = args.product
+    shim = args.shim
+    layout = args.layout
+    worker = args.worker
+    parallel = args.parallel
+    instancePaths = [ip for ip in args.instancePaths.split(',') if ip != '']
     log = args.log
     ####################################################
     # CONFIG
     ####################################################
-    modisprod = ['MOD09Q1', 'MOD13Q1', 'TRMM_3B43']
-    flatArraySchema = {
-        'MOD09Q1':    'lltid:int64, red:int16, nir:int16, quality:uint16',
-        'MOD13Q1':    'lltid:int64, ndvi:int16, evi:int16, quality:uint16, red:int16, nir:int16, blue:int16, mir:int16, viewza:int16, sunza:int16, relaza:int16, cdoy:int16, reli:int8',
-        'TRMM_3B43':'lltid:int64, precipitation:float, relativeError:float, gaugeRelativeWeighting:int8'
-    }
-    flatArrayChunksize = {
-        'MOD09Q1':    1048576, # ~6MB
-        'MOD13Q1':    262144, # ~6MB
-        'TRMM_3B43':262144 # ~2.25MB
-    }
     if prod == 'default':
-        for mp in modisprod:
-            if mp in binaryFilepath:
-                prod = mp
-    if prod == 'default':
-                logging.exception("Unknown product: The product could not be figured out.")
-                raise Exception("Unknown product")
-    if prod in modisprod == False:
+        prod = productRegistry.guessProduct(binaryFilepath)
+        if prod is None:
+            logging.exception("Unknown product: The product could not be figured out.")
+            raise Exception("Unknown product")
+    if productRegistry.getProductName(prod) is None:
         logging.exception("Unknown product: Product not found.")
         raise Exception("Product not found")
-    flatDimension = '[k=0:*, ' + str(chunkSize1D) + ', 0]'
-    if chunkSize1D < 1:
-        flatDimension = '[k=0:*, ' + str(flatArrayChunksize[prod]) + ',0]'
+    prod = productRegistry.getProductName(prod)
+    flatDimension = None
+    if chunkSize1D > 0:
+        flatDimension = getFlatDimension(prod, chunkSize1D)
     #Log
     numeric_loglevel = getattr(logging, log.upper(), None)
     if not isinstance(numeric_loglevel, int):
@@ -193,19 +462,34 @@ def main(argv):
     logging.basicConfig(filename = 'log_load2scidb.log', level = numeric_loglevel, format = '%(asctime)s %(levelname)s: %(message)s')
     logging.info("load2scidb: " + str(args))
     #
-    iqpath = "/opt/scidb/" + os.environ['SCIDB_VER'] + "/bin/" # Path to iquery
-    cmdaql = iqpath + "iquery -nq \"" # Prefix on how to call iquery with AQL expression
-    cmdafl = iqpath + "iquery -naq \"" # Prefix on how to call iquery with AFL expression
+    iqpath = "" # Path to iquery
+    if 'SCIDB_VER' in os.environ or shim == '':
+        iqpath = "/opt/scidb/" + os.environ['SCIDB_VER'] + "/bin/"
+    if shim == '':
+        pool = scidbClient.openPool(iqpath + "iquery")
+    else:
+        pool = scidbClient.openPool(shim)
     ####################################################
     # SCRIPT
     ####################################################
-    bpath, bfilename = os.path.split(binaryFilepath)    
-    TMP_VALUE1D = getArrayname(bfilename)
-    flatArrayAQL = "CREATE ARRAY " + TMP_VALUE1D + " <" + flatArraySchema[prod] + ">" + flatDimension + ";"
-    load2scidb(binaryFilepath, destArray, flatArrayAQL, cmdaql, cmdafl, loadInstance)
+    metrics = loadMetrics.openMetrics(args.metrics, args.metricsProm, 'load2scidb')
+    if args.cleanStaging:
+        cleanStaging(pool)
+    if parallel:
+        if len(instancePaths) == 0:
+            instancePaths = loadDispatcher.getInstancePaths(iqpath + "iquery")
+        retcode = loadPartitions([os.path.abspath(bf) for bf in binaryFilepaths], destArray, prod, flatDimension, pool, instancePaths, layout, instanceMemory, worker, metrics)
+    else:
+        retcode = loadFiles(binaryFilepaths, destArray, prod, flatDimension, loadInstance, pool, layout, instances, instanceMemory, worker, metrics)
+    if worker is None:
+        dropStaging(pool)
+    scidbClient.closePool(pool)
+    loadMetrics.writeProm(metrics)
     t1 = datetime.datetime.now()
     tt = t1 - t0
     logging.info("Done in " + str(tt))
+    if retcode != 0:
+        sys.exit(retcode)
 
 
 if __name__ == "__main__":
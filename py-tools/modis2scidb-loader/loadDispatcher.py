@@ -0,0 +1,122 @@
+#
+#   Copyright (C) 2014 National Institute For Space Research (INPE) - Brazil.
+#
+#  This file is part of SciETL.
+#
+#  SciETL is free software: you can
+#  redistribute it and/or modify it under the terms of the
+#  GNU Lesser General Public License as published by
+#  the Free Software Foundation, either version 3 of the License,
+#  or (at your option) any later version.
+#
+#  SciETL is distributed in the hope that
+#  it will be useful, but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+#  GNU Lesser General Public License for more details.
+#
+#  You should have received a copy of the GNU Lesser General Public License
+#  along with SciETL. See LICENSE. If not, write to
+#  e-sensing team at <esensning-team@dpi.inpe.br>.
+#
+# Author: Alber Sanchez
+#
+#
+# Keeps one load slot per SciDB instance busy: queued files are loaded by a
+# pool of threads and the next file starts as soon as any slot is free.
+#
+
+import sys
+import threading
+import subprocess as subp
+import logging
+try:
+    import Queue as queue
+except ImportError:
+    import queue
+
+#********************************************************
+# UTIL
+#********************************************************
+def getInstances(iquery = "iquery"):
+    '''Returns the ids of the SciDB instances'''
+    out = subp.check_output(iquery + " -otsv -aq \"project(list('instances'), instance_id);\"", shell = True)
+    res = []
+    for line in out.decode().splitlines():
+        line = line.strip()
+        if line.isdigit():
+            res.append(int(line))
+    return res
+
+def getInstancePaths(iquery = "iquery"):
+    '''Returns the data folders of the SciDB instances, in instance order'''
+    out = subp.check_output(iquery + " -otsv -aq \"project(list('instances'), instance_id, instance_path);\"", shell = True)
+    res = []
+    for line in out.decode().splitlines():
+        fields = line.strip().split('\t')
+        if len(fields) == 2 and fields[0].isdigit():
+            res.append((int(fields[0]), fields[1]))
+    return [path for iid, path in sorted(res)]
+
+def startDispatcher(loadFile, slots):
+    '''Starts a dispatcher running loadFile(path) on the queued files with the given number of concurrent slots. It returns the dispatcher'''
+    dispatcher = {
+        'loadFile': loadFile,
+        'queue': queue.Queue(),
+        'queued': set(), # Files waiting or being loaded
+        'lock': threading.Lock(),
+        'slots': 0,
+        'threads': []
+    }
+    setSlots(dispatcher, slots)
+    return dispatcher
+
+def setSlots(dispatcher, slots):
+    '''Changes the number of concurrent loads of the dispatcher. Extra slots finish their current load and stop'''
+    slots = max(1, slots)
+    with dispatcher['lock']:
+        if slots == dispatcher['slots']:
+            return
+        logging.info("Load slots: " + str(dispatcher['slots']) + " -> " + str(slots))
+        dispatcher['slots'] = slots
+        dispatcher['threads'] = [t for t in dispatcher['threads'] if t.is_alive()]
+        for i in range(len(dispatcher['threads']), slots):
+            t = threading.Thread(target = runSlot, args = (dispatcher,))
+            t.daemon = True
+            dispatcher['threads'].append(t)
+            t.start()
+
+def submit(dispatcher, filepath):
+    '''Queues a file (or a group of files given as a tuple) for loading. Files already waiting or being loaded are ignored. It returns TRUE if the file was queued'''
+    with dispatcher['lock']:
+        if filepath in dispatcher['queued']:
+            return False
+        dispatcher['queued'].add(filepath)
+    dispatcher['queue'].put(filepath)
+    return True
+
+def pending(dispatcher):
+    '''Returns the number of files waiting or being loaded'''
+    with dispatcher['lock']:
+        return len(dispatcher['queued'])
+
+def runSlot(dispatcher):
+    '''Loads queued files, one at a time, while the slot is needed'''
+    me = threading.current_thread()
+    while True:
+        with dispatcher['lock']:
+            alive = [t for t in dispatcher['threads'] if t.is_alive()]
+            if alive.index(me) >= dispatcher['slots']:
+                dispatcher['threads'].remove(me)
+                return
+        try:
+            filepath = dispatcher['queue'].get(timeout = 1)
+        except queue.Empty:
+            continue
+        try:
+            dispatcher['loadFile'](filepath)
+        except:
+            e = sys.exc_info()[1]
+            logging.exception("Unknown exception loading: " + str(filepath) + "\n" + str(e))
+        finally:
+            with dispatcher['lock']:
+                dispatcher['queued'].discard(filepath)
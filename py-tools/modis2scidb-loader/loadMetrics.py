@@ -0,0 +1,117 @@
+#
+#   Copyright (C) 2014 National Institute For Space Research (INPE) - Brazil.
+#
+#  This file is part of SciETL.
+#
+#  SciETL is free software: you can
+#  redistribute it and/or modify it under the terms of the
+#  GNU Lesser General Public License as published by
+#  the Free Software Foundation, either version 3 of the License,
+#  or (at your option) any later version.
+#
+#  SciETL is distributed in the hope that
+#  it will be useful, but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+#  GNU Lesser General Public License for more details.
+#
+#  You should have received a copy of the GNU Lesser General Public License
+#  along with SciETL. See LICENSE. If not, write to
+#  e-sensing team at <esensning-team@dpi.inpe.br>.
+#
+# Author: Alber Sanchez
+#
+#
+# Telemetry of the loader pipeline. Each event (the conversion of an HDF, the
+# load of a binary file, a job) is written as a JSON line, and its numeric
+# values (bytes, pixels, records, files, seconds) are added to per-process
+# totals exported in Prometheus' textfile format (i.e. for node_exporter's
+# textfile collector). Give each script its own textfile.
+#
+
+import os
+import json
+import time
+import socket
+import datetime
+import threading
+
+# Values added to the totals: keys equal to or ending with _<unit>
+counterUnits = ['bytes', 'pixels', 'records', 'files', 'hdfs', 'seconds']
+
+#********************************************************
+# UTIL
+#********************************************************
+def openMetrics(jsonPath = '', promPath = '', job = ''):
+    '''Returns the metrics of a script: the JSON lines file the events are appended to and the Prometheus textfile the totals are written to. Empty paths disable either of them'''
+    return {
+        'json': jsonPath,
+        'prom': promPath,
+        'job': job,
+        'host': socket.gethostname(),
+        'start': time.time(),
+        'lock': threading.RLock(),
+        'counters': {} # Total by (metric name, labels)
+    }
+
+def isCounter(key):
+    '''Returns TRUE if the values of the given key are added to the totals'''
+    for unit in counterUnits:
+        if key == unit or key.endswith('_' + unit):
+            return True
+    return False
+
+def addCounter(metrics, name, value, labels = None):
+    '''Adds the value to a total i.e. addCounter(m, 'slot_busy_seconds', 2.5, {'slot': '1'}). It does nothing when metrics is None'''
+    if metrics is None:
+        return
+    key = (name, tuple(sorted((labels or {}).items())))
+    with metrics['lock']:
+        metrics['counters'][key] = metrics['counters'].get(key, 0) + value
+
+def record(metrics, event, values, labels = None):
+    '''Writes an event and its values as a JSON line and adds its numeric values to the totals of the event, by label (i.e. status). It does nothing when metrics is None'''
+    if metrics is None:
+        return
+    entry = {
+        'time': datetime.datetime.now().isoformat(),
+        'event': event,
+        'job': metrics['job'],
+        'host': metrics['host'],
+        'pid': os.getpid()
+    }
+    entry.update(labels or {})
+    entry.update(values)
+    with metrics['lock']:
+        if metrics['json'] != '':
+            jfile = open(metrics['json'], "a")
+            jfile.write(json.dumps(entry, sort_keys = True) + "\n")
+            jfile.close()
+        addCounter(metrics, event, 1, labels)
+        for k, v in values.items():
+            if isCounter(k) and isinstance(v, (int, float)) and not isinstance(v, bool):
+                addCounter(metrics, event + '_' + k, v, labels)
+
+def formatLabels(labels):
+    '''Returns the Prometheus representation of the labels i.e. {job="run",status="ok"}'''
+    return '{' + ','.join([k + '="' + str(v).replace('\\', '\\\\').replace('"', '\\"') + '"' for k, v in labels]) + '}'
+
+def writeProm(metrics):
+    '''Writes the totals to the Prometheus textfile, replacing it at once so the exporter never reads half a file. It does nothing when metrics is None or there is no textfile'''
+    if metrics is None or metrics['prom'] == '':
+        return
+    lines = []
+    jobLabel = (('job', metrics['job']),)
+    with metrics['lock']:
+        names = sorted(set([name for name, labels in metrics['counters'].keys()]))
+        for name in names:
+            lines.append("# TYPE scietl_" + name + "_total counter")
+            for (n, labels), value in sorted(metrics['counters'].items()):
+                if n == name:
+                    lines.append("scietl_" + name + "_total" + formatLabels(jobLabel + labels) + " " + repr(value))
+        lines.append("# TYPE scietl_uptime_seconds gauge")
+        lines.append("scietl_uptime_seconds" + formatLabels(jobLabel) + " " + repr(time.time() - metrics['start']))
+        tmppath = metrics['prom'] + '.' + str(os.getpid()) + '.tmp'
+        pfile = open(tmppath, "w")
+        pfile.write("\n".join(lines) + "\n")
+        pfile.close()
+        os.rename(tmppath, metrics['prom'])
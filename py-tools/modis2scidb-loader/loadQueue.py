@@ -0,0 +1,127 @@
+#
+#   Copyright (C) 2014 National Institute For Space Research (INPE) - Brazil.
+#
+#  This file is part of SciETL.
+#
+#  SciETL is free software: you can
+#  redistribute it and/or modify it under the terms of the
+#  GNU Lesser General Public License as published by
+#  the Free Software Foundation, either version 3 of the License,
+#  or (at your option) any later version.
+#
+#  SciETL is distributed in the hope that
+#  it will be useful, but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+#  GNU Lesser General Public License for more details.
+#
+#  You should have received a copy of the GNU Lesser General Public License
+#  along with SciETL. See LICENSE. If not, write to
+#  e-sensing team at <esensning-team@dpi.inpe.br>.
+#
+# Author: Alber Sanchez
+#
+#
+# Persistent queue of the binary files to load. Each file goes through the
+# states pending, loading, loaded and failed. A pending file is ready once its
+# size and mtime did not change for a while, so files still being written are
+# not loaded. The queue survives restarts: interrupted loads are retried and
+# files arrived while nobody was watching are found by scanning the folder.
+#
+
+import os
+import time
+import datetime
+import logging
+import sqlite3
+
+#********************************************************
+# UTIL
+#********************************************************
+def openQueue(dbpath):
+    '''Opens (or creates) the load queue stored in the given SQLite file'''
+    conn = sqlite3.connect(dbpath, timeout = 60)
+    conn.execute("CREATE TABLE IF NOT EXISTS files (path TEXT PRIMARY KEY, size INTEGER, mtime REAL, seen REAL, status TEXT, attempts INTEGER, error TEXT, updated TEXT)")
+    conn.execute("CREATE INDEX IF NOT EXISTS files_status ON files (status)")
+    conn.commit()
+    return conn
+
+def setStatus(conn, filepath, status, error = None):
+    '''Changes the status of a file. Failures are counted'''
+    attempts = 0
+    if status == 'failed':
+        attempts = 1
+    conn.execute("UPDATE files SET status = ?, error = ?, attempts = attempts + ?, updated = ? WHERE path = ?", (status, error, attempts, str(datetime.datetime.now()), filepath))
+    conn.commit()
+
+def observe(conn, filepath):
+    '''Adds a file to the queue as pending or, if it is pending and its size or mtime changed, restarts its stability wait. Files already loaded are queued again when they change. It returns the status of the file'''
+    try:
+        st = os.stat(filepath)
+    except OSError:
+        return None
+    row = conn.execute("SELECT size, mtime, status FROM files WHERE path = ?", (filepath,)).fetchone()
+    changed = row is None or row[0] != st.st_size or row[1] != st.st_mtime
+    if row is None or (changed and row[2] in ('pending', 'loaded', 'failed')):
+        conn.execute("INSERT OR REPLACE INTO files VALUES (?, ?, ?, ?, 'pending', 0, NULL, ?)", (filepath, st.st_size, st.st_mtime, time.time(), str(datetime.datetime.now())))
+        conn.commit()
+        return 'pending'
+    return row[2]
+
+def scanFolder(conn, folder, extension):
+    '''Queues the files of a folder with the given extension (e.g .sdbbin) that are not yet queued. It returns the number of files found'''
+    res = 0
+    for name in sorted(os.listdir(folder)):
+        if os.path.splitext(name)[1] == extension:
+            observe(conn, os.path.join(folder, name))
+            res = res + 1
+    return res
+
+def retryFailed(conn, maxAttempts, delay = 0):
+    '''Puts back as pending the failed files with less than maxAttempts attempts whose last attempt is older than delay seconds. It returns the number of files queued again'''
+    now = datetime.datetime.now()
+    cutoff = str(now - datetime.timedelta(seconds = delay))
+    n = conn.execute("UPDATE files SET status = 'pending', updated = ? WHERE status = 'failed' AND attempts < ? AND updated <= ?", (str(now), maxAttempts, cutoff)).rowcount
+    conn.commit()
+    if n > 0:
+        logging.info("Failed files queued again: " + str(n))
+    return n
+
+def recoverQueue(conn, maxAttempts):
+    '''Puts back as pending the files whose load was interrupted (i.e. by a restart) and the failed ones with less than maxAttempts attempts'''
+    n = conn.execute("UPDATE files SET status = 'pending', updated = ? WHERE status = 'loading'", (str(datetime.datetime.now()),)).rowcount
+    conn.commit()
+    if n > 0:
+        logging.info("Interrupted loads queued again: " + str(n))
+    return n + retryFailed(conn, maxAttempts)
+
+def readyFiles(conn, stableTime):
+    '''Returns the pending files whose size and mtime did not change during the last stableTime seconds, in arrival order. Pending files no longer found are dropped from the queue'''
+    res = []
+    now = time.time()
+    for filepath, size, mtime, seen in conn.execute("SELECT path, size, mtime, seen FROM files WHERE status = 'pending' ORDER BY seen, path").fetchall():
+        try:
+            st = os.stat(filepath)
+        except OSError:
+            logging.warning("Queued file not found: " + filepath)
+            conn.execute("DELETE FROM files WHERE path = ?", (filepath,))
+            continue
+        if st.st_size != size or st.st_mtime != mtime:
+            conn.execute("UPDATE files SET size = ?, mtime = ?, seen = ? WHERE path = ?", (st.st_size, st.st_mtime, now, filepath))
+        elif now - seen >= stableTime:
+            res.append(filepath)
+    conn.commit()
+    return res
+
+def waitTime(conn, filepaths):
+    '''Returns the seconds the files have been waiting in the queue since they were last seen changing'''
+    res = 0
+    now = time.time()
+    for filepath in filepaths:
+        row = conn.execute("SELECT seen FROM files WHERE path = ?", (filepath,)).fetchone()
+        if row is not None:
+            res = max(res, now - row[0])
+    return res
+
+def countFiles(conn):
+    '''Returns the number of files by status'''
+    return dict(conn.execute("SELECT status, count(*) FROM files GROUP BY status").fetchall())
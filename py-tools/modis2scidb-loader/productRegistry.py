@@ -0,0 +1,269 @@
+#
+#   Copyright (C) 2014 National Institute For Space Research (INPE) - Brazil.
+#
+#  This file is part of SciETL.
+#
+#  SciETL is free software: you can
+#  redistribute it and/or modify it under the terms of the
+#  GNU Lesser General Public License as published by
+#  the Free Software Foundation, either version 3 of the License,
+#  or (at your option) any later version.
+#
+#  SciETL is distributed in the hope that
+#  it will be useful, but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+#  GNU Lesser General Public License for more details.
+#
+#  You should have received a copy of the GNU Lesser General Public License
+#  along with SciETL. See LICENSE. If not, write to
+#  e-sensing team at <esensning-team@dpi.inpe.br>.
+#
+# Author: Alber Sanchez
+#
+# Product knowledge shared by the loader scripts: band layouts, data types,
+# record sizes, time grids and SciDB array schemas.
+#
+
+import re
+
+#********************************************************
+# PRODUCTS
+#********************************************************
+# Period used for monthly products given as YYYYMMDD i.e 19980101, 19980201, 19980301
+MONTHLY = -319980101
+
+products = {
+    'MOD09Q1': {
+        'bands': [('red', 'int16'), ('nir', 'int16'), ('quality', 'uint16')],
+        'modis2scidbBands': '0,1,2', # Bands converted by modis2scidb
+        'period': 8,
+        'startYear': 2000,
+        'resolution': 4800, # Pixels per tile side
+        'flatArrayChunksize': 1048576, # ~6MB
+        'layout': 'lltid', # Record layout of the binary files. See layouts
+        'destArraySchema': '<red:int16, nir:int16, quality:uint16> [col_id=48000:72000,1014,5,row_id=38400:62400,1014,5,time_id=0:9200,1,0]'
+    },
+    'MOD13Q1': {
+        'bands': [('ndvi', 'int16'), ('evi', 'int16'), ('quality', 'uint16'), ('red', 'int16'), ('nir', 'int16'), ('blue', 'int16'), ('mir', 'int16'), ('viewza', 'int16'), ('sunza', 'int16'), ('relaza', 'int16'), ('cdoy', 'int16'), ('reli', 'int16')],
+        'modis2scidbBands': '0,1,2,3,4,5,6,7,8,9,10,11',
+        'period': 16,
+        'startYear': 2000,
+        'resolution': 4800,
+        'flatArrayChunksize': 262144, # ~6MB
+        'layout': 'lltid',
+        'destArraySchema': '<ndvi:int16, evi:int16, quality:uint16, red:int16, nir:int16, blue:int16, mir:int16, viewza:int16, sunza:int16, relaza:int16, cdoy:int16, reli:int16> [col_id=48000:72000,502,5,row_id=38400:62400,502,5,time_id=0:9200,1,0]'
+    },
+    'TRMM_3B43': {
+        'bands': [('precipitation', 'float'), ('relativeError', 'float'), ('gaugeRelativeWeighting', 'int8')],
+        'modis2scidbBands': '0,1,2',
+        'period': MONTHLY,
+        'startYear': 1998,
+        'resolution': 0,
+        'flatArrayChunksize': 262144, # ~2.25MB
+        'layout': 'lltid', # modis2scidb only writes lltid
+        'destArraySchema': ''
+    }
+}
+
+# Record layouts of the binary files: the index attributes preceding the band values
+layouts = {
+    'lltid': [('lltid', 'int64')], # col_id + row_id * 10^6 + time_id * 10^11
+    'dims': [('col_id', 'int64'), ('row_id', 'int64'), ('time_id', 'int64')]
+}
+
+# Other names used for the products
+aliases = {
+    'TRMM3B43': 'TRMM_3B43'
+}
+
+# Fire products loaded by fire2scidb-loader.py. The 1D arrays are staging arrays, reused by every load
+# and holding a single file; arrays for batches of files are derived from them. The encoder converts the
+# rasters: fire2scidb writes every cell, sparse only the cells with data (non-zero and not nodata)
+fireProducts = {
+  "hotspot_daily": {
+        "file_extension": "tif",
+        "start_date": "2014-01-01",
+        "create_1d_array_afl": "CREATE TEMP ARRAY hotspot_daily_1d_tmp <col:int16, row:int16, time_idx:int16, measure:uint8> [i=0:1410000,1410001,0]",
+        "tmp_array_1d": "hotspot_daily_1d_tmp",
+        "staging_cell_budget": 50000000, # cells loaded at once: consecutive files are batched up to it
+        "tmp_array_data_format": "'(int16, int16, int16, uint8)'",
+        "array_3d": "hotspot_daily",
+        "encoder": "sparse" # the hotspot counts are zero in most cells
+  },
+  "hotspot_monthly": {
+        "file_extension": "tif",
+        "start_date": "2000-01",
+        "create_1d_array_afl": "CREATE TEMP ARRAY hotspot_monthly_1d_tmp <col:int16, row:int16, time_idx:int16, measure:uint8> [i=0:1410000,1410001,0]",
+        "tmp_array_1d": "hotspot_monthly_1d_tmp",
+        "staging_cell_budget": 50000000, # cells loaded at once: consecutive files are batched up to it
+        "tmp_array_data_format": "'(int16, int16, int16, uint8)'",
+        "array_3d": "hotspot_monthly",
+        "encoder": "sparse" # the hotspot counts are zero in most cells
+  },
+  "hotspot_risk_daily": {
+        "file_extension": "env",
+        "start_date": "2015-12-01",
+        "create_1d_array_afl": "CREATE TEMP ARRAY hotspot_risk_daily_1d_tmp <col:int16, row:int16, time_idx:int16, measure:uint8> [i=0:29889971,29889972,0]",
+        "tmp_array_1d": "hotspot_risk_daily_1d_tmp",
+        "staging_cell_budget": 50000000, # cells loaded at once: consecutive files are batched up to it
+        "tmp_array_data_format": "'(int16, int16, int16, uint8)'",
+        "array_3d": "hotspot_risk_daily",
+        "encoder": "fire2scidb"
+  },
+  "hotspot_risk_monthly": {
+        "file_extension": "tif",
+        "start_date": "2015-01",
+        "create_1d_array_afl": "CREATE TEMP ARRAY hotspot_risk_monthly_1d_tmp <col:int16, row:int16, time_idx:int16, high_risk:uint8, medium_risk:uint8, low_risk:uint8> [i=0:34979999,3498000,0]",
+        "tmp_array_1d": "hotspot_risk_monthly_1d_tmp",
+        "staging_cell_budget": 50000000, # cells loaded at once: consecutive files are batched up to it
+        "tmp_array_data_format": "'(int16, int16, int16, uint8, uint8, uint8)'",
+        "array_3d": "hotspot_risk_monthly",
+        "encoder": "fire2scidb"
+  }
+}
+
+# iquery command creating the 1D array, kept for scripts running it directly
+for fp in fireProducts.values():
+    fp["create_1d_array_cmd"] = "iquery -naq \"" + fp["create_1d_array_afl"] + ";\""
+
+# Size (bytes) of SciDB's data types
+typeSize = {
+    'bool': 1,
+    'char': 1,
+    'int8': 1,
+    'uint8': 1,
+    'int16': 2,
+    'uint16': 2,
+    'int32': 4,
+    'uint32': 4,
+    'int64': 8,
+    'uint64': 8,
+    'float': 4,
+    'double': 8
+}
+
+# Dictionary used to convert from the symbolic representation of an HDF data type to an array (and NumPy) type code
+#TODO:Not yet tested to work with SciDB: CHAR, CHAR8, UCHAR8, INT8, UINT8, INT32, UINT32, FLOAT32, FLOAT64
+typeTab2 = {
+    'CHAR': 'c',
+    'CHAR8': 'b',
+    'UCHAR8': 'B',
+    'INT8': 'h',
+    'UINT8': 'H',
+    'INT16': 'h',
+    'UINT16': 'H',
+    'INT32': 'l',
+    'UINT32': 'L',
+    'FLOAT32': 'f',
+    'FLOAT64': 'd'
+}
+
+# HDF layouts already figured out, by dataset signature
+hdfLayouts = {}
+
+#********************************************************
+# UTIL
+#********************************************************
+def getProductName(name):
+    '''Returns the registry name of the given product name (or alias) and None if the product is unknown'''
+    res = None
+    if name in products:
+        res = name
+    elif name in aliases:
+        res = aliases[name]
+    return res
+
+def getProduct(name):
+    '''Returns the description of the given product. It raises an exception if the product is unknown'''
+    pname = getProductName(name)
+    if pname is None:
+        raise Exception("Unknown product: " + str(name))
+    return products[pname]
+
+def guessProduct(path):
+    '''Returns the registry name of the product found in the given path (e.g a file name) and None if there is no product in it'''
+    res = None
+    for name in list(products.keys()) + list(aliases.keys()):
+        if name in path:
+            res = getProductName(name)
+            break
+    return res
+
+def getLayout(name, layout = None):
+    '''Returns the record layout of the given product's binary files, unless a layout is given. It raises an exception if the layout is unknown'''
+    if layout is None or layout == '':
+        layout = getProduct(name)['layout']
+    if layout not in layouts:
+        raise Exception("Unknown layout: " + str(layout))
+    return layout
+
+def getFlatArraySchema(name, layout = None):
+    '''Returns the attributes of the 1D array holding the loaded data i.e 'lltid:int64, red:int16, nir:int16, quality:uint16' '''
+    attrs = []
+    for attname, atttype in layouts[getLayout(name, layout)] + getProduct(name)['bands']:
+        attrs.append(attname + ':' + atttype)
+    return ', '.join(attrs)
+
+def getRecordSize(name, layout = None):
+    '''Returns the size (bytes) of a record of the 1D array: the indexes plus the bands'''
+    res = 0
+    for attname, atttype in layouts[getLayout(name, layout)] + getProduct(name)['bands']:
+        res = res + typeSize[atttype]
+    return res
+
+def getFlatArrayChunksize(name, chunkBytes = 6 * pow(2, 20)):
+    '''Returns the chunk size of the 1D array holding the loaded data. Products without a tuned value get the largest power of 2 records whose band values fit in chunkBytes'''
+    product = getProduct(name)
+    if product['flatArrayChunksize'] > 0:
+        return product['flatArrayChunksize']
+    res = 1
+    valueSize = getRecordSize(name, 'lltid') - typeSize['int64']
+    while res * 2 * valueSize <= chunkBytes:
+        res = res * 2
+    return res
+
+def sizeFlatArrayChunk(name, nbytes, layout = None, instances = 1, instanceMemory = 0, minChunksize = 1024, memoryShare = 8):
+    '''Returns the chunk size (records) of the 1D array holding a load of nbytes. It starts from the product's chunk size and reduces it so small loads are spread over the instances and a chunk takes at most 1/memoryShare of the instance memory (MB), if given. The result is a power of 2 of at least minChunksize records, unless the memory is smaller'''
+    recordSize = getRecordSize(name, layout)
+    records = max(1, nbytes // recordSize)
+    perInstance = 1
+    while perInstance * max(1, instances) < records:
+        perInstance = perInstance * 2
+    res = max(minChunksize, min(getFlatArrayChunksize(name), perInstance))
+    if instanceMemory > 0:
+        while res > 1 and res * recordSize * memoryShare > instanceMemory * pow(2, 20):
+            res = res // 2
+    return res
+
+def getChunkGeometry(name):
+    '''Returns the dimensions of the given product's destination array as a dictionary of dimension name to its start, end (None if unbounded), chunk interval and overlap. It returns None if the product has no destination array schema'''
+    schema = getProduct(name)['destArraySchema']
+    if schema == '':
+        return None
+    res = {}
+    for dimname, start, end, interval, overlap in re.findall(r'(\w+)\s*=\s*(-?\d+)\s*:\s*(\*|-?\d+)\s*,\s*(\d+)\s*,\s*(\d+)', schema[schema.index('['):]):
+        res[dimname] = {
+            'start': int(start),
+            'end': None if end == '*' else int(end),
+            'interval': int(interval),
+            'overlap': int(overlap)
+        }
+    return res
+
+def getHdfLayout(ds, typeTab):
+    '''Returns the band names (in file order), the array type code of each band and the band resolutions of an HDF given its datasets (pyhdf's SD.datasets()) and the dictionary of symbolic names of the HDF data types. The results are cached by dataset signature'''
+    key = tuple(sorted([(k, tuple(ds[k][1]), ds[k][2], ds[k][3]) for k in ds.keys()]))
+    if key not in hdfLayouts:
+        banddatatype = {}
+        bandindex = {} # band index in the file
+        bandres = {} # band resolution e.g. (4800, 4800)
+        for k in ds.keys():
+            banddatatype[k] = typeTab2[typeTab[ds[k][2]]]
+            bandindex[ds[k][3]] = k
+            bandres[k] = ds[k][1]
+        hdfLayouts[key] = {
+            'bandnames': [bandindex[i] for i in sorted(bandindex.keys())],
+            'banddatatype': banddatatype,
+            'bandres': bandres
+        }
+    return hdfLayouts[key]
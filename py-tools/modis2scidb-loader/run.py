@@ -23,11 +23,20 @@
 
 import os
 import sys
+import time
 import fnmatch
-import subprocess as subp
 import datetime
 import argparse
 import logging
+import errno
+import shutil
+import multiprocessing
+from multiprocessing.pool import ThreadPool
+import productRegistry
+import hdfCatalog
+import convManifest
+import addHdfs2bin
+import loadMetrics
 
 
 
@@ -98,7 +107,7 @@ def checkHdfName(file, head, yyyydoyFrom, yyyydoyTo, hFrom, hTo, vFrom, vTo, col
     if len(fnparts) == 6:
         yyydoy = int(fnparts[1][1:])
         if yyydoy >= yyyydoyFrom and yyydoy <= yyyydoyTo:
-            hv = map(int, getHV(fnparts[2]))
+            hv = list(map(int, getHV(fnparts[2])))
             h = hv[0]
             v = hv[1]
             if h >= hFrom and h <= hTo and v >= vFrom and v <= vTo:
@@ -202,111 +211,284 @@ def buildTileName(h, v):
     res = si + sj
     return res
 
-def callAddHdfCommand(scriptFolder, hdf2binFolder, loadFolder, hdfPaths, binaryFilepath, lineMin, lineMax, sampMin, sampMax, period, log):
-    '''Calls the script that builds the binary files from HDFs'''
-    arg0 = "python " + scriptFolder + "addHdfs2bin.py --log INFO "
-    arg1 = ';'.join(hdfPaths)
-    arg2 = " " + binaryFilepath
-    arg3 = " --lineMin " + str(lineMin)
-    arg4 = " --lineMax " + str(lineMax)
-    arg5 = " --sampMin " + str(sampMin)
-    arg6 = " --sampMax " + str(sampMax)
-    arg7 = " --period " + str(period)
-    arg8 = " --log " + log
-    cmd = arg0 + arg3 + arg4 + arg5 + arg6 + arg7 + arg8 + ' "' + arg1 + '"' + arg2
-    logging.info("Calling addHdf: " + cmd)
-    subp.check_call(str(cmd), shell=True)
-    #Copy to the keep folder
-    tmpPts = binaryFilepath.split("/")
-    fn = tmpPts[len(tmpPts) - 1]
-    if os.path.isfile(binaryFilepath):
-        if os.path.isdir(hdf2binFolder):
-            cmd1 = "cp " + binaryFilepath + " " + buildPath(hdf2binFolder) + fn
-            logging.info("Copying binary file to KEEP folder..: " + cmd1)
-            subp.check_call(str(cmd1), shell=True)
-        #Move file to the loadFolder folder
-        cmd2 = "mv " + binaryFilepath + " " + loadFolder + os.path.basename(binaryFilepath)
-        logging.info("Moving binary file to LOAD folder..: " + cmd2)
-        subp.check_call(str(cmd2), shell=True)
+def reflinkFile(srcpath, dstpath):
+    '''Makes dstpath a copy-on-write clone (reflink) of srcpath. It returns FALSE when the file system does not support it'''
+    res = False
+    try:
+        import fcntl
+        FICLONE = 0x40049409 # Linux ioctl
+        src = open(srcpath, "rb")
+        dst = open(dstpath, "wb")
+        try:
+            fcntl.ioctl(dst.fileno(), FICLONE, src.fileno())
+            res = True
+        finally:
+            src.close()
+            dst.close()
+    except (ImportError, IOError, OSError):
+        res = False
+    if res == False and os.path.isfile(dstpath):
+        os.remove(dstpath)
+    return res
+
+def keepFile(srcpath, dstpath):
+    '''Places a copy of a file: a hard link or a reflink when both paths are on the same file system, a full copy otherwise'''
+    if os.path.isfile(dstpath):
+        os.remove(dstpath)
+    try:
+        os.link(srcpath, dstpath)
+    except OSError:
+        if reflinkFile(srcpath, dstpath) == False:
+            shutil.copyfile(srcpath, dstpath)
+
+def moveFile(srcpath, dstpath):
+    '''Moves a file. Across file systems, the file is copied to a temporal name next to dstpath and then renamed, so dstpath only shows up complete'''
+    try:
+        os.rename(srcpath, dstpath)
+    except OSError as e:
+        if e.errno != errno.EXDEV:
+            raise
+        tmppath = dstpath + '.tmp'
+        shutil.copyfile(srcpath, tmppath)
+        os.rename(tmppath, dstpath)
+        os.remove(srcpath)
+
+def buildGroupBinaryFilePath(basebfilepath, hRange, vRange, date, prod):
+    '''Returns a name for a binary file made of a group of tiles. The tile ranges are part of the name, so the groups of the same date do not collide'''
+    res = buildBinaryFilePath(basebfilepath, hRange, vRange, date, prod)
+    res = res[:-len('.sdbbin')] + '_h%02d-%02dv%02d-%02d.sdbbin' % (min(hRange), max(hRange), min(vRange), max(vRange))
+    return res
+
+def buildTileGroups(hRange, vRange, tilesPerJob):
+    '''Splits the tile ranges in groups (pairs of h and v ranges) of about tilesPerJob tiles. 0 means a single group'''
+    hRange = list(hRange)
+    vRange = list(vRange)
+    if tilesPerJob < 1 or tilesPerJob >= len(hRange) * len(vRange):
+        return [(hRange, vRange)]
+    if tilesPerJob >= len(vRange):
+        hstep = tilesPerJob // len(vRange)
+        vstep = len(vRange)
     else:
-        logging.warning("File not found: " + binaryFilepath)
-        
-    
-def loadhdfCHRONOS(modisPath, basebfilepath, dates, hRange, vRange, hdf2binFolder, loadFolder, scriptFolder, lineMin, lineMax, sampMin, sampMax, period, prod, log):
-    '''Builds the file paths and calls the load script. The paths match the storage folder schema .../modisProductPath/year/HDFs'''
-    hdflist = []
+        hstep = 1
+        vstep = tilesPerJob
+    res = []
+    for i in range(0, len(hRange), hstep):
+        for j in range(0, len(vRange), vstep):
+            res.append((hRange[i:i + hstep], vRange[j:j + vstep]))
+    return res
+
+def listHdfsCHRONOS(modisPath, date, hRange, vRange, catalog = None):
+    '''Returns the paths to the HDFs of a date and tile ranges or None if there is no folder for them. The paths match the storage folder schema .../modisProductPath/year/HDFs. When a catalog is given, the HDFs are found there instead of listing the folders'''
     #head = 'MOD09Q1'
     #col = '005'
     ext = 'hdf'
     splitStr = '.'
     nParts = 6
     tilelist = buildTileLits(hRange, vRange)
-    
+    hdfPaths = []
+    hdfFiles = []
+    hdfFilesExt = []
+    hdfFilesExtDoy = []
+    #Builds the basepath where to find the HDFs
+    d = doy2date(date)
+    adoyList = buildAdoyList([date])
+    yyyy = d[0]
+    #basePath = modisPath + str(yyyy) + '/250m/'
+    basePath = modisPath + str(yyyy) + '/'
+    if not os.path.isdir(basePath):
+        logging.warning("Not a directory: " + basePath)
+        return None
+    #Get the path to the HDFs
+    if catalog is not None:
+        hdfPaths = hdfCatalog.findHdfs(catalog, adoyList[0], hRange, vRange, folder = basePath)
+    else:
+        dirs = os.listdir( basePath )
+        for f in dirs:
+            if checkHdfName(f, splitStr, nParts, ext):#Filter by number of parts and file extension
+                hdfFilesExt.append(f)
+        for f in hdfFilesExt:
+            if f.split(".")[1] in adoyList:#Filter by DOY
+                hdfFilesExtDoy.append(f)
+        for f in hdfFilesExtDoy:
+            if f.split(".")[2] in tilelist:#Filter by TILE
+                hdfFiles.append(f)
+        #Add the path to each file
+        for f in hdfFiles:
+            hdfPaths.append(basePath + f)
+    return hdfPaths
+
+def listHdfsModisPackage(modisPath, date, hRange, vRange, catalog = None):
+    '''Returns the paths to the HDFs of a date and tile ranges or None if there is no folder for them. The paths match the storage folder schema of R' MODIS package. When a catalog is given, the HDFs are found there instead of listing the folders'''
+    hdfPaths = []
+    #Builds the basepath where to find the HDFs
+    d = doy2date(date)
+    yyyy = d[0]
+    mm = d[1]
+    dd = d[2]
+    if len(str(d[1])) == 1:
+        mm = '0'  +str(d[1])
+    if len(str(d[2])) == 1:
+        dd = '0' + str(d[2])
+    basePath = modisPath + str(yyyy) + '.'  + str(mm) + '.'  + str(dd) + '/'
+    if not os.path.isdir(basePath):
+        return None
+    #Get the path to the HDFs
+    if catalog is not None:
+        hdfPaths = hdfCatalog.findHdfs(catalog, 'A' + str(date), hRange, vRange, folder = basePath)
+    else:
+        for i in hRange:
+            for j in vRange:
+                tile = '*' + buildTileName(i, j) + '*'
+                for file in os.listdir(basePath):
+                    if fnmatch.fnmatch(file, tile):
+                        if fnmatch.fnmatch(file, '*' + str(date) + '*'):
+                            hdfPaths.append(basePath + file)
+    return hdfPaths
+
+def buildJobs(modisPath, modisFolderSchema, basebfilepath, dates, hRange, vRange, tilesPerJob, hdf2binFolder, loadFolder, lineMin, lineMax, sampMin, sampMax, prod, catalog = None, manifestPath = '', layout = None, chunkOrder = False, metricsPath = ''):
+    '''Splits a backfill in (date, tile group) jobs. Each job builds its own binary file'''
+    res = []
+    product = productRegistry.getProduct(prod)
+    geometry = None
+    if chunkOrder:
+        geometry = productRegistry.getChunkGeometry(prod)
+    tileGroups = buildTileGroups(hRange, vRange, tilesPerJob)
     for date in dates:
-        hdfPaths = []
-        hdfFiles = []
-        hdfFilesExt = []
-        hdfFilesExtDoy = []
-        #Builds the basepath where to find the HDFs
-        d = doy2date(date)
-        adoyList = buildAdoyList([date])
-        yyyy = d[0]
-        #basePath = modisPath + str(yyyy) + '/250m/'
-        basePath = modisPath + str(yyyy) + '/'
-        if os.path.isdir(basePath):
-            dirs = os.listdir( basePath )
-            #Builds the name of the binary file
-            binaryFilepath = buildBinaryFilePath(basebfilepath, hRange, vRange, date, prod)
-            #Get the path to the HDFs
-            for f in dirs:
-                if checkHdfName(f, splitStr, nParts, ext):#Filter by number of parts and file extension
-                    hdfFilesExt.append(f)
-            for f in hdfFilesExt:
-                if f.split(".")[1] in adoyList:#Filter by DOY
-                    hdfFilesExtDoy.append(f)
-            for f in hdfFilesExtDoy:
-                if f.split(".")[2] in tilelist:#Filter by TILE
-                    hdfFiles.append(f)
-            #Add the path to each file
-            for f in hdfFiles:
-                hdfPaths.append(basePath + f)
-            #Command
-            if len(hdfPaths) > 0:
-                callAddHdfCommand(scriptFolder, hdf2binFolder, loadFolder, hdfPaths, binaryFilepath, lineMin, lineMax, sampMin, sampMax, period, log)
+        for hGroup, vGroup in tileGroups:
+            if modisFolderSchema == 'R-MODIS':
+                hdfPaths = listHdfsModisPackage(modisPath, date, hGroup, vGroup, catalog)
             else:
+                hdfPaths = listHdfsCHRONOS(modisPath, date, hGroup, vGroup, catalog)
+            if hdfPaths is None:
+                continue
+            if len(hdfPaths) == 0:
                 logging.warning("No HDF file match the given DOY and TILE")
+                continue
+            #Builds the name of the binary file
+            if len(tileGroups) > 1:
+                binaryFilepath = buildGroupBinaryFilePath(basebfilepath, hGroup, vGroup, date, prod)
+            else:
+                binaryFilepath = buildBinaryFilePath(basebfilepath, hGroup, vGroup, date, prod)
+            res.append({
+                'date': date,
+                'hdfPaths': hdfPaths,
+                'binaryFilepath': binaryFilepath,
+                'hdf2binFolder': hdf2binFolder,
+                'loadFolder': loadFolder,
+                'period': product['period'],
+                'startyear': product['startYear'],
+                'window': (lineMin, lineMax, sampMin, sampMax),
+                'manifest': manifestPath,
+                'layout': productRegistry.getLayout(prod, layout),
+                'geometry': geometry,
+                'metrics': metricsPath
+            })
+    return res
+
+def skipDoneJobs(jobs, manifestPath):
+    '''Returns the jobs whose binary file was not yet built and placed according to the conversion manifest'''
+    res = []
+    manifest = convManifest.openManifest(manifestPath)
+    for job in jobs:
+        lineMin, lineMax, sampMin, sampMax = job['window']
+        window = convManifest.buildWindow(lineMin, lineMax, sampMin, sampMax, job['layout'])
+        if convManifest.areDone(manifest, job['hdfPaths'], window, job['binaryFilepath']) and not os.path.isfile(job['binaryFilepath']):
+            logging.info("Job already done: " + job['binaryFilepath'])
         else:
-            logging.warning("Not a directory: " + basePath)
+            res.append(job)
+    manifest.close()
+    return res
 
+def convertJob(job):
+    '''Builds the binary file of a job from its HDFs and returns the job, along with the seconds it took'''
+    t0 = time.time()
+    lineMin, lineMax, sampMin, sampMax = job['window']
+    manifest = None
+    if job['manifest'] != '':
+        manifest = convManifest.openManifest(job['manifest'])
+    metrics = None
+    if job['metrics'] != '':
+        metrics = loadMetrics.openMetrics(job['metrics'], '', 'run')
+    logging.info("Adding HDFs: " + ';'.join(job['hdfPaths']) + " to " + job['binaryFilepath'])
+    addHdfs2bin.addHdfs2bin(job['hdfPaths'], job['binaryFilepath'], job['period'], job['startyear'], lineMin, lineMax, sampMin, sampMax, 64 * pow(2, 20), 1, 1, manifest, job['layout'], job['geometry'], metrics = metrics)
+    if manifest is not None:
+        manifest.close()
+    job['convert_seconds'] = time.time() - t0
+    return job
 
-def loadhdfModisPackage(modisPath, basebfilepath, dates, hRange, vRange, hdf2binFolder, loadFolder, scriptFolder, lineMin, lineMax, sampMin, sampMax, period, prod, log):
-    '''Builds the file paths and calls the load script. The paths match the storage folder schema of R' MODIS package'''
-    for date in dates:
-        hdfPaths = []
-        #Builds the basepath where to find the HDFs
-        d = doy2date(date)
-        yyyy = d[0]
-        mm = d[1]
-        dd = d[2]
-        if len(str(d[1])) == 1:
-            mm = '0'  +str(d[1])
-        if len(str(d[2])) == 1:
-            dd = '0' + str(d[2])
-        basePath = modisPath + str(yyyy) + '.'  + str(mm) + '.'  + str(dd) + '/'
-        if os.path.isdir(basePath):
-            #Builds the name of the binary file
-            binaryFilepath = buildBinaryFilePath(basebfilepath, hRange, vRange, date, prod)
-            #Get the path to the HDFs
-            for i in hRange:
-                for j in vRange:
-                    tile = '*' + buildTileName(i, j) + '*'
-                    for file in os.listdir(basePath):
-                        if fnmatch.fnmatch(file, tile):
-                            if fnmatch.fnmatch(file, '*' + str(date) + '*'):
-                                hdfPaths.append(basePath + file)
-            #Command
-            callAddHdfCommand(scriptFolder, hdf2binFolder, loadFolder, hdfPaths, binaryFilepath, lineMin, lineMax, sampMin, sampMax, period, log)
+def placeBinaryFile(job, metrics = None):
+    '''Places the binary file of a job in the keep and load folders. The job is recorded in the metrics (see loadMetrics.py)'''
+    t0 = time.time()
+    nbytes = 0
+    binaryFilepath = job['binaryFilepath']
+    hdf2binFolder = job['hdf2binFolder']
+    loadFolder = job['loadFolder']
+    fn = os.path.basename(binaryFilepath)
+    if os.path.isfile(binaryFilepath):
+        nbytes = os.path.getsize(binaryFilepath)
+        #Keep a copy in the keep folder
+        if os.path.isdir(hdf2binFolder):
+            logging.info("Keeping binary file in KEEP folder..: " + buildPath(hdf2binFolder) + fn)
+            keepFile(binaryFilepath, buildPath(hdf2binFolder) + fn)
+        #Move file to the loadFolder folder
+        logging.info("Moving binary file to LOAD folder..: " + loadFolder + fn)
+        moveFile(binaryFilepath, loadFolder + fn)
+    else:
+        logging.warning("File not found: " + binaryFilepath)
+    loadMetrics.record(metrics, 'job', {'output': binaryFilepath, 'hdfs': len(job['hdfPaths']), 'bytes': nbytes, 'convert_seconds': job.get('convert_seconds', 0), 'place_seconds': time.time() - t0})
+    loadMetrics.writeProm(metrics)
+    return job
+
+def logProgress(done, total, t0):
+    '''Logs the number of finished jobs and the estimated time to finish the remaining ones'''
+    elapsed = datetime.datetime.now() - t0
+    eta = datetime.timedelta(seconds = int(elapsed.total_seconds() / done * (total - done)))
+    logging.info("Progress: " + str(done) + "/" + str(total) + " jobs (" + str(100 * done // total) + "%) in " + str(elapsed) + ". ETA: " + str(eta))
+
+def dropUnplaced(jobs):
+    '''Removes the binary files left in the temporal folder by the jobs whose conversion or placement failed, or which were not placed because another job failed. Files of jobs with a conversion manifest are kept: the next run finds them unplaced and places them, after dropping the bytes of unfinished conversions'''
+    for job in jobs:
+        binaryFilepath = job['binaryFilepath']
+        if os.path.isfile(binaryFilepath):
+            if job['manifest'] != '':
+                logging.warning("Binary file not placed, kept for the next run: " + binaryFilepath)
+            else:
+                logging.warning("Removing binary file not placed: " + binaryFilepath)
+                os.remove(binaryFilepath)
 
+def runJobs(jobs, cpuJobs, ioJobs, metrics = None):
+    '''Converts the jobs using a pool of cpuJobs processes while a pool of ioJobs threads places the resulting binary files. On errors, the binary files not placed are dropped (see dropUnplaced)'''
+    t0 = datetime.datetime.now()
+    cpupool = None
+    iopool = ThreadPool(ioJobs)
+    placements = []
+    finished = False
+    try:
+        if cpuJobs > 1:
+            cpupool = multiprocessing.Pool(cpuJobs)
+            converted = cpupool.imap_unordered(convertJob, jobs)
+        else:
+            converted = (convertJob(job) for job in jobs)
+        done = 0
+        for job in converted:
+            placements.append(iopool.apply_async(placeBinaryFile, (job, metrics)))
+            done += 1
+            logProgress(done, len(jobs), t0)
+        finished = True
+    finally:
+        if cpupool is not None:
+            #On errors, the jobs not converted yet are dropped
+            if finished:
+                cpupool.close()
+            else:
+                cpupool.terminate()
+            cpupool.join()
+        iopool.close()
+        iopool.join()
+        dropUnplaced(jobs)
+    for p in placements:
+        p.get() # Raises the placement errors, if any
+            
             
 #********************************************************
 #WORKER
@@ -327,10 +509,19 @@ def main(argv):
     parser.add_argument("-yf", "--yearFrom", help = "Starting year of data. Default = 2000", type = int, default = 2000)
     parser.add_argument("-yt", "--yearTo", help = "End year of data. Default = 2013", type = int, default = 2013)
     parser.add_argument("-h2b", "--hdf2binFolder", help = "Folder to keep a copy of the binary files", default = '')
-    parser.add_argument("-lmin", "--lineMin", help = "Minimun image row to load. Use it only when an image subset is needed. Default is 0", default = 0)
-    parser.add_argument("-lmax", "--lineMax", help = "Maximum image row to load. Use it only when an image subset is needed. Default is 4799", default = 4799)
-    parser.add_argument("-smin", "--sampMin", help = "Minimum image column to load. Use it only when an image subset is needed. Default is 0", default = 0)
-    parser.add_argument("-smax", "--sampMax", help = "Maximum image column to load. Use it only when an image subset is needed. Default is 4799 ", default = 4799)
+    parser.add_argument("-lmin", "--lineMin", help = "Minimun image row to load. Use it only when an image subset is needed. Default is 0", type = int, default = 0)
+    parser.add_argument("-lmax", "--lineMax", help = "Maximum image row to load. Use it only when an image subset is needed. Default is 4799", type = int, default = 4799)
+    parser.add_argument("-smin", "--sampMin", help = "Minimum image column to load. Use it only when an image subset is needed. Default is 0", type = int, default = 0)
+    parser.add_argument("-smax", "--sampMax", help = "Maximum image column to load. Use it only when an image subset is needed. Default is 4799 ", type = int, default = 4799)
+    parser.add_argument("-j", "--jobs", help = "Number of processes converting HDFs. Default = 1", type = int, default = 1)
+    parser.add_argument("--ioJobs", help = "Number of threads placing the binary files in the keep and load folders. Default = 2", type = int, default = 2)
+    parser.add_argument("--tilesPerJob", help = "Number of tiles of each job (binary file). Default = 0 (all the tiles of a date)", type = int, default = 0)
+    parser.add_argument("--catalog", help = "Catalog (SQLite file) of the HDFs. It is refreshed before use. See hdfCatalog.py", default = '')
+    parser.add_argument("--layout", help = "Record layout of the binary files: lltid or dims. See addHdfs2bin.py. Default = the product's", choices = ['lltid', 'dims'], default = None)
+    parser.add_argument("--chunkOrder", help = "Order the records of the binary files chunk by chunk using the destination array's chunks of the product", action = "store_true")
+    parser.add_argument("--manifest", help = "Conversion manifest (SQLite file). Reruns skip the jobs already converted and placed. See convManifest.py", default = '')
+    parser.add_argument("--metrics", help = "File (JSON lines) the metrics of each HDF conversion and job are appended to. See loadMetrics.py", default = '')
+    parser.add_argument("--metricsProm", help = "File the job totals are written to, in Prometheus' textfile format", default = '')
     parser.add_argument("--log", help = "Log level. Default = WARNING", default = 'WARNING')
     #Get paramters
     args = parser.parse_args()
@@ -338,8 +529,6 @@ def main(argv):
     modisFolderSchema = args.modisFolderSchema
     basebfilepath = args.basebfilepath
     loadFolder = args.loadFolder
-    scriptFolder = buildPath(sys.path[0])
-    # args.scriptFolder
     hMin = args.hMin
     hMax = args.hMax
     vMin = args.vMin
@@ -355,22 +544,26 @@ def main(argv):
     sampMin = args.sampMin
     sampMax = args.sampMax
     log = args.log
+    catalogPath = args.catalog
+    manifestPath = args.manifest
+    layout = args.layout
+    chunkOrder = args.chunkOrder
+    cpuJobs = args.jobs
+    ioJobs = args.ioJobs
+    tilesPerJob = args.tilesPerJob
     ####################################################
     # CONFIG
     ####################################################
-    modisprod = ['MOD09Q1', 'MOD13Q1']
-    temporalResolution = {
-        'MOD09Q1': 8,
-        'MOD13Q1': 16
-    }
     if prod == 'default':
-        for mp in modisprod:
-            if mp in modisPath:
-                prod = mp
-    if prod in modisprod == False:
+        prod = productRegistry.guessProduct(modisPath)
+    if productRegistry.getProductName(prod) is None:
         logging.exception("Unknown MODIS product: The MODIS product could not be figured out.")
         raise Exception("Unknown MODIS product")
-    period = temporalResolution[prod]
+    prod = productRegistry.getProductName(prod)
+    period = productRegistry.getProduct(prod)['period']
+    if period < 1:
+        logging.exception("Unknown MODIS product: Not a MODIS product.")
+        raise Exception("Not a MODIS product")
     dates = buildDoy(yearFrom, yearTo, period)
     #if yearFrom == 2000:
     #    dates = buildDoy(yearFrom, yearTo, period)
@@ -389,10 +582,17 @@ def main(argv):
     #loadFolder = '/home/scidb/toLoad/'
     #modisPath = '/home/scidb/MODIS_ARC/MODIS/MOD09Q1.005/' # '/dados1/modisOriginal/MOD13Q1/' # '/mnt/lun0/MODIS_ARC/MODIS/MOD09Q1.005/'
     #dates = buildDoy(2000, 2001, period)
-    if modisFolderSchema == 'R-MODIS':
-        loadhdfModisPackage(modisPath, basebfilepath, dates, hRange, vRange, hdf2binFolder, loadFolder, scriptFolder, lineMin, lineMax, sampMin, sampMax, period, prod, log)
-    elif modisFolderSchema == 'MP-YEAR':
-        loadhdfCHRONOS(modisPath, basebfilepath, dates, hRange, vRange, hdf2binFolder, loadFolder, scriptFolder, lineMin, lineMax, sampMin, sampMax, period, prod, log)
+    catalog = None
+    if catalogPath != '':
+        catalog = hdfCatalog.openCatalog(catalogPath)
+        hdfCatalog.refreshCatalog(catalog, modisPath)
+    jobs = buildJobs(modisPath, modisFolderSchema, basebfilepath, dates, hRange, vRange, tilesPerJob, hdf2binFolder, loadFolder, lineMin, lineMax, sampMin, sampMax, prod, catalog, manifestPath, layout, chunkOrder, os.path.abspath(args.metrics) if args.metrics != '' else '')
+    if manifestPath != '':
+        jobs = skipDoneJobs(jobs, manifestPath)
+    logging.info("Number of jobs: " + str(len(jobs)))
+    metrics = loadMetrics.openMetrics(args.metrics, args.metricsProm, 'run')
+    runJobs(jobs, cpuJobs, ioJobs, metrics)
+    loadMetrics.writeProm(metrics)
     #Use HSD folder structure of R MODIS PACKAGE. Each HDF to a binary file
     #loadhdfGISOBAMAsingle(modisPath, basebfilepath, dates, hRange, vRange, hdf2binFolder, loadFolder, scriptFolder, lineMin, lineMax, sampMin, sampMax, period)
     t1 = datetime.datetime.now()    
@@ -0,0 +1,265 @@
+#
+#   Copyright (C) 2014 National Institute For Space Research (INPE) - Brazil.
+#
+#  This file is part of SciETL.
+#
+#  SciETL is free software: you can
+#  redistribute it and/or modify it under the terms of the
+#  GNU Lesser General Public License as published by
+#  the Free Software Foundation, either version 3 of the License,
+#  or (at your option) any later version.
+#
+#  SciETL is distributed in the hope that
+#  it will be useful, but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+#  GNU Lesser General Public License for more details.
+#
+#  You should have received a copy of the GNU Lesser General Public License
+#  along with SciETL. See LICENSE. If not, write to
+#  e-sensing team at <esensning-team@dpi.inpe.br>.
+#
+# Author: Alber Sanchez
+#
+#
+# Runs SciDB query sequences over a pool of sessions. Targets are either
+# SciDB's shim (comma separated URLs, i.e. one per instance; the sessions are
+# kept open and reused) or the path to iquery (one process per sequence).
+# Errors are raised as QueryError and the time of each query is returned.
+# See fakeShim.py for a stand-in server.
+#
+
+import sys
+import time
+import argparse
+import datetime
+import logging
+import threading
+import subprocess as subp
+try:
+    import Queue as queue
+    from urllib import urlencode
+    from urllib2 import urlopen, HTTPError, URLError
+except ImportError:
+    import queue
+    from urllib.parse import urlencode
+    from urllib.request import urlopen
+    from urllib.error import HTTPError, URLError
+
+class QueryError(Exception):
+    '''Error running a query. It keeps the query, SciDB's message and the seconds spent'''
+    def __init__(self, query, message, seconds = 0):
+        Exception.__init__(self, message + " (" + query + ")")
+        self.query = query
+        self.message = message
+        self.seconds = seconds
+
+#********************************************************
+# UTIL
+#********************************************************
+def openPool(target, size = 1, timeout = 3600):
+    '''Returns a pool of sessions to the given target: the path to iquery or a comma separated list of shim URLs (i.e. http://localhost:8080). Up to size sessions are open to each URL'''
+    pool = {
+        'backend': 'iquery',
+        'targets': [target],
+        'size': size,
+        'timeout': timeout,
+        'free': queue.Queue(),
+        'lock': threading.Lock(),
+        'open': 0, # Sessions open
+        'sessions': [] # Open sessions, by creation order
+    }
+    if target.startswith('http://') or target.startswith('https://'):
+        pool['backend'] = 'shim'
+        pool['targets'] = [t.strip().rstrip('/') for t in target.split(',') if t.strip() != '']
+    return pool
+
+def shimRequest(url, operation, params, timeout):
+    '''Sends a request to SciDB's shim and returns the response text'''
+    try:
+        resp = urlopen(url + '/' + operation + '?' + urlencode(params), timeout = timeout)
+        res = resp.read().decode()
+        resp.close()
+    except HTTPError as e:
+        raise QueryError(params.get('query', operation), e.read().decode().strip() or str(e))
+    except URLError as e:
+        raise QueryError(params.get('query', operation), "Connection error: " + str(e.reason))
+    return res
+
+def getSession(pool, wait = 1):
+    '''Takes a free session from the pool, opening a new one while there are less than size sessions per target. It waits for a free session otherwise, checking again whenever a session is closed (see closeSession) or after wait seconds, as the size may grow'''
+    n = -1
+    while n < 0:
+        try:
+            session = pool['free'].get_nowait()
+        except queue.Empty:
+            session = None
+        if session is not None:
+            return session
+        with pool['lock']:
+            n = pool['open']
+            if n < pool['size'] * len(pool['targets']):
+                pool['open'] = n + 1
+            else:
+                n = -1
+        if n < 0:
+            try:
+                session = pool['free'].get(timeout = wait)
+            except queue.Empty:
+                session = None
+            if session is not None:
+                return session
+    session = {'target': pool['targets'][n % len(pool['targets'])], 'id': None}
+    if pool['backend'] == 'shim':
+        try:
+            session['id'] = shimRequest(session['target'], 'new_session', {}, pool['timeout']).strip()
+        except QueryError:
+            with pool['lock']:
+                pool['open'] = pool['open'] - 1
+            raise
+    with pool['lock']:
+        pool['sessions'].append(session)
+    logging.debug("New SciDB session: " + str(session))
+    return session
+
+def releaseSession(pool, session, broken = False):
+    '''Gives a session back to the pool. Broken sessions are closed'''
+    if broken:
+        closeSession(pool, session)
+    else:
+        pool['free'].put(session)
+
+def closeSession(pool, session):
+    '''Closes a session and removes it from the pool'''
+    with pool['lock']:
+        if session not in pool['sessions']:
+            return
+        pool['sessions'].remove(session)
+        pool['open'] = pool['open'] - 1
+    #Wakes up a getSession waiting for a free session, as a new one can be opened
+    pool['free'].put(None)
+    if session['id'] is not None:
+        try:
+            shimRequest(session['target'], 'release_session', {'id': session['id']}, pool['timeout'])
+        except QueryError as e:
+            logging.warning("Could not release the SciDB session: " + str(e))
+
+def closePool(pool):
+    '''Closes the sessions of the pool'''
+    for session in list(pool['sessions']):
+        closeSession(pool, session)
+
+def runIquery(iquery, queries):
+    '''Runs the queries, in order, using one iquery process and returns the seconds spent'''
+    t0 = time.time()
+    cmd = [iquery, "-naq", "; ".join(queries) + ";"]
+    proc = subp.Popen(cmd, stdout = subp.PIPE, stderr = subp.PIPE)
+    out, err = proc.communicate()
+    seconds = time.time() - t0
+    if proc.returncode != 0:
+        raise QueryError("; ".join(queries), (err or out).decode().strip() or "iquery exit code " + str(proc.returncode), seconds)
+    return seconds
+
+def runQueries(pool, queries):
+    '''Runs the (AFL) queries, in order, over one session of the pool. It returns a list of dictionaries with the query and the seconds it took. It raises a QueryError if any query fails'''
+    res = []
+    session = getSession(pool)
+    broken = False
+    try:
+        if pool['backend'] == 'iquery':
+            res.append({'query': "; ".join(queries), 'seconds': runIquery(session['target'], queries)})
+        else:
+            for query in queries:
+                t0 = time.time()
+                try:
+                    shimRequest(session['target'], 'execute_query', {'id': session['id'], 'query': query, 'release': 0}, pool['timeout'])
+                except QueryError as e:
+                    e.seconds = time.time() - t0
+                    broken = e.message.startswith("Connection error")
+                    raise
+                res.append({'query': query, 'seconds': time.time() - t0})
+    finally:
+        releaseSession(pool, session, broken)
+    for r in res:
+        logging.debug("Query done in " + str(round(r['seconds'], 3)) + "s: " + r['query'])
+    return res
+
+def readQuery(pool, query):
+    '''Runs an (AFL) query over one session of the pool and returns its result as a list of rows, each a list of the attribute values (text). It raises a QueryError if the query fails'''
+    session = getSession(pool)
+    broken = False
+    t0 = time.time()
+    try:
+        if pool['backend'] == 'iquery':
+            proc = subp.Popen([session['target'], "-otsv", "-aq", query + ";"], stdout = subp.PIPE, stderr = subp.PIPE)
+            out, err = proc.communicate()
+            if proc.returncode != 0:
+                raise QueryError(query, (err or out).decode().strip() or "iquery exit code " + str(proc.returncode), time.time() - t0)
+            out = out.decode()
+        else:
+            try:
+                shimRequest(session['target'], 'execute_query', {'id': session['id'], 'query': query, 'save': 'tsv', 'release': 0}, pool['timeout'])
+                out = shimRequest(session['target'], 'read_lines', {'id': session['id'], 'n': 0}, pool['timeout'])
+            except QueryError as e:
+                e.seconds = time.time() - t0
+                broken = e.message.startswith("Connection error")
+                raise
+    finally:
+        releaseSession(pool, session, broken)
+    logging.debug("Query read in " + str(round(time.time() - t0, 3)) + "s: " + query)
+    return [line.split('\t') for line in out.splitlines() if line != '']
+
+
+#********************************************************
+#WORKER
+#********************************************************
+def main(argv):
+    t0 = datetime.datetime.now()
+    parser = argparse.ArgumentParser(description = "Runs AFL queries on SciDB and reports their timings. Useful for benchmarking the load path against fakeShim.py")
+    parser.add_argument("target", help = "Path to iquery or comma separated shim URLs i.e. http://localhost:8080")
+    parser.add_argument("query", help = "AFL queries to run in order", nargs = '+')
+    parser.add_argument("-r", "--repeat", help = "Number of times the queries are run. Default = 1", type = int, default = 1)
+    parser.add_argument("-s", "--sessions", help = "Sessions per target running the repetitions concurrently. Default = 1", type = int, default = 1)
+    parser.add_argument("--log", help = "Log level. Default = WARNING", default = 'WARNING')
+    #Get paramters
+    args = parser.parse_args()
+    ####################################################
+    # CONFIG
+    ####################################################
+    numeric_loglevel = getattr(logging, args.log.upper(), None)
+    if not isinstance(numeric_loglevel, int):
+        raise ValueError('Invalid log level: %s' % args.log)
+    logging.basicConfig(filename = 'log_scidbClient.log', level = numeric_loglevel, format = '%(asctime)s %(levelname)s: %(message)s')
+    logging.info("scidbClient: " + str(args))
+    ####################################################
+    # SCRIPT
+    ####################################################
+    pool = openPool(args.target, args.sessions)
+    timings = []
+    errors = []
+    def worker(n):
+        for i in range(n):
+            try:
+                timings.extend(runQueries(pool, args.query))
+            except QueryError as e:
+                errors.append(e)
+    nthreads = args.sessions * len(pool['targets'])
+    threads = [threading.Thread(target = worker, args = (args.repeat // nthreads + (1 if i < args.repeat % nthreads else 0),)) for i in range(nthreads)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    closePool(pool)
+    seconds = [t['seconds'] for t in timings]
+    if len(seconds) > 0:
+        print("queries: " + str(len(seconds)) + " mean: " + str(round(sum(seconds) / len(seconds), 4)) + "s max: " + str(round(max(seconds), 4)) + "s")
+    for e in errors:
+        print("error: " + str(e))
+    t1 = datetime.datetime.now()
+    print("total: " + str(t1 - t0))
+    logging.info("Finished in " + str(t1 - t0))
+    if len(errors) > 0:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+   main(sys.argv[1:])